@@ -12,23 +12,15 @@ os.environ['VERCEL'] = '1'
 
 # Import app after path is set
 try:
-    from app import app, db
+    from app import app, kiem_tra_schema
     
-    # CRITICAL: Initialize database BEFORE any requests
-    # This must happen at import time for Vercel
+    # CRITICAL: Check database schema BEFORE any requests
+    # Chỉ 1 câu query đọc schema_version, không chạy DDL lúc cold start: chạy
+    # `flask --app app migrate` khi deploy (đặt AUTO_MIGRATE=1 để tự migrate, có khóa advisory)
     try:
         with app.app_context():
-            # Force create all tables
-            db.create_all()
-            # Verify tables were created
-            from sqlalchemy import inspect
-            inspector = inspect(db.engine)
-            tables = inspector.get_table_names()
-            print(f"Database initialized. Tables: {tables}")
-            if 'cayxanh' not in tables:
-                print("WARNING: cayxanh table not found after create_all()")
-                # Try to create again
-                db.create_all()
+            tu_dong_migrate = os.environ.get('AUTO_MIGRATE', '0') == '1'
+            kiem_tra_schema(tu_dong_migrate=tu_dong_migrate)
     except Exception as db_error:
         # Log error but continue - might be permission issue
         error_msg = f"Database initialization error: {str(db_error)}"
@@ -1,18 +1,33 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
+import click
 from datetime import datetime, date
-import pandas as pd
 import os
+import hashlib
+import re
+import threading
+import time
+import unicodedata
 from urllib.parse import quote_plus, urlparse, urlunparse, unquote
-from sqlalchemy import func, extract
+from sqlalchemy import func, event
 from sqlalchemy.engine.url import URL
-from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
-from werkzeug.exceptions import RequestEntityTooLarge
-import requests
+from werkzeug.exceptions import NotFound, RequestEntityTooLarge
+from cache import CacheStore, LRUCache
+from prefix_index import PrefixIndex
+from excel_import import (
+    chuan_hoa_du_lieu_excel, doc_dong_file, doc_file_excel, du_cot_bat_buoc, tao_dataframe,
+    tim_cot_excel, tim_dong_tieu_de, uoc_tinh_so_dong,
+)
+from image_variants import doc_bien_the_anh, ho_tro_bien_the, tao_bien_the
+from storage import LocalStorage, StorageQueue, VercelBlobStorage, is_blob_url
 
 # Load environment variables from .env file
-load_dotenv()
+# (chỉ import python-dotenv khi có file .env, trên Vercel biến môi trường lấy từ dashboard)
+ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+if os.path.exists(ENV_FILE):
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'kimbiofarm-secret-key-2025'
@@ -46,12 +61,6 @@ def allowed_file(filename):
     """Kiểm tra file có phải là ảnh hợp lệ không"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def is_blob_url(url):
-    """Kiểm tra xem URL có phải là Vercel Blob URL không"""
-    if not url:
-        return False
-    return 'blob.vercel-storage.com' in url
-
 def get_blob_url_from_path(path):
     """Lấy Blob URL từ path trong database (hỗ trợ cả Blob URL và local path)"""
     if not path:
@@ -61,49 +70,197 @@ def get_blob_url_from_path(path):
     # Nếu là local path, trả về None để dùng local serving
     return None
 
-def upload_to_vercel_blob(file_content, filename, content_type, token):
-    """Upload file to Vercel Blob storage using REST API"""
-    try:
-        url = "https://blob.vercel-storage.com/put"
-        headers = {
-            "Authorization": f"Bearer {token}"
-        }
-        data = {
-            "pathname": f"images/{filename}",
-            "addRandomSuffix": "false"
-        }
-        files = {
-            "file": (filename, file_content, content_type)
-        }
-        
-        response = requests.post(url, headers=headers, data=data, files=files, timeout=30)
-        response.raise_for_status()
-        
-        result = response.json()
-        # The API returns the URL in different possible fields
-        return result.get("url") or result.get("href") or result.get("downloadUrl") or result.get("pathname")
-    except Exception as e:
-        print(f"Error uploading to Vercel Blob: {e}")
-        raise
+def la_moi_truong_vercel():
+    """Đang chạy trên Vercel không"""
+    return bool(os.environ.get('VERCEL') or os.environ.get('VERCEL_ENV'))
 
-def delete_from_vercel_blob(blob_url, token):
-    """Delete file from Vercel Blob storage using REST API"""
-    try:
-        url = "https://blob.vercel-storage.com/delete"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "url": blob_url
-        }
-        
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        response.raise_for_status()
-        return True
-    except Exception as e:
-        print(f"Error deleting from Vercel Blob: {e}")
-        return False
+# Ảnh lưu theo hash nội dung: <sha256>.<ext> và biến thể <sha256>_<tên>.webp
+ANH_THEO_NOI_DUNG = re.compile(r'^[0-9a-f]{64}(_[a-z]+)?\.[a-z0-9]+$')
+ANH_CACHE_MAX_AGE = 365 * 24 * 3600
+
+# Lưu ảnh lên Vercel Blob (nếu có BLOB_READ_WRITE_TOKEN) hoặc thư mục upload local.
+# Ảnh gốc upload ngay trong request (trên Vercel thư mục local là /tmp riêng của instance,
+# thread nền có thể không chạy xong sau khi trả response); tạo ảnh biến thể và xóa ảnh
+# chạy trong hàng đợi nền (ANH_WORKERS thread, ANH_WORKERS=0 thì chạy ngay trong request)
+ANH_WORKERS = int(os.environ.get('ANH_WORKERS', 2))
+local_storage = LocalStorage(UPLOAD_FOLDER, '/uploads/images/' if la_moi_truong_vercel() else 'uploads/images/')
+hang_doi_anh = StorageQueue(workers=ANH_WORKERS, ten='anh')
+_blob_storage = None
+
+def lay_blob_storage():
+    """Client Vercel Blob dùng chung (None nếu không có BLOB_READ_WRITE_TOKEN)"""
+    global _blob_storage
+    blob_token = os.environ.get('BLOB_READ_WRITE_TOKEN')
+    if not blob_token:
+        return None
+    if _blob_storage is None or _blob_storage.token != blob_token:
+        _blob_storage = VercelBlobStorage(blob_token)
+    return _blob_storage
+
+def luu_file_anh(noi_dung, ten_file, content_type):
+    """Lưu 1 file ảnh lên Blob (nếu có token) hoặc local, trả về giá trị lưu vào database
+
+    Có Blob token mà upload lỗi thì raise (không lưu local: file local không dùng chung giữa các instance).
+    """
+    blob = lay_blob_storage()
+    if blob:
+        return blob.put(ten_file, noi_dung, content_type)
+    return local_storage.put(ten_file, noi_dung, content_type)
+
+def xoa_file_anh(cac_hinh_anh):
+    """Xóa các file ảnh: Blob URL xóa chung 1 request, còn lại xóa file local"""
+    cac_hinh_anh = [hinh_anh for hinh_anh in cac_hinh_anh if hinh_anh]
+    blob_urls = [hinh_anh for hinh_anh in cac_hinh_anh if is_blob_url(hinh_anh)]
+    blob = lay_blob_storage()
+    if blob_urls and blob:
+        blob.delete(blob_urls)
+    local_storage.delete(cac_hinh_anh)
+
+# Xóa ảnh qua outbox: handler chỉ thêm dòng anh_can_xoa trong cùng transaction,
+# sweeper chạy nền xóa theo lô (Blob: 1 request/lô) các ảnh không còn cây nào dùng,
+# lỗi thì giữ lại để lần sau thử tiếp. Định kỳ thu gom cả file mồ côi trong storage.
+ANH_DON_INTERVAL = int(os.environ.get('ANH_DON_INTERVAL', 60))  # Giây giữa 2 lần dọn outbox
+ANH_THU_GOM_INTERVAL = int(os.environ.get('ANH_THU_GOM_INTERVAL', 24 * 3600))  # 0 = chỉ thu gom bằng CLI
+ANH_MO_COI_SAU = 3600  # Chỉ thu gom file cũ hơn (tránh xóa file vừa upload chưa commit)
+ANH_DON_LO = 100
+ANH_XOA_TOI_DA_LAN_THU = 5
+_don_anh_lock = threading.Lock()
+_don_anh_da_hen = False
+_lan_don_anh = 0.0
+_lan_thu_gom_anh = time.monotonic()
+
+def them_anh_can_xoa(hinh_anh, hinh_anh_bien_the=None):
+    """Thêm ảnh gốc và ảnh biến thể vào outbox chờ xóa (chưa commit, gọi hen_don_anh sau khi commit)"""
+    cac_dong = [
+        AnhCanXoa(duong_dan=duong_dan)
+        for duong_dan in [hinh_anh, *doc_bien_the_anh(hinh_anh_bien_the).values()] if duong_dan
+    ]
+    db.session.add_all(cac_dong)
+    return len(cac_dong)
+
+def hen_don_anh():
+    """Hẹn dọn outbox ảnh trong hàng đợi nền (gộp các lần gọi, tối đa 1 lần mỗi ANH_DON_INTERVAL giây)"""
+    global _don_anh_da_hen
+    if ANH_WORKERS <= 0:
+        _don_anh_nen()
+        return
+    with _don_anh_lock:
+        if _don_anh_da_hen:
+            return
+        _don_anh_da_hen = True
+        cho = max(0.0, _lan_don_anh + ANH_DON_INTERVAL - time.monotonic())
+    timer = threading.Timer(cho, hang_doi_anh.submit, args=(_don_anh_nen,))
+    timer.daemon = True
+    timer.start()
+
+def _don_anh_nen():
+    """Việc chạy nền: dọn outbox, thu gom file mồ côi nếu đến hạn"""
+    global _don_anh_da_hen, _lan_don_anh, _lan_thu_gom_anh
+    with _don_anh_lock:
+        _don_anh_da_hen = False
+        _lan_don_anh = time.monotonic()
+        thu_gom = ANH_THU_GOM_INTERVAL > 0 and _lan_don_anh - _lan_thu_gom_anh >= ANH_THU_GOM_INTERVAL
+        if thu_gom:
+            _lan_thu_gom_anh = _lan_don_anh
+    with app.app_context():
+        try:
+            don_anh_can_xoa()
+            if thu_gom:
+                thu_gom_anh_mo_coi()
+        finally:
+            db.session.remove()
+
+def anh_dang_dung():
+    """Tên file mọi ảnh (gốc và biến thể) còn được cây nào đó dùng"""
+    ten_file = set()
+    for hinh_anh, bien_the in db.session.query(CayXanh.hinh_anh, CayXanh.hinh_anh_bien_the).filter(
+        CayXanh.hinh_anh.isnot(None)
+    ):
+        ten_file.add(os.path.basename(hinh_anh))
+        ten_file.update(os.path.basename(path) for path in doc_bien_the_anh(bien_the).values())
+    return ten_file
+
+def don_anh_can_xoa(lo=ANH_DON_LO):
+    """Xóa theo lô các ảnh trong outbox không còn cây nào dùng, trả về (số file đã xóa, số dòng lỗi)"""
+    dang_dung = None
+    da_xoa = so_loi = 0
+    cuoi = 0
+    while True:
+        cac_dong = AnhCanXoa.query.filter(
+            AnhCanXoa.id > cuoi, AnhCanXoa.so_lan_thu < ANH_XOA_TOI_DA_LAN_THU
+        ).order_by(AnhCanXoa.id).limit(lo).all()
+        if not cac_dong:
+            break
+        cuoi = cac_dong[-1].id
+        if dang_dung is None:
+            dang_dung = anh_dang_dung()
+
+        # Ảnh lưu theo nội dung nên có thể dùng chung giữa nhiều cây: chỉ xóa khi không còn ai dùng
+        cac_duong_dan = sorted({
+            dong.duong_dan for dong in cac_dong if os.path.basename(dong.duong_dan) not in dang_dung
+        })
+        try:
+            xoa_file_anh(cac_duong_dan)
+        except Exception as e:
+            print(f"Error deleting images: {e}")
+            for dong in cac_dong:
+                dong.so_lan_thu += 1
+                dong.loi = str(e)
+            so_loi += len(cac_dong)
+        else:
+            AnhCanXoa.query.filter(AnhCanXoa.id.in_([dong.id for dong in cac_dong])).delete(synchronize_session=False)
+            da_xoa += len(cac_duong_dan)
+        db.session.commit()
+    return da_xoa, so_loi
+
+def thu_gom_anh_mo_coi(cu_hon=ANH_MO_COI_SAU):
+    """Xóa file trong storage (local và Blob) không cây nào dùng và cũ hơn cu_hon giây, trả về số file"""
+    dang_dung = anh_dang_dung()
+    moc = time.time() - cu_hon
+    nguon = [local_storage]
+    if lay_blob_storage():
+        nguon.append(lay_blob_storage())
+    mo_coi = []
+    for storage in nguon:
+        mo_coi.extend(
+            duong_dan for duong_dan, thoi_gian in storage.liet_ke()
+            if thoi_gian < moc and os.path.basename(duong_dan) not in dang_dung
+        )
+    for lo in _chia_lo(mo_coi, ANH_DON_LO):
+        xoa_file_anh(lo)
+    return len(mo_coi)
+
+def tao_bien_the_anh(hinh_anh, noi_dung):
+    """Tạo và lưu ảnh biến thể cho ảnh `hinh_anh`, ghi đường dẫn vào hinh_anh_bien_the của các cây dùng ảnh"""
+    import json
+    with app.app_context():
+        try:
+            ten_goc = os.path.splitext(os.path.basename(hinh_anh))[0]
+            bien_the = {
+                ten: luu_file_anh(du_lieu, f"{ten_goc}_{ten}.webp", 'image/webp')
+                for ten, du_lieu in tao_bien_the(noi_dung).items()
+            }
+            if not bien_the:
+                return
+
+            # Ghi cho mọi cây còn dùng ảnh này (có thể đã upload ảnh khác trong lúc xử lý)
+            bang = CayXanh.__table__
+            ket_qua = db.session.execute(
+                bang.update().where(bang.c.hinh_anh == hinh_anh)
+                .values(hinh_anh_bien_the=json.dumps(bien_the))
+            )
+            if ket_qua.rowcount == 0:
+                them_anh_can_xoa(None, json.dumps(bien_the))
+            db.session.commit()
+            if ket_qua.rowcount == 0:
+                hen_don_anh()
+                return
+            xoa_cache_dashboard()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error creating image variants for {hinh_anh}: {e}")
+        finally:
+            db.session.remove()
 
 def fix_postgres_url(url):
     """Fix PostgreSQL connection string by properly encoding password and handling special characters"""
@@ -252,7 +409,8 @@ else:
         print("✗ CRITICAL: No DATABASE_URL or POSTGRES_URL found on Vercel!")
         print("✗ Data will be lost after each deployment. Please configure PostgreSQL database.")
         raise Exception("DATABASE_URL or POSTGRES_URL environment variable is required on Vercel. SQLite cannot persist data on serverless platforms.")
-    db_path = 'sqlite:///cayxanh.db'
+    # DATABASE_URL=sqlite:///... dùng file SQLite khác (vd. khi chạy test)
+    db_path = db_url if db_url.startswith('sqlite') else 'sqlite:///cayxanh.db'
     print("✓ Using SQLite (Local Development)")
 
 app.config['SQLALCHEMY_DATABASE_URI'] = db_path
@@ -270,6 +428,18 @@ print(f"Vercel environment: {is_vercel}")
 if is_vercel and 'sqlite' in db_path.lower():
     print("⚠ WARNING: SQLite detected on Vercel! Data will be lost. Please configure PostgreSQL.")
 
+def bo_dau(text):
+    """Bỏ dấu tiếng Việt và chuyển về chữ thường ('Cây Kim Tiền' -> 'cay kim tien')"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFD', str(text).lower().replace('đ', 'd').replace('Đ', 'd'))
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return ' '.join(text.split())
+
+def tao_chuoi_tim_kiem(ma_cay, loai_cay):
+    """Giá trị cột tim_kiem: mã cây + loại cây đã bỏ dấu, chữ thường"""
+    return f"{bo_dau(ma_cay)} {bo_dau(loai_cay)}".strip()
+
 # Models
 class CayXanh(db.Model):
     __tablename__ = 'cayxanh'
@@ -279,6 +449,8 @@ class CayXanh(db.Model):
     loai_cay = db.Column(db.String(200), nullable=False)
     ton_kho = db.Column(db.Float, default=0.0, nullable=False)
     hinh_anh = db.Column(db.String(500), nullable=True)  # Đường dẫn ảnh
+    hinh_anh_bien_the = db.Column(db.Text, nullable=True)  # JSON {thumb, medium: đường dẫn ảnh WebP thu nhỏ}
+    tim_kiem = db.Column(db.String(260))  # Mã cây + loại cây bỏ dấu, chữ thường (dùng để tìm kiếm)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -289,8 +461,18 @@ class CayXanh(db.Model):
     def __repr__(self):
         return f'<CayXanh {self.ma_cay}: {self.loai_cay}>'
 
+@event.listens_for(CayXanh, 'before_insert')
+@event.listens_for(CayXanh, 'before_update')
+def _cap_nhat_tim_kiem(mapper, connection, target):
+    """Giữ cột tim_kiem đồng bộ với ma_cay/loai_cay khi ghi qua ORM"""
+    target.tim_kiem = tao_chuoi_tim_kiem(target.ma_cay, target.loai_cay)
+
 class NhapKho(db.Model):
     __tablename__ = 'nhapkho'
+    __table_args__ = (
+        # Phân trang keyset lịch sử nhập: ORDER BY ngay_nhap, created_at, id
+        db.Index('ix_nhapkho_ngay_created_id', 'ngay_nhap', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cay_xanh_id = db.Column(db.Integer, db.ForeignKey('cayxanh.id'), nullable=False)
@@ -305,8 +487,16 @@ class NhapKho(db.Model):
     def __repr__(self):
         return f'<NhapKho {self.cay_xanh_id}: {self.so_luong} cây - {self.ngay_nhap}>'
 
+# Lịch sử/giá nhập mới nhất của từng cây: WHERE cay_xanh_id = ? ORDER BY ngay_nhap DESC, created_at DESC, id DESC
+db.Index('ix_nhapkho_cay_ngay_created', NhapKho.cay_xanh_id,
+         NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc(), NhapKho.id.desc())
+
 class XuatKho(db.Model):
     __tablename__ = 'xuatkho'
+    __table_args__ = (
+        # Phân trang keyset lịch sử xuất: ORDER BY ngay_xuat, created_at, id
+        db.Index('ix_xuatkho_ngay_created_id', 'ngay_xuat', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cay_xanh_id = db.Column(db.Integer, db.ForeignKey('cayxanh.id'), nullable=False)
@@ -319,6 +509,1796 @@ class XuatKho(db.Model):
     def __repr__(self):
         return f'<XuatKho {self.cay_xanh_id}: {self.so_luong} cây - {self.ngay_xuat}>'
 
+# Lịch sử xuất của từng cây: WHERE cay_xanh_id = ? ORDER BY ngay_xuat DESC, created_at DESC
+db.Index('ix_xuatkho_cay_ngay_created', XuatKho.cay_xanh_id,
+         XuatKho.ngay_xuat.desc(), XuatKho.created_at.desc(), XuatKho.id.desc())
+
+class TonKhoNgay(db.Model):
+    __tablename__ = 'ton_kho_ngay'
+    
+    # Primary key (cay_xanh_id, ngay) cũng là index cho truy vấn "tồn kho tại ngày"
+    cay_xanh_id = db.Column(db.Integer, db.ForeignKey('cayxanh.id'), primary_key=True)
+    ngay = db.Column(db.Date, primary_key=True)
+    ton_cuoi = db.Column(db.Float, default=0.0, nullable=False)  # Tồn kho cuối ngày
+    
+    def __repr__(self):
+        return f'<TonKhoNgay {self.cay_xanh_id}: {self.ton_cuoi} - {self.ngay}>'
+
+class GiaVonCay(db.Model):
+    __tablename__ = 'gia_von_cay'
+    
+    cay_xanh_id = db.Column(db.Integer, db.ForeignKey('cayxanh.id'), primary_key=True)
+    so_luong = db.Column(db.Float, default=0.0, nullable=False)  # Số lượng còn theo sổ nhập/xuất
+    gia_tri_binh_quan = db.Column(db.Float, default=0.0, nullable=False)  # Giá trị tồn theo bình quân gia quyền
+    gia_von_binh_quan = db.Column(db.Float, default=0.0, nullable=False)  # Tổng giá vốn hàng đã xuất (bình quân)
+    gia_tri_fifo = db.Column(db.Float, default=0.0, nullable=False)  # Giá trị tồn theo FIFO (tổng các lô còn lại)
+    gia_von_fifo = db.Column(db.Float, default=0.0, nullable=False)  # Tổng giá vốn hàng đã xuất (FIFO)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    @property
+    def don_gia_binh_quan(self):
+        """Đơn giá bình quân hiện tại (đã gồm phí ship)"""
+        return self.gia_tri_binh_quan / self.so_luong if self.so_luong > 0 else 0.0
+    
+    def __repr__(self):
+        return f'<GiaVonCay {self.cay_xanh_id}: {self.so_luong} cây - {self.gia_tri_binh_quan}>'
+
+class LoHang(db.Model):
+    __tablename__ = 'lo_hang'
+    __table_args__ = (
+        # Lấy lô cũ nhất trước khi xuất (FIFO)
+        db.Index('ix_lo_hang_fifo', 'cay_xanh_id', 'ngay_nhap', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    cay_xanh_id = db.Column(db.Integer, db.ForeignKey('cayxanh.id'), nullable=False)
+    ngay_nhap = db.Column(db.Date, nullable=False)
+    don_gia = db.Column(db.Float, nullable=False)  # (số lượng × giá nhập + phí ship) / số lượng
+    so_luong_con = db.Column(db.Float, nullable=False)  # Số lượng chưa xuất của lô
+    
+    def __repr__(self):
+        return f'<LoHang {self.cay_xanh_id}: {self.so_luong_con} cây x {self.don_gia} - {self.ngay_nhap}>'
+
+class BienDongThang(db.Model):
+    __tablename__ = 'bien_dong_thang'
+    __table_args__ = (
+        # Tổng theo tháng của mọi cây: WHERE thang = ...
+        db.Index('ix_bien_dong_thang_thang', 'thang'),
+    )
+    
+    cay_xanh_id = db.Column(db.Integer, db.ForeignKey('cayxanh.id'), primary_key=True)
+    thang = db.Column(db.Date, primary_key=True)  # Ngày đầu tháng
+    so_luong_nhap = db.Column(db.Float, default=0.0, nullable=False)
+    so_luong_xuat = db.Column(db.Float, default=0.0, nullable=False)
+    gia_tri_nhap = db.Column(db.Float, default=0.0, nullable=False)  # Tổng tiền nhập (gồm phí ship)
+    
+    def __repr__(self):
+        return f'<BienDongThang {self.cay_xanh_id}: {self.thang} +{self.so_luong_nhap} -{self.so_luong_xuat}>'
+
+class ImportJob(db.Model):
+    __tablename__ = 'import_job'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    ten_file = db.Column(db.String(255))
+    trang_thai = db.Column(db.String(20), nullable=False, default='cho')  # cho, dang_chay, xong, loi
+    tong_so_dong = db.Column(db.Integer)  # Ước tính, có thể None
+    so_dong = db.Column(db.Integer, default=0, nullable=False)
+    so_dong_loi = db.Column(db.Integer, default=0, nullable=False)
+    so_cay_moi = db.Column(db.Integer, default=0, nullable=False)
+    so_phieu_nhap = db.Column(db.Integer, default=0, nullable=False)
+    loi = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    bat_dau = db.Column(db.DateTime)
+    ket_thuc = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<ImportJob {self.id}: {self.trang_thai} - {self.so_dong} dòng>'
+
+class AnhCanXoa(db.Model):
+    __tablename__ = 'anh_can_xoa'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    duong_dan = db.Column(db.String(500), nullable=False)  # Blob URL hoặc đường dẫn local
+    so_lan_thu = db.Column(db.Integer, default=0, nullable=False)  # Số lần xóa lỗi
+    loi = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    def __repr__(self):
+        return f'<AnhCanXoa {self.id}: {self.duong_dan}>'
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+
+    version = db.Column(db.Integer, primary_key=True)
+    mo_ta = db.Column(db.String(200))
+    applied_at = db.Column(db.DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}: {self.mo_ta}>'
+
+# Schema migrations: mỗi phiên bản là 1 bước DDL, chạy 1 lần bằng `flask --app app migrate`
+# (hoặc tự động khi cold start phát hiện database còn ở phiên bản cũ).
+# Request handler KHÔNG BAO GIỜ chạy DDL.
+def _migration_tao_bang():
+    """Tạo các bảng ban đầu (cayxanh, nhapkho, xuatkho) đúng như phiên bản 1
+
+    Không dùng db.create_all(): cột, index, bảng thêm sau do từng migration sau tự tạo.
+    """
+    metadata = db.MetaData()
+    db.Table(
+        'cayxanh', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('ma_cay', db.String(50), unique=True, nullable=False, index=True),
+        db.Column('loai_cay', db.String(200), nullable=False),
+        db.Column('ton_kho', db.Float, nullable=False),
+        db.Column('hinh_anh', db.String(500), nullable=True),
+        db.Column('created_at', db.DateTime),
+        db.Column('updated_at', db.DateTime),
+    )
+    db.Table(
+        'nhapkho', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('cay_xanh_id', db.Integer, db.ForeignKey('cayxanh.id'), nullable=False),
+        db.Column('so_luong', db.Float, nullable=False),
+        db.Column('gia_nhap', db.Float, nullable=False),
+        db.Column('phi_ship', db.Float),
+        db.Column('tong_tien', db.Float, nullable=False),
+        db.Column('ngay_nhap', db.Date, nullable=False),
+        db.Column('ghi_chu', db.Text),
+        db.Column('created_at', db.DateTime),
+    )
+    db.Table(
+        'xuatkho', metadata,
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('cay_xanh_id', db.Integer, db.ForeignKey('cayxanh.id'), nullable=False),
+        db.Column('so_luong', db.Float, nullable=False),
+        db.Column('ngay_xuat', db.Date, nullable=False),
+        db.Column('ly_do', db.String(200)),
+        db.Column('ghi_chu', db.Text),
+        db.Column('created_at', db.DateTime),
+    )
+    metadata.create_all(db.engine, checkfirst=True)
+
+def _tao_index(*ten_index):
+    """Tạo các index (khai báo trên model) theo tên, bỏ qua index đã có"""
+    for bang in (NhapKho.__table__, XuatKho.__table__):
+        for index in bang.indexes:
+            if index.name in ten_index:
+                index.create(db.engine, checkfirst=True)
+
+def _migration_import_job():
+    """Bảng import_job cho import chạy nền"""
+    ImportJob.__table__.create(db.engine, checkfirst=True)
+
+def _migration_tim_kiem():
+    """Cột tim_kiem (bỏ dấu) + index tìm kiếm: trigram GIN trên PostgreSQL, FTS5 trên SQLite"""
+    from sqlalchemy import inspect
+    with db.engine.begin() as conn:
+        cot = {c['name'] for c in inspect(conn).get_columns('cayxanh')}
+        if 'tim_kiem' not in cot:
+            conn.execute(db.text('ALTER TABLE cayxanh ADD COLUMN tim_kiem VARCHAR(260)'))
+
+    # Điền giá trị cho dữ liệu cũ
+    bang = CayXanh.__table__
+    rows = [
+        {'b_id': id_, 'b_tim_kiem': tao_chuoi_tim_kiem(ma_cay, loai_cay)}
+        for id_, ma_cay, loai_cay in db.session.query(CayXanh.id, CayXanh.ma_cay, CayXanh.loai_cay)
+    ]
+    stmt = bang.update().where(bang.c.id == db.bindparam('b_id')).values(tim_kiem=db.bindparam('b_tim_kiem'))
+    for lo in _chia_lo(rows):
+        db.session.execute(stmt, lo)
+    db.session.commit()
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                conn.execute(db.text(
+                    'CREATE INDEX IF NOT EXISTS ix_cayxanh_tim_kiem_trgm ON cayxanh USING gin (tim_kiem gin_trgm_ops)'
+                ))
+        except Exception as e:
+            print(f"Warning: Could not create trigram index (pg_trgm): {e}")
+    elif dialect == 'sqlite':
+        try:
+            with db.engine.begin() as conn:
+                for sql in SQLITE_FTS_DDL:
+                    conn.execute(db.text(sql))
+        except Exception as e:
+            print(f"Warning: Could not create FTS5 search index: {e}")
+
+def _migration_index_lich_su():
+    """Index (ngày, created_at, id) cho phân trang keyset; điền created_at còn NULL"""
+    for model, cot_ngay in ((NhapKho, NhapKho.ngay_nhap), (XuatKho, XuatKho.ngay_xuat)):
+        # Dòng cũ thiếu created_at sẽ bị bỏ qua khi so sánh keyset => lấy theo ngày nhập/xuất
+        rows = [
+            {'b_id': id_, 'b_created_at': datetime.combine(ngay, datetime.min.time())}
+            for id_, ngay in db.session.query(model.id, cot_ngay).filter(model.created_at.is_(None))
+        ]
+        bang = model.__table__
+        stmt = bang.update().where(bang.c.id == db.bindparam('b_id')).values(created_at=db.bindparam('b_created_at'))
+        for lo in _chia_lo(rows):
+            db.session.execute(stmt, lo)
+        db.session.commit()
+    _tao_index('ix_nhapkho_ngay_created_id', 'ix_xuatkho_ngay_created_id')
+
+def _migration_ton_kho_ngay():
+    """Bảng ton_kho_ngay (tồn kho cuối ngày), tính từ lịch sử nhập/xuất hiện có"""
+    TonKhoNgay.__table__.create(db.engine, checkfirst=True)
+    xay_dung_lai_ton_kho_ngay()
+
+def _migration_gia_von():
+    """Bảng gia_von_cay và lo_hang (giá vốn bình quân/FIFO), tính từ lịch sử hiện có"""
+    for model in (GiaVonCay, LoHang):
+        model.__table__.create(db.engine, checkfirst=True)
+    xay_dung_lai_gia_von()
+
+def _migration_bien_dong_thang():
+    """Bảng bien_dong_thang (nhập/xuất theo tháng), tính từ lịch sử hiện có"""
+    BienDongThang.__table__.create(db.engine, checkfirst=True)
+    xay_dung_lai_bien_dong_thang()
+
+def _migration_index_theo_cay():
+    """Index (cay_xanh_id, ngày DESC, created_at DESC, id DESC) cho lịch sử và giá nhập theo từng cây"""
+    _tao_index('ix_nhapkho_cay_ngay_created', 'ix_xuatkho_cay_ngay_created')
+
+def _migration_hinh_anh_bien_the():
+    """Cột hinh_anh_bien_the lưu đường dẫn ảnh thumbnail/medium"""
+    from sqlalchemy import inspect
+    with db.engine.begin() as conn:
+        cot = {c['name'] for c in inspect(conn).get_columns('cayxanh')}
+        if 'hinh_anh_bien_the' not in cot:
+            conn.execute(db.text('ALTER TABLE cayxanh ADD COLUMN hinh_anh_bien_the TEXT'))
+
+def _migration_anh_can_xoa():
+    """Bảng anh_can_xoa (outbox ảnh chờ xóa khỏi storage)"""
+    AnhCanXoa.__table__.create(db.engine, checkfirst=True)
+
+MIGRATIONS = [
+    (1, 'Tạo bảng ban đầu', _migration_tao_bang),
+    (2, 'Bảng import_job', _migration_import_job),
+    (3, 'Cột tim_kiem và index tìm kiếm', _migration_tim_kiem),
+    (4, 'Index phân trang lịch sử nhập/xuất', _migration_index_lich_su),
+    (5, 'Bảng tồn kho cuối ngày', _migration_ton_kho_ngay),
+    (6, 'Bảng giá vốn bình quân/FIFO', _migration_gia_von),
+    (7, 'Bảng biến động theo tháng', _migration_bien_dong_thang),
+    (8, 'Index lịch sử nhập/xuất theo cây', _migration_index_theo_cay),
+    (9, 'Cột hinh_anh_bien_the', _migration_hinh_anh_bien_the),
+    (10, 'Bảng anh_can_xoa', _migration_anh_can_xoa),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def lay_schema_version():
+    """Phiên bản schema hiện tại của database (0 nếu chưa có bảng schema_version)"""
+    try:
+        return db.session.query(func.max(SchemaVersion.version)).scalar() or 0
+    except Exception:
+        db.session.rollback()
+        return 0
+
+# Khóa advisory PostgreSQL: nhiều instance cùng migrate thì chạy lần lượt
+KHOA_MIGRATE = 7261001
+
+def migrate_schema():
+    """Chạy các migration chưa áp dụng, trả về danh sách phiên bản vừa chạy"""
+    if db.engine.dialect.name != 'postgresql':
+        return _chay_migration()
+    # Giữ khóa trên 1 kết nối riêng suốt quá trình migrate (các bước dùng session và engine)
+    with db.engine.connect() as conn:
+        conn.execute(db.text('SELECT pg_advisory_lock(:khoa)'), {'khoa': KHOA_MIGRATE})
+        conn.commit()  # Khóa mức session vẫn giữ sau commit, kết nối không bị treo "idle in transaction"
+        try:
+            return _chay_migration()
+        finally:
+            conn.execute(db.text('SELECT pg_advisory_unlock(:khoa)'), {'khoa': KHOA_MIGRATE})
+
+def _chay_migration():
+    SchemaVersion.__table__.create(db.engine, checkfirst=True)
+    # Đọc phiên bản sau khi có khóa: instance chờ khóa sẽ bỏ qua các bước instance trước đã chạy
+    hien_tai = lay_schema_version()
+    da_chay = []
+    for version, mo_ta, buoc in MIGRATIONS:
+        if version <= hien_tai:
+            continue
+        buoc()
+        db.session.add(SchemaVersion(version=version, mo_ta=mo_ta))
+        db.session.commit()
+        da_chay.append(version)
+        print(f"✓ Applied schema migration {version}: {mo_ta}")
+    return da_chay
+
+def kiem_tra_schema(tu_dong_migrate=True):
+    """Kiểm tra nhanh phiên bản schema khi khởi động (1 câu query), migrate nếu cần"""
+    hien_tai = lay_schema_version()
+    if hien_tai >= SCHEMA_VERSION:
+        return True
+    print(f"Database schema version {hien_tai} < {SCHEMA_VERSION}")
+    if not tu_dong_migrate:
+        print("⚠ Run `flask --app app migrate` to upgrade the database schema.")
+        return False
+    migrate_schema()
+    return True
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Tạo/cập nhật schema database lên phiên bản mới nhất"""
+    da_chay = migrate_schema()
+    if da_chay:
+        print(f"Database schema upgraded to version {SCHEMA_VERSION}")
+    else:
+        print(f"Database schema is up to date (version {SCHEMA_VERSION})")
+
+# Tìm kiếm cây không phân biệt dấu trên cột tim_kiem
+# - SQLite: bảng FTS5 (tokenizer trigram) đồng bộ bằng trigger => tìm chuỗi con không cần quét bảng
+# - PostgreSQL: index GIN gin_trgm_ops => LIKE '%...%' dùng được index
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS cayxanh_fts USING fts5("
+    "tim_kiem, content='cayxanh', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS cayxanh_fts_ai AFTER INSERT ON cayxanh BEGIN "
+    "INSERT INTO cayxanh_fts(rowid, tim_kiem) VALUES (new.id, new.tim_kiem); END",
+    "CREATE TRIGGER IF NOT EXISTS cayxanh_fts_ad AFTER DELETE ON cayxanh BEGIN "
+    "INSERT INTO cayxanh_fts(cayxanh_fts, rowid, tim_kiem) VALUES ('delete', old.id, old.tim_kiem); END",
+    "CREATE TRIGGER IF NOT EXISTS cayxanh_fts_au AFTER UPDATE OF tim_kiem ON cayxanh BEGIN "
+    "INSERT INTO cayxanh_fts(cayxanh_fts, rowid, tim_kiem) VALUES ('delete', old.id, old.tim_kiem); "
+    "INSERT INTO cayxanh_fts(rowid, tim_kiem) VALUES (new.id, new.tim_kiem); END",
+    "INSERT INTO cayxanh_fts(cayxanh_fts) VALUES ('rebuild')",
+]
+_co_fts = None
+
+def _co_bang_fts():
+    """Database có bảng cayxanh_fts không (kiểm tra 1 lần mỗi process)"""
+    global _co_fts
+    if _co_fts is None:
+        if db.engine.dialect.name != 'sqlite':
+            _co_fts = False
+        else:
+            _co_fts = db.session.execute(db.text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cayxanh_fts'"
+            )).first() is not None
+    return _co_fts
+
+def loc_tim_kiem(query, search):
+    """Lọc query CayXanh theo từ khóa (không phân biệt dấu/hoa thường), xếp kết quả khớp đầu từ lên trước"""
+    tu_khoa = bo_dau(search)
+    if not tu_khoa:
+        return query
+
+    # FTS5 trigram cần từ khóa >= 3 ký tự; ngắn hơn thì dùng LIKE trên cột tim_kiem
+    if len(tu_khoa) >= 3 and _co_bang_fts():
+        fts = db.text('SELECT rowid FROM cayxanh_fts WHERE cayxanh_fts MATCH :tu_khoa').bindparams(
+            tu_khoa='"' + tu_khoa.replace('"', '""') + '"'
+        ).columns(db.column('rowid', db.Integer))
+        query = query.filter(CayXanh.id.in_(fts))
+    else:
+        query = query.filter(CayXanh.tim_kiem.contains(tu_khoa, autoescape=True))
+
+    khop_dau_tu = db.or_(
+        CayXanh.tim_kiem.startswith(tu_khoa, autoescape=True),
+        CayXanh.tim_kiem.contains(' ' + tu_khoa, autoescape=True)
+    )
+    return query.order_by(db.case((khop_dau_tu, 0), else_=1))
+
+# Định giá tồn kho: tồn kho × giá nhập mới nhất, tính cho tất cả cây trong 1 câu query
+def _ho_tro_window_function():
+    """Kiểm tra database có hỗ trợ window function (ROW_NUMBER) không"""
+    dialect = db.engine.dialect
+    if dialect.name != 'sqlite':
+        return True
+    # SQLite hỗ trợ window function từ bản 3.25
+    return getattr(dialect.dbapi, 'sqlite_version_info', (0,)) >= (3, 25)
+
+def gia_nhap_moi_nhat_subquery(cay_ids=None):
+    """Subquery (cay_xanh_id, gia_nhap): phiếu nhập mới nhất của mỗi cây (chỉ các cây trong cay_ids nếu có)"""
+    thu_tu = (NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc(), NhapKho.id.desc())
+    loc = [NhapKho.cay_xanh_id.in_(list(cay_ids))] if cay_ids is not None else []
+
+    if db.engine.dialect.name == 'postgresql':
+        # PostgreSQL: DISTINCT ON lấy dòng đầu tiên của mỗi nhóm
+        return db.session.query(
+            NhapKho.cay_xanh_id, NhapKho.gia_nhap
+        ).filter(*loc).distinct(NhapKho.cay_xanh_id).order_by(
+            NhapKho.cay_xanh_id, *thu_tu
+        ).subquery('gia_moi_nhat')
+
+    if _ho_tro_window_function():
+        # ROW_NUMBER() OVER (PARTITION BY cay_xanh_id ...) = 1
+        xep_hang = db.session.query(
+            NhapKho.cay_xanh_id.label('cay_xanh_id'),
+            NhapKho.gia_nhap.label('gia_nhap'),
+            func.row_number().over(partition_by=NhapKho.cay_xanh_id, order_by=thu_tu).label('rn')
+        ).filter(*loc).subquery('xep_hang')
+        return db.session.query(
+            xep_hang.c.cay_xanh_id, xep_hang.c.gia_nhap
+        ).filter(xep_hang.c.rn == 1).subquery('gia_moi_nhat')
+
+    # Fallback cho SQLite cũ: correlated subquery lấy id phiếu nhập mới nhất
+    nhap_khac = db.aliased(NhapKho)
+    id_moi_nhat = db.session.query(nhap_khac.id).filter(
+        nhap_khac.cay_xanh_id == NhapKho.cay_xanh_id
+    ).order_by(
+        nhap_khac.ngay_nhap.desc(), nhap_khac.created_at.desc(), nhap_khac.id.desc()
+    ).limit(1).correlate(NhapKho).scalar_subquery()
+    return db.session.query(
+        NhapKho.cay_xanh_id, NhapKho.gia_nhap
+    ).filter(NhapKho.id == id_moi_nhat, *loc).subquery('gia_moi_nhat')
+
+def bang_gia_tri_ton_kho(cay_ids=None):
+    """Danh sách (cay_xanh_id, ma_cay, loai_cay, ton_kho, gia_nhap_moi_nhat, gia_tri) cho báo cáo"""
+    gia_moi_nhat = gia_nhap_moi_nhat_subquery()
+    gia_tri = func.coalesce(CayXanh.ton_kho, 0) * func.coalesce(gia_moi_nhat.c.gia_nhap, 0)
+
+    query = db.session.query(
+        CayXanh.id.label('cay_xanh_id'),
+        CayXanh.ma_cay,
+        CayXanh.loai_cay,
+        CayXanh.ton_kho,
+        gia_moi_nhat.c.gia_nhap.label('gia_nhap_moi_nhat'),
+        gia_tri.label('gia_tri')
+    ).outerjoin(gia_moi_nhat, gia_moi_nhat.c.cay_xanh_id == CayXanh.id)
+
+    if cay_ids is not None:
+        query = query.filter(CayXanh.id.in_(list(cay_ids)))
+
+    return query.order_by(CayXanh.loai_cay).all()
+
+def tong_gia_tri_ton_kho():
+    """Tổng giá trị tồn kho của tất cả cây (1 câu query duy nhất)"""
+    gia_moi_nhat = gia_nhap_moi_nhat_subquery()
+    tong = db.session.query(
+        func.sum(CayXanh.ton_kho * gia_moi_nhat.c.gia_nhap)
+    ).join(gia_moi_nhat, gia_moi_nhat.c.cay_xanh_id == CayXanh.id).scalar()
+    return float(tong or 0)
+
+# Import Excel: chuẩn hóa cả DataFrame bằng phép toán vector của pandas,
+# sau đó ghi cây và phiếu nhập bằng bulk insert/upsert (vài câu lệnh cho cả file)
+IMPORT_CHUNK_SIZE = 500  # Số dòng mỗi lô executemany / số giá trị mỗi IN (...)
+# Giới hạn tham số của 1 câu lệnh trên SQLite cũ (< 3.32); câu INSERT nhiều VALUES dùng
+# 1 tham số cho mỗi cột của mỗi dòng => số dòng mỗi câu tính theo số cột
+SQLITE_MAX_THAM_SO = 999
+
+def _chia_lo(rows, size=IMPORT_CHUNK_SIZE):
+    """Chia danh sách thành các lô nhỏ"""
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+def _kich_thuoc_lo(so_cot):
+    """Số dòng tối đa của 1 câu lệnh mà mỗi dòng dùng so_cot tham số (vd. INSERT ... VALUES (...), (...))"""
+    return max(1, min(IMPORT_CHUNK_SIZE, SQLITE_MAX_THAM_SO // so_cot))
+
+def _upsert_cay_xanh(rows, id_theo_ma):
+    """Insert cây mới / cập nhật loai_cay, ton_kho của cây đã có bằng bulk statement"""
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert_insert
+        for lo in _chia_lo(rows, _kich_thuoc_lo(len(rows[0]))):
+            stmt = upsert_insert(CayXanh.__table__).values(lo)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[CayXanh.__table__.c.ma_cay],
+                set_={
+                    'loai_cay': stmt.excluded.loai_cay,
+                    'ton_kho': stmt.excluded.ton_kho,
+                    'tim_kiem': stmt.excluded.tim_kiem,
+                    'updated_at': stmt.excluded.updated_at,
+                }
+            )
+            db.session.execute(stmt)
+        return
+
+    # Database khác: bulk insert cây mới + bulk update theo primary key
+    moi = [r for r in rows if r['ma_cay'] not in id_theo_ma]
+    cu = [
+        {'id': id_theo_ma[r['ma_cay']], 'loai_cay': r['loai_cay'], 'ton_kho': r['ton_kho'],
+         'tim_kiem': r['tim_kiem'], 'updated_at': r['updated_at']}
+        for r in rows if r['ma_cay'] in id_theo_ma
+    ]
+    if moi:
+        db.session.execute(db.insert(CayXanh), moi)
+    if cu:
+        db.session.execute(db.update(CayXanh), cu)
+
+def ghi_du_lieu_excel(du_lieu):
+    """Ghi dữ liệu đã chuẩn hóa vào database (chưa commit), trả về (số cây mới, số phiếu nhập)"""
+    if du_lieu.empty:
+        return 0, 0
+
+    # Mỗi mã cây: dòng cuối cùng quyết định tên và tồn kho (kể cả số lượng = 0)
+    cuoi = du_lieu.drop_duplicates('ma_cay', keep='last')
+
+    # ma_cay -> id chỉ của các mã cây trong lô (không nạp cả bảng cho mỗi lô)
+    def lay_id_theo_ma():
+        return {ma_cay: row.id for ma_cay, row in _lay_cay_theo_ma(cuoi['ma_cay'], CayXanh.id).items()}
+
+    id_theo_ma = lay_id_theo_ma()
+    bay_gio = datetime.now()
+    rows = [
+        {'ma_cay': ma_cay, 'loai_cay': ten_hang, 'ton_kho': float(so_luong),
+         'tim_kiem': tao_chuoi_tim_kiem(ma_cay, ten_hang), 'created_at': bay_gio, 'updated_at': bay_gio}
+        for ma_cay, ten_hang, so_luong in zip(cuoi['ma_cay'], cuoi['ten_hang'], cuoi['so_luong'])
+    ]
+    so_cay_moi = sum(1 for r in rows if r['ma_cay'] not in id_theo_ma)
+    _upsert_cay_xanh(rows, id_theo_ma)
+
+    # Lấy id của cây vừa tạo
+    if so_cay_moi:
+        id_theo_ma = lay_id_theo_ma()
+
+    # Chỉ tạo phiếu nhập nếu số lượng > 0 và giá > 0
+    nhap = du_lieu[(du_lieu['so_luong'] > 0) & (du_lieu['gia_nhap'] > 0)]
+    tong_tien = nhap['so_luong'] * nhap['gia_nhap'] + nhap['phi_ship']
+    phieu_nhap = [
+        {'cay_xanh_id': id_theo_ma[ma_cay], 'so_luong': float(so_luong), 'gia_nhap': float(gia_nhap),
+         'phi_ship': float(phi_ship), 'tong_tien': float(tien), 'ngay_nhap': ngay_nhap,
+         'ghi_chu': 'Import từ Excel', 'created_at': bay_gio}
+        for ma_cay, so_luong, gia_nhap, phi_ship, tien, ngay_nhap in zip(
+            nhap['ma_cay'], nhap['so_luong'], nhap['gia_nhap'], nhap['phi_ship'], tong_tien, nhap['ngay_nhap']
+        )
+    ]
+    for lo in _chia_lo(phieu_nhap):
+        db.session.execute(db.insert(NhapKho), lo)
+    # Import ghi đè tồn kho và thường có phiếu lùi ngày: tính lại số liệu tổng hợp của các cây
+    # trong lô theo lịch sử (đối chiếu với ton_kho) thay vì cộng dồn
+    xay_dung_lai_so_lieu(id_theo_ma.values())
+
+    return so_cay_moi, len(phieu_nhap)
+
+def import_dataframe(df):
+    """Import 1 DataFrame (đã đọc từ Excel); trả về (số cây mới, số phiếu nhập) hoặc None nếu thiếu cột"""
+    cot = tim_cot_excel(df.columns)
+    if not du_cot_bat_buoc(cot):
+        return None
+    return ghi_du_lieu_excel(chuan_hoa_du_lieu_excel(df, cot))
+
+# Import streaming: đọc từng dòng (openpyxl read-only / csv reader) và ghi theo từng lô,
+# mỗi lô commit trong 1 transaction riêng => bộ nhớ không tăng theo kích thước file
+STREAMING_CHUNK_SIZE = int(os.environ.get('STREAMING_IMPORT_CHUNK_SIZE', 1000))
+STREAMING_IMPORT_THRESHOLD = 1 * 1024 * 1024  # File lớn hơn 1MB tự động dùng chế độ streaming
+def import_streaming(file, filename, chunk_size=None, tien_do=None):
+    """Import file theo từng lô, mỗi lô commit riêng; trả về dict thống kê (có key 'loi' nếu thiếu cột/lỗi)
+
+    tien_do(ket_qua) được gọi sau mỗi lô đã commit (dùng cho import chạy nền).
+    """
+    chunk_size = chunk_size or STREAMING_CHUNK_SIZE
+    ket_qua = {'so_dong': 0, 'so_dong_loi': 0, 'so_cay_moi': 0, 'so_phieu_nhap': 0, 'so_lo': 0, 'loi': None}
+
+    rows = doc_dong_file(file, filename)
+    try:
+        tieu_de = tim_dong_tieu_de(rows)
+        if tieu_de is None:
+            ket_qua['loi'] = 'thieu_cot'
+            return ket_qua
+        cot, so_cot = tieu_de
+
+        def ghi_lo(lo):
+            df = tao_dataframe(lo, so_cot)
+            du_lieu = chuan_hoa_du_lieu_excel(df, cot)
+            try:
+                so_cay_moi, so_phieu_nhap = ghi_du_lieu_excel(du_lieu)
+                db.session.commit()
+            except Exception:
+                ket_qua['so_dong_loi'] += len(lo)
+                raise
+            ket_qua['so_dong'] += len(lo)
+            ket_qua['so_dong_loi'] += int(du_lieu['loi'].sum())
+            ket_qua['so_cay_moi'] += so_cay_moi
+            ket_qua['so_phieu_nhap'] += so_phieu_nhap
+            ket_qua['so_lo'] += 1
+            if tien_do:
+                tien_do(ket_qua)
+
+        lo = []
+        for row in rows:
+            # Chuẩn hóa độ dài dòng theo dòng tiêu đề
+            row = tuple(row[:so_cot]) + (None,) * (so_cot - len(row))
+            lo.append(row)
+            if len(lo) >= chunk_size:
+                ghi_lo(lo)
+                lo = []
+        if lo:
+            ghi_lo(lo)
+    except Exception as e:
+        db.session.rollback()
+        ket_qua['loi'] = str(e)
+        import traceback
+        traceback.print_exc()
+    finally:
+        rows.close()
+    return ket_qua
+
+# Import chạy nền: lưu file upload vào thư mục tạm, tạo ImportJob rồi import streaming
+# trong thread pool cục bộ; client theo dõi tiến độ qua /api/import-jobs/<id>
+IMPORT_TMP_FOLDER = os.path.join('/tmp' if is_vercel else app.instance_path, 'imports')
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 1))
+_import_executor = None
+
+def _lay_import_executor():
+    """Thread pool chạy import nền (tạo khi cần để không tốn chi phí lúc cold start)"""
+    global _import_executor
+    if _import_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _import_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix='import')
+    return _import_executor
+
+def chay_import_job(job_id, path, filename):
+    """Chạy 1 ImportJob (trong thread nền), cập nhật tiến độ sau mỗi lô"""
+    with app.app_context():
+        try:
+            job = db.session.get(ImportJob, job_id)
+            job.trang_thai = 'dang_chay'
+            job.bat_dau = datetime.now()
+            job.tong_so_dong = uoc_tinh_so_dong(path, filename)
+            db.session.commit()
+
+            def tien_do(ket_qua):
+                job.so_dong = ket_qua['so_dong']
+                job.so_dong_loi = ket_qua['so_dong_loi']
+                job.so_cay_moi = ket_qua['so_cay_moi']
+                job.so_phieu_nhap = ket_qua['so_phieu_nhap']
+                db.session.commit()
+
+            with open(path, 'rb') as f:
+                ket_qua = import_streaming(f, filename, tien_do=tien_do)
+
+            # import_streaming đã rollback nếu lỗi => nạp lại job
+            job = db.session.get(ImportJob, job_id)
+            job.so_dong = ket_qua['so_dong']
+            job.so_dong_loi = ket_qua['so_dong_loi']
+            job.so_cay_moi = ket_qua['so_cay_moi']
+            job.so_phieu_nhap = ket_qua['so_phieu_nhap']
+            if ket_qua['loi'] == 'thieu_cot':
+                job.trang_thai = 'loi'
+                job.loi = 'File Excel phải có các cột: Tên hàng, Số lượng, Giá tiền, Ngày (Phí ship là tùy chọn)'
+            elif ket_qua['loi']:
+                job.trang_thai = 'loi'
+                job.loi = ket_qua['loi']
+            else:
+                job.trang_thai = 'xong'
+            job.ket_thuc = datetime.now()
+            db.session.commit()
+            if ket_qua['so_lo']:
+                xoa_cache_dashboard()
+                xoa_goi_y_index()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error running import job {job_id}: {e}")
+            import traceback
+            traceback.print_exc()
+            try:
+                job = db.session.get(ImportJob, job_id)
+                job.trang_thai = 'loi'
+                job.loi = str(e)
+                job.ket_thuc = datetime.now()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def tao_import_job(file):
+    """Lưu file upload vào thư mục tạm, tạo ImportJob và đưa vào hàng đợi; trả về job"""
+    os.makedirs(IMPORT_TMP_FOLDER, exist_ok=True)
+    filename = secure_filename(file.filename) or 'import.xlsx'
+    job = ImportJob(ten_file=file.filename, trang_thai='cho')
+    db.session.add(job)
+    db.session.commit()
+
+    path = os.path.join(IMPORT_TMP_FOLDER, f"{job.id}_{filename}")
+    file.save(path)
+    _lay_import_executor().submit(chay_import_job, job.id, path, filename)
+    return job
+
+def import_job_to_dict(job):
+    """Trạng thái ImportJob dạng JSON (kèm % hoàn thành và thời gian còn lại ước tính)"""
+    phan_tram = None
+    eta_giay = None
+    if job.trang_thai == 'xong':
+        phan_tram = 100
+        eta_giay = 0
+    elif job.tong_so_dong:
+        phan_tram = min(round(job.so_dong * 100 / job.tong_so_dong, 1), 100)
+        if job.bat_dau and job.so_dong:
+            da_chay = (datetime.now() - job.bat_dau).total_seconds()
+            con_lai = max(job.tong_so_dong - job.so_dong, 0)
+            eta_giay = round(da_chay / job.so_dong * con_lai, 1)
+    return {
+        'id': job.id,
+        'ten_file': job.ten_file,
+        'trang_thai': job.trang_thai,
+        'tong_so_dong': job.tong_so_dong,
+        'so_dong': job.so_dong,
+        'so_dong_loi': job.so_dong_loi,
+        'so_cay_moi': job.so_cay_moi,
+        'so_phieu_nhap': job.so_phieu_nhap,
+        'phan_tram': phan_tram,
+        'eta_giay': eta_giay,
+        'loi': job.loi,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'bat_dau': job.bat_dau.isoformat() if job.bat_dau else None,
+        'ket_thuc': job.ket_thuc.isoformat() if job.ket_thuc else None,
+    }
+
+# Phân trang keyset (cursor) cho lịch sử: WHERE (ngày, created_at, id) < cursor ORDER BY ... DESC LIMIT n
+# => trang nào cũng tốn như trang 1, không OFFSET và không COUNT(*) mỗi request
+LICH_SU_COUNT_TTL = 300  # Tổng số dòng lịch sử chỉ cần gần đúng => cache 5 phút
+LICH_SU_PER_PAGE = 50
+
+class KeysetPage:
+    """1 trang kết quả phân trang keyset"""
+
+    def __init__(self, items, per_page, tu, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.tu = tu  # Số thứ tự (0-based) của dòng đầu tiên trong trang
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+def ma_hoa_cursor(ngay, created_at, *khoa_khac):
+    """Mã hóa khóa (ngày, created_at, ...) thành chuỗi an toàn cho URL"""
+    import base64
+    import json
+    raw = json.dumps([ngay.isoformat(), created_at.isoformat() if created_at else None, *khoa_khac])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def giai_ma_cursor(cursor):
+    """Giải mã cursor, trả về tuple (ngày, created_at, ...) hoặc None nếu cursor không hợp lệ"""
+    if not cursor:
+        return None
+    import base64
+    import json
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        ngay, created_at, *khoa_khac = json.loads(raw)
+        if not khoa_khac:
+            return None
+        return (
+            date.fromisoformat(ngay),
+            datetime.fromisoformat(created_at) if created_at else None,
+            *khoa_khac,
+        )
+    except Exception:
+        return None
+
+def dem_gan_dung(model):
+    """Tổng số dòng của bảng (cache LICH_SU_COUNT_TTL giây, không đếm lại mỗi request)"""
+    return dashboard_cache.get_or_set(
+        f'lich_su:so_dong:{model.__tablename__}',
+        lambda: model.query.count(),
+        ttl=LICH_SU_COUNT_TTL
+    )
+
+def phan_trang_keyset(query, cot, after=None, before=None, per_page=50, tu=0):
+    """Phân trang query theo khóa cot = (ngày, created_at, ..., id), mới nhất trước
+
+    after: cursor của dòng cuối trang trước (đi tới trang sau)
+    before: cursor của dòng đầu trang hiện tại (quay lại trang trước)
+    """
+    after = giai_ma_cursor(after)
+    before = giai_ma_cursor(before)
+    # Cursor phải khớp số cột khóa, nếu không coi như trang đầu
+    if after and len(after) != len(cot):
+        after = None
+    if before and len(before) != len(cot):
+        before = None
+
+    rows = query_trang_keyset(query, cot, after, before, per_page).all()
+    return _tao_trang_keyset(rows, [c.key for c in cot], after, before, per_page, tu)
+
+def query_trang_keyset(query, cot, after=None, before=None, per_page=50):
+    """Query lấy per_page + 1 dòng của 1 trang keyset (after/before là cursor đã giải mã)"""
+    khoa = db.tuple_(*cot)
+    if before:
+        # Đi ngược: lấy các dòng mới hơn theo thứ tự tăng dần rồi đảo lại
+        return query.filter(khoa > before).order_by(*[c.asc() for c in cot]).limit(per_page + 1)
+    if after:
+        query = query.filter(khoa < after)
+    return query.order_by(*[c.desc() for c in cot]).limit(per_page + 1)
+
+def _tao_trang_keyset(rows, ten_cot, after, before, per_page, tu):
+    """KeysetPage từ tối đa per_page + 1 dòng đã sắp xếp (tăng dần nếu đi ngược bằng before)"""
+    if before:
+        co_trang_truoc = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        co_trang_sau = True
+        tu = max(tu - len(rows), 0)
+    else:
+        co_trang_sau = len(rows) > per_page
+        rows = rows[:per_page]
+        co_trang_truoc = after is not None
+
+    def cursor_cua(row):
+        return ma_hoa_cursor(*(getattr(row, ten) for ten in ten_cot))
+
+    return KeysetPage(
+        rows, per_page, tu,
+        next_cursor=cursor_cua(rows[-1]) if rows and co_trang_sau else None,
+        prev_cursor=cursor_cua(rows[0]) if rows and co_trang_truoc else None,
+    )
+
+# Dòng thời gian nhập + xuất: khóa keyset (ngày, created_at, loai, id), trang lấy từng nhánh theo index
+# rồi trộn, export đọc UNION ALL 2 bảng
+# (id của 2 bảng có thể trùng nhau nên khóa phải có thêm loai)
+EXPORT_BATCH_SIZE = 1000
+
+def bien_dong_subquery(tu_ngay=None, den_ngay=None):
+    """Subquery UNION ALL tất cả phiếu nhập và xuất (kèm mã cây, loại cây)"""
+    nhap, xuat = (query for _, query, _ in cac_nhanh_bien_dong(tu_ngay, den_ngay))
+    return nhap.union_all(xuat).subquery('bien_dong')
+
+def cac_nhanh_bien_dong(tu_ngay=None, den_ngay=None):
+    """[(loai, query, cột khóa (ngày, created_at, id))] của nhánh nhập và nhánh xuất
+
+    Lọc ngày theo khoảng nửa mở [tu_ngay, den_ngay + 1 ngày) để dùng được index.
+    """
+    from datetime import timedelta
+
+    def loc_ngay(query, cot_ngay):
+        if tu_ngay:
+            query = query.filter(cot_ngay >= tu_ngay)
+        if den_ngay:
+            query = query.filter(cot_ngay < den_ngay + timedelta(days=1))
+        return query
+
+    nhap = loc_ngay(db.session.query(
+        db.literal('nhap').label('loai'),
+        NhapKho.id.label('id'),
+        NhapKho.ngay_nhap.label('ngay'),
+        NhapKho.created_at.label('created_at'),
+        CayXanh.ma_cay.label('ma_cay'),
+        CayXanh.loai_cay.label('loai_cay'),
+        NhapKho.so_luong.label('so_luong'),
+        NhapKho.gia_nhap.label('gia_nhap'),
+        NhapKho.phi_ship.label('phi_ship'),
+        NhapKho.tong_tien.label('tong_tien'),
+        db.null().label('ly_do'),
+        NhapKho.ghi_chu.label('ghi_chu'),
+    ).join(CayXanh, NhapKho.cay_xanh_id == CayXanh.id), NhapKho.ngay_nhap)
+
+    xuat = loc_ngay(db.session.query(
+        db.literal('xuat').label('loai'),
+        XuatKho.id.label('id'),
+        XuatKho.ngay_xuat.label('ngay'),
+        XuatKho.created_at.label('created_at'),
+        CayXanh.ma_cay.label('ma_cay'),
+        CayXanh.loai_cay.label('loai_cay'),
+        XuatKho.so_luong.label('so_luong'),
+        db.null().label('gia_nhap'),
+        db.null().label('phi_ship'),
+        db.null().label('tong_tien'),
+        XuatKho.ly_do.label('ly_do'),
+        XuatKho.ghi_chu.label('ghi_chu'),
+    ).join(CayXanh, XuatKho.cay_xanh_id == CayXanh.id), XuatKho.ngay_xuat)
+
+    return [
+        ('nhap', nhap, (NhapKho.ngay_nhap, NhapKho.created_at, NhapKho.id)),
+        ('xuat', xuat, (XuatKho.ngay_xuat, XuatKho.created_at, XuatKho.id)),
+    ]
+
+def _dieu_kien_keyset_nhanh(cot, loai, cursor, lon_hon):
+    """Điều kiện khóa (ngày, created_at, loai, id) <hoặc> cursor viết trên cột của 1 nhánh (loai cố định)"""
+    ngay, created_at, loai_cursor, id_cursor = cursor
+    if loai == loai_cursor:
+        khoa, gia_tri = db.tuple_(*cot), (ngay, created_at, id_cursor)
+        return khoa > gia_tri if lon_hon else khoa < gia_tri
+    # Khác loai: cùng (ngày, created_at) thì thứ tự do loai quyết định
+    khoa, gia_tri = db.tuple_(*cot[:2]), (ngay, created_at)
+    if lon_hon:
+        return khoa >= gia_tri if loai > loai_cursor else khoa > gia_tri
+    return khoa <= gia_tri if loai < loai_cursor else khoa < gia_tri
+
+def phan_trang_bien_dong(after=None, before=None, per_page=50, tu=0):
+    """Phân trang dòng thời gian nhập + xuất theo (ngày, created_at, loai, id), mới nhất trước
+
+    Mỗi nhánh lấy tối đa per_page + 1 dòng theo index của bảng đó (điều kiện cursor,
+    ORDER BY, LIMIT nằm trong từng nhánh), rồi trộn 2 danh sách ngắn trong Python
+    => không phải đọc và sắp xếp cả lịch sử như khi phân trang trên UNION ALL.
+    """
+    after = giai_ma_cursor(after)
+    before = giai_ma_cursor(before)
+    if after and len(after) != 4:
+        after = None
+    if before and len(before) != 4:
+        before = None
+
+    rows = []
+    for _, query in cac_query_trang_bien_dong(after, before, per_page):
+        rows.extend(query.all())
+    rows.sort(key=lambda r: (r.ngay, r.created_at, r.loai, r.id), reverse=not before)
+    return _tao_trang_keyset(rows[:per_page + 1], ['ngay', 'created_at', 'loai', 'id'], after, before, per_page, tu)
+
+def cac_query_trang_bien_dong(after=None, before=None, per_page=50):
+    """[(loai, query)] từng nhánh của 1 trang dòng thời gian (after/before là cursor đã giải mã)"""
+    cursor = before or after
+    cac_query = []
+    for loai, query, cot in cac_nhanh_bien_dong():
+        if cursor:
+            query = query.filter(_dieu_kien_keyset_nhanh(cot, loai, cursor, lon_hon=bool(before)))
+        thu_tu = [c.asc() if before else c.desc() for c in cot]
+        cac_query.append((loai, query.order_by(*thu_tu).limit(per_page + 1)))
+    return cac_query
+
+def query_lich_su(loai):
+    """(query, cột khóa keyset) của trang lịch sử nhập hoặc xuất"""
+    # joinedload: lấy luôn CayXanh trong cùng câu query (template dùng nhap.cay_xanh.*)
+    if loai == 'nhap':
+        return NhapKho.query.options(db.joinedload(NhapKho.cay_xanh)), (NhapKho.ngay_nhap, NhapKho.created_at, NhapKho.id)
+    return XuatKho.query.options(db.joinedload(XuatKho.cay_xanh)), (XuatKho.ngay_xuat, XuatKho.created_at, XuatKho.id)
+
+def cot_khoa_bien_dong(bien_dong):
+    """Các cột khóa keyset của dòng thời gian"""
+    return (bien_dong.c.ngay, bien_dong.c.created_at, bien_dong.c.loai, bien_dong.c.id)
+
+COT_BIEN_DONG = ['loai', 'ngay', 'ma_cay', 'loai_cay', 'so_luong', 'gia_nhap', 'phi_ship',
+                 'tong_tien', 'ly_do', 'ghi_chu', 'created_at', 'id']
+
+def doc_bien_dong(tu_ngay=None, den_ngay=None, batch_size=EXPORT_BATCH_SIZE):
+    """Generator trả về từng dòng biến động theo thứ tự thời gian (cũ -> mới), đọc theo lô"""
+    bien_dong = bien_dong_subquery(tu_ngay, den_ngay)
+    stmt = db.select(*[bien_dong.c[c] for c in COT_BIEN_DONG]).order_by(
+        *[c.asc() for c in cot_khoa_bien_dong(bien_dong)]
+    ).execution_options(stream_results=True, yield_per=batch_size)
+    # stream_results: PostgreSQL dùng server-side cursor, không nạp hết kết quả vào bộ nhớ
+    for row in db.session.execute(stmt):
+        yield row
+
+def _gia_tri_export(value):
+    """Chuyển giá trị sang dạng ghi được ra JSON/CSV"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+def stream_bien_dong_csv(rows):
+    """Generator các đoạn text CSV (có BOM để Excel đọc đúng tiếng Việt)"""
+    import csv
+    import io
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')
+    writer.writerow(COT_BIEN_DONG)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_gia_tri_export(getattr(row, c)) for c in COT_BIEN_DONG])
+        if i % EXPORT_BATCH_SIZE == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+def stream_bien_dong_json(rows):
+    """Generator các đoạn text của 1 mảng JSON"""
+    import json
+    yield '['
+    for i, row in enumerate(rows):
+        item = json.dumps({c: _gia_tri_export(getattr(row, c)) for c in COT_BIEN_DONG}, ensure_ascii=False)
+        yield item if i == 0 else ',' + item
+    yield ']'
+
+# Cập nhật tồn kho nguyên tử: 1 câu UPDATE có điều kiện, không đọc-sửa-ghi trong Python
+# => nhiều request xuất hàng đồng thời không thể bán vượt tồn kho
+def _cap_nhat_ton_kho(cay_id, thay_doi, dieu_kien=None):
+    """UPDATE cayxanh SET ton_kho = ton_kho + :thay_doi WHERE id = :id [AND dieu_kien] RETURNING ton_kho
+
+    Trả về tồn kho mới, hoặc None nếu không có dòng nào thỏa điều kiện.
+    """
+    bang = CayXanh.__table__
+    stmt = bang.update().where(bang.c.id == cay_id)
+    if dieu_kien is not None:
+        stmt = stmt.where(dieu_kien)
+    stmt = stmt.values(ton_kho=bang.c.ton_kho + thay_doi, updated_at=datetime.now())
+
+    if db.engine.dialect.update_returning:
+        return db.session.execute(stmt.returning(bang.c.ton_kho)).scalar()
+
+    # Database không hỗ trợ RETURNING: đọc lại trong cùng transaction
+    if db.session.execute(stmt).rowcount == 0:
+        return None
+    return db.session.execute(db.select(bang.c.ton_kho).where(bang.c.id == cay_id)).scalar()
+
+def tru_ton_kho(cay_id, so_luong):
+    """Trừ tồn kho nếu còn đủ hàng; trả về tồn kho mới hoặc None nếu không đủ"""
+    bang = CayXanh.__table__
+    return _cap_nhat_ton_kho(cay_id, -so_luong, bang.c.ton_kho >= so_luong)
+
+def cong_ton_kho(cay_id, so_luong):
+    """Cộng tồn kho; trả về tồn kho mới"""
+    return _cap_nhat_ton_kho(cay_id, so_luong)
+
+# Tồn kho cuối ngày: mỗi cây có 1 dòng cho mỗi ngày có biến động (ton_cuoi = tồn sau ngày đó)
+# => "tồn kho ngày X của mọi cây" = dòng gần nhất <= X của từng cây, 1 query dùng primary key
+def ghi_ton_kho_ngay(bien_dong):
+    """Áp dụng biến động [(cay_xanh_id, ngay, thay_doi), ...] lên bảng ton_kho_ngay (chưa commit)
+
+    Ngày chưa có dòng thì tạo từ tồn cuối của ngày gần nhất trước đó, sau đó cộng
+    thay_doi vào dòng của ngày đó và mọi ngày sau (nhập/xuất lùi ngày vẫn đúng).
+    """
+    gop = {}
+    for cay_id, ngay, thay_doi in bien_dong:
+        if isinstance(ngay, datetime):
+            ngay = ngay.date()
+        gop[(cay_id, ngay)] = gop.get((cay_id, ngay), 0.0) + float(thay_doi)
+    if not gop:
+        return
+
+    bang = TonKhoNgay.__table__
+    truoc = bang.alias('truoc')
+    ton_truoc = db.select(truoc.c.ton_cuoi).where(
+        truoc.c.cay_xanh_id == db.bindparam('b_cay_id'), truoc.c.ngay < db.bindparam('b_ngay')
+    ).order_by(truoc.c.ngay.desc()).limit(1).scalar_subquery()
+    chon = db.select(
+        db.bindparam('b_cay_id', type_=db.Integer), db.bindparam('b_ngay', type_=db.Date),
+        func.coalesce(ton_truoc, 0.0)
+    )
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert_insert
+        tao_dong = upsert_insert(bang).from_select(
+            ['cay_xanh_id', 'ngay', 'ton_cuoi'], chon.where(db.true())
+        ).on_conflict_do_nothing()
+    else:
+        da_co = db.select(bang.c.ngay).where(
+            bang.c.cay_xanh_id == db.bindparam('b_cay_id'), bang.c.ngay == db.bindparam('b_ngay')
+        )
+        tao_dong = bang.insert().from_select(['cay_xanh_id', 'ngay', 'ton_cuoi'], chon.where(~da_co.exists()))
+
+    # Tạo dòng theo thứ tự ngày tăng dần để ngày sau lấy được tồn của ngày trước trong cùng lô
+    thu_tu = sorted(gop, key=lambda k: (k[1], k[0]))
+    db.session.execute(tao_dong, [{'b_cay_id': cay_id, 'b_ngay': ngay} for cay_id, ngay in thu_tu])
+    db.session.execute(
+        bang.update().where(
+            bang.c.cay_xanh_id == db.bindparam('b_cay_id'), bang.c.ngay >= db.bindparam('b_ngay')
+        ).values(ton_cuoi=bang.c.ton_cuoi + db.bindparam('b_thay_doi')),
+        [{'b_cay_id': cay_id, 'b_ngay': ngay, 'b_thay_doi': gop[(cay_id, ngay)]} for cay_id, ngay in thu_tu]
+    )
+
+def _cac_lo_cay(cay_ids, so_tham_so=1):
+    """Các lô id cây cho việc tính lại: [None] = mọi cây; mỗi id dùng so_tham_so tham số trong 1 câu lệnh"""
+    if cay_ids is None:
+        return [None]
+    return list(_chia_lo(sorted(set(cay_ids)), _kich_thuoc_lo(so_tham_so)))
+
+def _loc_cay(cot, lo):
+    """Điều kiện lọc theo lô id cây (không lọc nếu lo là None)"""
+    return [cot.in_(lo)] if lo is not None else []
+
+def xay_dung_lai_ton_kho_ngay(cay_ids=None):
+    """Tính lại bảng ton_kho_ngay (mọi cây hoặc chỉ cay_ids) từ lịch sử nhập/xuất, trả về số dòng (chưa commit)"""
+    so_dong = 0
+    for lo in _cac_lo_cay(cay_ids, so_tham_so=2):
+        nhap = db.select(
+            NhapKho.cay_xanh_id.label('cay_xanh_id'), NhapKho.ngay_nhap.label('ngay'), NhapKho.so_luong.label('thay_doi')
+        ).where(*_loc_cay(NhapKho.cay_xanh_id, lo))
+        xuat = db.select(
+            XuatKho.cay_xanh_id.label('cay_xanh_id'), XuatKho.ngay_xuat.label('ngay'), (-XuatKho.so_luong).label('thay_doi')
+        ).where(*_loc_cay(XuatKho.cay_xanh_id, lo))
+        bd = nhap.union_all(xuat).subquery('bien_dong')
+        rows = db.session.execute(
+            db.select(bd.c.cay_xanh_id, bd.c.ngay, func.sum(bd.c.thay_doi))
+            .group_by(bd.c.cay_xanh_id, bd.c.ngay)
+            .order_by(bd.c.cay_xanh_id, bd.c.ngay)
+        )
+
+        snapshot = []
+        cay_truoc, ton = None, 0.0
+        for cay_id, ngay, thay_doi in rows:
+            if cay_id != cay_truoc:
+                cay_truoc, ton = cay_id, 0.0
+            ton += thay_doi or 0
+            snapshot.append({'cay_xanh_id': cay_id, 'ngay': ngay, 'ton_cuoi': ton})
+
+        db.session.execute(TonKhoNgay.__table__.delete().where(*_loc_cay(TonKhoNgay.cay_xanh_id, lo)))
+        for lo_snapshot in _chia_lo(snapshot):
+            db.session.execute(db.insert(TonKhoNgay.__table__), lo_snapshot)
+        so_dong += len(snapshot)
+    doi_chieu_ton_kho_ngay(cay_ids)
+    return so_dong
+
+def doi_chieu_ton_kho_ngay(cay_ids=None):
+    """Khớp tồn cuối trong ton_kho_ngay với cayxanh.ton_kho, trả về số cây được điều chỉnh (chưa commit)
+
+    Tồn kho ghi đè trực tiếp (Import Excel) không có trong lịch sử nhập/xuất: phần chênh lệch
+    được ghi vào ngày cập nhật cuối của cây (và các ngày sau đó).
+    """
+    ton_cuoi = db.select(TonKhoNgay.ton_cuoi).where(
+        TonKhoNgay.cay_xanh_id == CayXanh.id
+    ).order_by(TonKhoNgay.ngay.desc()).limit(1).correlate(CayXanh).scalar_subquery()
+    chenh_lech = []
+    for lo in _cac_lo_cay(cay_ids):
+        for cay_id, ton_kho, updated_at, ton_cuoi_cay in db.session.query(
+            CayXanh.id, CayXanh.ton_kho, CayXanh.updated_at, func.coalesce(ton_cuoi, 0.0)
+        ).filter(*_loc_cay(CayXanh.id, lo)):
+            if abs((ton_kho or 0) - ton_cuoi_cay) > 1e-9:
+                ngay = updated_at.date() if updated_at else date.today()
+                chenh_lech.append((cay_id, ngay, (ton_kho or 0) - ton_cuoi_cay))
+    ghi_ton_kho_ngay(chenh_lech)
+    return len(chenh_lech)
+
+def ton_kho_theo_ngay(ngay):
+    """Tồn kho cuối ngày `ngay` của mọi cây: [(ma_cay, loai_cay, ton_kho)], 1 câu query"""
+    gan_nhat = db.select(func.max(TonKhoNgay.ngay)).where(
+        TonKhoNgay.cay_xanh_id == CayXanh.id, TonKhoNgay.ngay <= ngay
+    ).correlate(CayXanh).scalar_subquery()
+    return db.session.query(
+        CayXanh.ma_cay, CayXanh.loai_cay, func.coalesce(TonKhoNgay.ton_cuoi, 0.0).label('ton_kho')
+    ).outerjoin(
+        TonKhoNgay, db.and_(TonKhoNgay.cay_xanh_id == CayXanh.id, TonKhoNgay.ngay == gan_nhat)
+    ).order_by(CayXanh.loai_cay).all()
+
+@app.cli.command('rebuild-ton-kho-ngay')
+def rebuild_ton_kho_ngay_command():
+    """Tính lại bảng tồn kho cuối ngày từ lịch sử nhập/xuất"""
+    so_dong = xay_dung_lai_ton_kho_ngay()
+    db.session.commit()
+    print(f"✓ Rebuilt ton_kho_ngay: {so_dong} rows")
+
+# Giá vốn tính dần: mỗi cây có 1 dòng gia_von_cay (bình quân gia quyền + tổng FIFO)
+# và các lô hàng lo_hang còn tồn (FIFO). Đơn giá lô đã gồm phí ship phân bổ.
+# Nhập/xuất cập nhật ngay khi ghi => báo cáo giá vốn chỉ đọc 1 dòng mỗi cây.
+def _tao_gia_von_cay(cay_ids):
+    """Tạo dòng gia_von_cay (giá trị 0) cho các cây chưa có"""
+    cay_ids = set(cay_ids)
+    da_co = set()
+    for lo in _chia_lo(list(cay_ids)):
+        da_co.update(id_ for (id_,) in db.session.query(GiaVonCay.cay_xanh_id).filter(GiaVonCay.cay_xanh_id.in_(lo)))
+    moi = [{'cay_xanh_id': id_, 'updated_at': datetime.now()} for id_ in sorted(cay_ids - da_co)]
+    if moi:
+        db.session.execute(db.insert(GiaVonCay.__table__), moi)
+
+def ghi_gia_von_nhap(phieu_nhap):
+    """Thêm lô hàng FIFO và cộng giá trị bình quân cho các phiếu nhập (chưa commit)"""
+    lo_hang = [
+        {'cay_xanh_id': p['cay_xanh_id'], 'ngay_nhap': p['ngay_nhap'],
+         'don_gia': float(p['tong_tien']) / float(p['so_luong']), 'so_luong_con': float(p['so_luong'])}
+        for p in phieu_nhap if p['so_luong'] > 0
+    ]
+    if not lo_hang:
+        return
+
+    _tao_gia_von_cay(l['cay_xanh_id'] for l in lo_hang)
+    for lo in _chia_lo(lo_hang):
+        db.session.execute(db.insert(LoHang.__table__), lo)
+
+    tang = {}
+    for l in lo_hang:
+        so_luong, gia_tri = tang.get(l['cay_xanh_id'], (0.0, 0.0))
+        tang[l['cay_xanh_id']] = (so_luong + l['so_luong_con'], gia_tri + l['so_luong_con'] * l['don_gia'])
+    bang = GiaVonCay.__table__
+    db.session.execute(
+        bang.update().where(bang.c.cay_xanh_id == db.bindparam('b_id')).values(
+            so_luong=bang.c.so_luong + db.bindparam('b_so_luong'),
+            gia_tri_binh_quan=bang.c.gia_tri_binh_quan + db.bindparam('b_gia_tri'),
+            gia_tri_fifo=bang.c.gia_tri_fifo + db.bindparam('b_gia_tri'),
+            updated_at=datetime.now()
+        ),
+        [{'b_id': id_, 'b_so_luong': sl, 'b_gia_tri': gt} for id_, (sl, gt) in tang.items()]
+    )
+
+def ghi_gia_von_xuat(phieu_xuat):
+    """Tính giá vốn cho các phiếu xuất: trừ lô FIFO cũ nhất trước, trừ giá trị theo đơn giá bình quân"""
+    giam = {}
+    for p in phieu_xuat:
+        if p['so_luong'] > 0:
+            giam[p['cay_xanh_id']] = giam.get(p['cay_xanh_id'], 0.0) + float(p['so_luong'])
+    if not giam:
+        return
+
+    _tao_gia_von_cay(giam)
+
+    # FIFO: đọc các lô còn hàng của mọi cây trong 1 query, trừ dần từ lô cũ nhất
+    gia_von_fifo = dict.fromkeys(giam, 0.0)
+    con_lai = dict(giam)
+    cap_nhat_lo = []
+    for lo in _chia_lo(list(giam)):
+        for lo_hang in LoHang.query.filter(
+            LoHang.cay_xanh_id.in_(lo), LoHang.so_luong_con > 0
+        ).order_by(LoHang.cay_xanh_id, LoHang.ngay_nhap, LoHang.id).with_for_update():
+            lay = min(con_lai[lo_hang.cay_xanh_id], lo_hang.so_luong_con)
+            if lay <= 0:
+                continue
+            con_lai[lo_hang.cay_xanh_id] -= lay
+            gia_von_fifo[lo_hang.cay_xanh_id] += lay * lo_hang.don_gia
+            cap_nhat_lo.append({'b_id': lo_hang.id, 'b_so_luong_con': lo_hang.so_luong_con - lay})
+    # Xuất vượt số lượng còn trong các lô (vd. tồn kho nhập tay từ Excel): phần vượt không có giá vốn
+    if cap_nhat_lo:
+        bang_lo = LoHang.__table__
+        db.session.execute(
+            bang_lo.update().where(bang_lo.c.id == db.bindparam('b_id'))
+            .values(so_luong_con=db.bindparam('b_so_luong_con')),
+            cap_nhat_lo
+        )
+
+    # Bình quân gia quyền: giá vốn = giá trị tồn × số lượng xuất / số lượng tồn (tính trong SQL, không đọc-sửa-ghi)
+    bang = GiaVonCay.__table__
+    so_luong_xuat = db.bindparam('b_so_luong')
+    gia_von_bq = db.case(
+        (bang.c.so_luong <= 0, 0.0),
+        (bang.c.so_luong <= so_luong_xuat, bang.c.gia_tri_binh_quan),
+        else_=bang.c.gia_tri_binh_quan * so_luong_xuat / bang.c.so_luong
+    )
+    db.session.execute(
+        bang.update().where(bang.c.cay_xanh_id == db.bindparam('b_id')).values(
+            gia_von_binh_quan=bang.c.gia_von_binh_quan + gia_von_bq,
+            gia_tri_binh_quan=bang.c.gia_tri_binh_quan - gia_von_bq,
+            so_luong=db.case((bang.c.so_luong > so_luong_xuat, bang.c.so_luong - so_luong_xuat), else_=0.0),
+            gia_von_fifo=bang.c.gia_von_fifo + db.bindparam('b_fifo'),
+            gia_tri_fifo=bang.c.gia_tri_fifo - db.bindparam('b_fifo'),
+            updated_at=datetime.now()
+        ),
+        [{'b_id': id_, 'b_so_luong': sl, 'b_fifo': gia_von_fifo[id_]} for id_, sl in giam.items()]
+    )
+
+def xay_dung_lai_gia_von(cay_ids=None):
+    """Tính lại gia_von_cay và lo_hang (mọi cây hoặc chỉ cay_ids) từ lịch sử nhập/xuất theo thứ tự ngày,
+    trả về số cây (chưa commit)"""
+    so_cay = 0
+    for lo in _cac_lo_cay(cay_ids, so_tham_so=2):
+        so_cay += _xay_dung_lai_gia_von_lo(lo)
+    return so_cay
+
+def _xay_dung_lai_gia_von_lo(lo):
+    """Tính lại gia_von_cay và lo_hang cho 1 lô id cây (None = mọi cây)"""
+    nhap = db.select(
+        NhapKho.cay_xanh_id.label('cay_xanh_id'), NhapKho.ngay_nhap.label('ngay'),
+        NhapKho.created_at.label('created_at'), db.literal(0).label('thu_tu'), NhapKho.id.label('id'),
+        NhapKho.so_luong.label('so_luong'), NhapKho.tong_tien.label('tong_tien')
+    ).where(*_loc_cay(NhapKho.cay_xanh_id, lo))
+    xuat = db.select(
+        XuatKho.cay_xanh_id.label('cay_xanh_id'), XuatKho.ngay_xuat.label('ngay'),
+        XuatKho.created_at.label('created_at'), db.literal(1).label('thu_tu'), XuatKho.id.label('id'),
+        XuatKho.so_luong.label('so_luong'), db.null().label('tong_tien')
+    ).where(*_loc_cay(XuatKho.cay_xanh_id, lo))
+    bd = nhap.union_all(xuat).subquery('bien_dong')
+    rows = db.session.execute(
+        db.select(bd.c.cay_xanh_id, bd.c.ngay, bd.c.thu_tu, bd.c.so_luong, bd.c.tong_tien)
+        .order_by(bd.c.cay_xanh_id, bd.c.ngay, bd.c.created_at, bd.c.thu_tu, bd.c.id)
+    )
+
+    trang_thai = {}
+    lo_con = {}
+    for cay_id, ngay, thu_tu, so_luong, tong_tien in rows:
+        so_luong = so_luong or 0
+        if so_luong <= 0:
+            continue
+        tt = trang_thai.setdefault(cay_id, {
+            'cay_xanh_id': cay_id, 'so_luong': 0.0, 'gia_tri_binh_quan': 0.0, 'gia_von_binh_quan': 0.0,
+            'gia_tri_fifo': 0.0, 'gia_von_fifo': 0.0, 'updated_at': datetime.now()
+        })
+        cac_lo = lo_con.setdefault(cay_id, [])
+        if thu_tu == 0:
+            gia_tri = tong_tien or 0
+            cac_lo.append({'cay_xanh_id': cay_id, 'ngay_nhap': ngay, 'don_gia': gia_tri / so_luong,
+                           'so_luong_con': so_luong})
+            tt['so_luong'] += so_luong
+            tt['gia_tri_binh_quan'] += gia_tri
+            tt['gia_tri_fifo'] += gia_tri
+            continue
+
+        # Phiếu xuất: cùng công thức với ghi_gia_von_xuat
+        if tt['so_luong'] <= 0:
+            gia_von_bq = 0.0
+        elif tt['so_luong'] <= so_luong:
+            gia_von_bq = tt['gia_tri_binh_quan']
+        else:
+            gia_von_bq = tt['gia_tri_binh_quan'] * so_luong / tt['so_luong']
+        tt['gia_von_binh_quan'] += gia_von_bq
+        tt['gia_tri_binh_quan'] -= gia_von_bq
+        tt['so_luong'] = max(tt['so_luong'] - so_luong, 0.0)
+
+        con_lai = so_luong
+        while con_lai > 0 and cac_lo:
+            lo_dau = cac_lo[0]
+            lay = min(con_lai, lo_dau['so_luong_con'])
+            con_lai -= lay
+            lo_dau['so_luong_con'] -= lay
+            tt['gia_von_fifo'] += lay * lo_dau['don_gia']
+            tt['gia_tri_fifo'] -= lay * lo_dau['don_gia']
+            if lo_dau['so_luong_con'] <= 0:
+                cac_lo.pop(0)
+
+    db.session.execute(LoHang.__table__.delete().where(*_loc_cay(LoHang.cay_xanh_id, lo)))
+    db.session.execute(GiaVonCay.__table__.delete().where(*_loc_cay(GiaVonCay.cay_xanh_id, lo)))
+    for lo_ghi in _chia_lo(list(trang_thai.values())):
+        db.session.execute(db.insert(GiaVonCay.__table__), lo_ghi)
+    for lo_ghi in _chia_lo([l for cac_lo in lo_con.values() for l in cac_lo]):
+        db.session.execute(db.insert(LoHang.__table__), lo_ghi)
+    return len(trang_thai)
+
+@app.cli.command('rebuild-gia-von')
+def rebuild_gia_von_command():
+    """Tính lại giá vốn (bình quân, FIFO) từ lịch sử nhập/xuất"""
+    so_cay = xay_dung_lai_gia_von()
+    db.session.commit()
+    print(f"✓ Rebuilt gia_von_cay: {so_cay} trees")
+
+# Biến động theo tháng: mỗi cây 1 dòng/tháng (nhập, xuất, giá trị nhập), cập nhật khi ghi phiếu
+# => số liệu tháng và biểu đồ theo tháng chỉ đọc vài dòng, không quét bảng nhapkho/xuatkho
+def dau_thang(ngay):
+    """Ngày đầu tháng của `ngay` (khóa tháng trong bảng bien_dong_thang)"""
+    return date(ngay.year, ngay.month, 1)
+
+def ghi_bien_dong_thang(bien_dong):
+    """Cộng [(cay_xanh_id, ngay, so_luong_nhap, so_luong_xuat, gia_tri_nhap), ...] vào bien_dong_thang (chưa commit)"""
+    gop = {}
+    for cay_id, ngay, nhap, xuat, gia_tri in bien_dong:
+        khoa = (cay_id, dau_thang(ngay))
+        cu = gop.get(khoa, (0.0, 0.0, 0.0))
+        gop[khoa] = (cu[0] + float(nhap), cu[1] + float(xuat), cu[2] + float(gia_tri))
+    if not gop:
+        return
+
+    bang = BienDongThang.__table__
+    rows = [
+        {'cay_xanh_id': cay_id, 'thang': thang, 'so_luong_nhap': nhap, 'so_luong_xuat': xuat, 'gia_tri_nhap': gia_tri}
+        for (cay_id, thang), (nhap, xuat, gia_tri) in sorted(gop.items())
+    ]
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert_insert
+        for lo in _chia_lo(rows, _kich_thuoc_lo(len(rows[0]))):
+            stmt = upsert_insert(bang).values(lo)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[bang.c.cay_xanh_id, bang.c.thang],
+                set_={
+                    'so_luong_nhap': bang.c.so_luong_nhap + stmt.excluded.so_luong_nhap,
+                    'so_luong_xuat': bang.c.so_luong_xuat + stmt.excluded.so_luong_xuat,
+                    'gia_tri_nhap': bang.c.gia_tri_nhap + stmt.excluded.gia_tri_nhap,
+                }
+            )
+            db.session.execute(stmt)
+        return
+
+    # Database khác: tạo dòng còn thiếu rồi cộng dồn bằng UPDATE
+    da_co = set(db.session.query(BienDongThang.cay_xanh_id, BienDongThang.thang).filter(
+        BienDongThang.cay_xanh_id.in_({r['cay_xanh_id'] for r in rows}),
+        BienDongThang.thang.in_({r['thang'] for r in rows})
+    ).all())
+    moi = [r for r in rows if (r['cay_xanh_id'], r['thang']) not in da_co]
+    cu = [
+        {'b_id': r['cay_xanh_id'], 'b_thang': r['thang'], 'b_nhap': r['so_luong_nhap'],
+         'b_xuat': r['so_luong_xuat'], 'b_gia_tri': r['gia_tri_nhap']}
+        for r in rows if (r['cay_xanh_id'], r['thang']) in da_co
+    ]
+    if moi:
+        db.session.execute(db.insert(bang), moi)
+    if cu:
+        db.session.execute(
+            bang.update().where(
+                bang.c.cay_xanh_id == db.bindparam('b_id'), bang.c.thang == db.bindparam('b_thang')
+            ).values(
+                so_luong_nhap=bang.c.so_luong_nhap + db.bindparam('b_nhap'),
+                so_luong_xuat=bang.c.so_luong_xuat + db.bindparam('b_xuat'),
+                gia_tri_nhap=bang.c.gia_tri_nhap + db.bindparam('b_gia_tri'),
+            ),
+            cu
+        )
+
+def xay_dung_lai_bien_dong_thang(cay_ids=None):
+    """Tính lại bảng bien_dong_thang (mọi cây hoặc chỉ cay_ids) từ lịch sử nhập/xuất, trả về số dòng (chưa commit)"""
+    so_dong = 0
+    for lo in _cac_lo_cay(cay_ids):
+        nhap = db.session.query(
+            NhapKho.cay_xanh_id, NhapKho.ngay_nhap, func.sum(NhapKho.so_luong), func.sum(NhapKho.tong_tien)
+        ).filter(*_loc_cay(NhapKho.cay_xanh_id, lo)).group_by(NhapKho.cay_xanh_id, NhapKho.ngay_nhap)
+        xuat = db.session.query(
+            XuatKho.cay_xanh_id, XuatKho.ngay_xuat, func.sum(XuatKho.so_luong)
+        ).filter(*_loc_cay(XuatKho.cay_xanh_id, lo)).group_by(XuatKho.cay_xanh_id, XuatKho.ngay_xuat)
+
+        db.session.execute(BienDongThang.__table__.delete().where(*_loc_cay(BienDongThang.cay_xanh_id, lo)))
+        ghi_bien_dong_thang(
+            [(cay_id, ngay, so_luong or 0, 0, tong_tien or 0) for cay_id, ngay, so_luong, tong_tien in nhap] +
+            [(cay_id, ngay, 0, so_luong or 0, 0) for cay_id, ngay, so_luong in xuat]
+        )
+        so_dong += BienDongThang.query.filter(*_loc_cay(BienDongThang.cay_xanh_id, lo)).count()
+    return so_dong
+
+def thong_ke_theo_thang(tu_thang, den_thang=None):
+    """Tổng nhập/xuất/giá trị nhập của mọi cây theo từng tháng trong [tu_thang, den_thang]"""
+    query = db.session.query(
+        BienDongThang.thang,
+        func.sum(BienDongThang.so_luong_nhap).label('so_luong_nhap'),
+        func.sum(BienDongThang.so_luong_xuat).label('so_luong_xuat'),
+        func.sum(BienDongThang.gia_tri_nhap).label('gia_tri_nhap'),
+    ).filter(BienDongThang.thang >= dau_thang(tu_thang))
+    if den_thang:
+        query = query.filter(BienDongThang.thang <= dau_thang(den_thang))
+    return query.group_by(BienDongThang.thang).order_by(BienDongThang.thang).all()
+
+@app.cli.command('rebuild-bien-dong-thang')
+def rebuild_bien_dong_thang_command():
+    """Tính lại bảng biến động theo tháng từ lịch sử nhập/xuất"""
+    so_dong = xay_dung_lai_bien_dong_thang()
+    db.session.commit()
+    print(f"✓ Rebuilt bien_dong_thang: {so_dong} rows")
+
+# Số liệu tổng hợp cập nhật mỗi lần ghi phiếu nhập/xuất
+def ghi_so_lieu_nhap(phieu_nhap):
+    """Cập nhật tồn kho cuối ngày, biến động tháng, giá vốn cho các phiếu nhập (dict cay_xanh_id, so_luong, tong_tien, ngay_nhap)"""
+    phieu_nhap = list(phieu_nhap)
+    ghi_ton_kho_ngay((p['cay_xanh_id'], p['ngay_nhap'], p['so_luong']) for p in phieu_nhap)
+    ghi_bien_dong_thang((p['cay_xanh_id'], p['ngay_nhap'], p['so_luong'], 0, p['tong_tien']) for p in phieu_nhap)
+    ghi_gia_von_nhap(phieu_nhap)
+
+def ghi_so_lieu_xuat(phieu_xuat):
+    """Cập nhật tồn kho cuối ngày, biến động tháng, giá vốn cho các phiếu xuất (dict cay_xanh_id, so_luong, ngay_xuat)"""
+    phieu_xuat = list(phieu_xuat)
+    ghi_ton_kho_ngay((p['cay_xanh_id'], p['ngay_xuat'], -p['so_luong']) for p in phieu_xuat)
+    ghi_bien_dong_thang((p['cay_xanh_id'], p['ngay_xuat'], 0, p['so_luong'], 0) for p in phieu_xuat)
+    ghi_gia_von_xuat(phieu_xuat)
+
+def xay_dung_lai_so_lieu(cay_ids=None):
+    """Tính lại mọi bảng số liệu tổng hợp (mọi cây hoặc chỉ cay_ids) từ lịch sử nhập/xuất (chưa commit)"""
+    xay_dung_lai_ton_kho_ngay(cay_ids)
+    xay_dung_lai_gia_von(cay_ids)
+    xay_dung_lai_bien_dong_thang(cay_ids)
+
+def xoa_so_lieu_cay(cay_id):
+    """Xóa số liệu tổng hợp của 1 cây (trước khi xóa cây)"""
+    for model in (TonKhoNgay, BienDongThang, LoHang, GiaVonCay):
+        model.query.filter_by(cay_xanh_id=cay_id).delete(synchronize_session=False)
+
+# Nhập/xuất hàng loạt: nhiều dòng trong 1 request, 1 transaction
+MAX_DONG_HANG_LOAT = 1000
+
+def _doc_so(value, ten, mac_dinh=0.0):
+    """Đọc số từ JSON, báo lỗi rõ ràng nếu không hợp lệ"""
+    if value is None or value == '':
+        return mac_dinh
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{ten} không hợp lệ: {value}')
+
+def _doc_chuoi(value, ten):
+    """Đọc chuỗi từ JSON (None/'' => ''), báo lỗi nếu không phải chuỗi"""
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f'{ten} phải là chuỗi: {value}')
+    return value.strip()
+
+def _doc_ngay(value, mac_dinh):
+    """Đọc ngày YYYY-MM-DD từ JSON (dùng mac_dinh nếu trống)"""
+    if not value:
+        return mac_dinh
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError(f'Ngày không hợp lệ: {value}')
+
+def _lay_cay_theo_ma(ma_cays, *cot):
+    """{ma_cay: row(cot...)} cho danh sách mã cây (IN theo lô để tránh giới hạn tham số)"""
+    ket_qua = {}
+    ma_cays = list(ma_cays)
+    for lo in _chia_lo(ma_cays):
+        for row in db.session.query(CayXanh.ma_cay, *cot).filter(CayXanh.ma_cay.in_(lo)):
+            ket_qua[row.ma_cay] = row
+    return ket_qua
+
+def nhap_hang_loat(lines, ngay_mac_dinh=None, ghi_chu_mac_dinh=''):
+    """Ghi nhiều dòng nhập hàng theo kiểu tất cả hoặc không (chưa commit)
+
+    Trả về (thanh_cong, ket_qua_tung_dong). Nếu có dòng lỗi thì không ghi gì cả.
+    """
+    ngay_mac_dinh = ngay_mac_dinh or date.today()
+    ket_qua = []
+    hop_le = []
+    for i, line in enumerate(lines):
+        try:
+            if not isinstance(line, dict):
+                raise ValueError('Dòng phải là object JSON')
+            ma_cay = _doc_chuoi(line.get('ma_cay'), 'Mã cây')
+            if not ma_cay:
+                raise ValueError('Thiếu mã cây')
+            so_luong = _doc_so(line.get('so_luong'), 'Số lượng')
+            if so_luong <= 0:
+                raise ValueError('Số lượng phải lớn hơn 0')
+            gia_nhap = _doc_so(line.get('gia_nhap'), 'Giá nhập')
+            phi_ship = _doc_so(line.get('phi_ship'), 'Phí ship')
+            if gia_nhap < 0 or phi_ship < 0:
+                raise ValueError('Giá nhập và phí ship không được âm')
+            hop_le.append({
+                'dong': i, 'ma_cay': ma_cay, 'loai_cay': _doc_chuoi(line.get('loai_cay'), 'Loại cây') or None,
+                'so_luong': so_luong, 'gia_nhap': gia_nhap, 'phi_ship': phi_ship,
+                'ngay_nhap': _doc_ngay(line.get('ngay_nhap'), ngay_mac_dinh),
+                'ghi_chu': _doc_chuoi(line.get('ghi_chu', ghi_chu_mac_dinh), 'Ghi chú'),
+            })
+            ket_qua.append({'dong': i, 'ma_cay': ma_cay, 'success': True, 'message': 'Nhập hàng thành công!'})
+        except ValueError as e:
+            ket_qua.append({'dong': i, 'ma_cay': line.get('ma_cay') if isinstance(line, dict) else None,
+                            'success': False, 'message': str(e)})
+
+    # Tìm tất cả cây trong 1 query
+    cay_theo_ma = _lay_cay_theo_ma({l['ma_cay'] for l in hop_le}, CayXanh.id, CayXanh.loai_cay)
+
+    # Tên mới nhất của mỗi mã cây (dòng sau ghi đè dòng trước)
+    ten_moi = {l['ma_cay']: l['loai_cay'] for l in hop_le if l['loai_cay']}
+
+    # Cây chưa có phải có loại cây
+    for l in hop_le:
+        if l['ma_cay'] not in cay_theo_ma and l['ma_cay'] not in ten_moi:
+            ket_qua[l['dong']].update(success=False, message='Cây mới phải có loại cây')
+    if not all(r['success'] for r in ket_qua):
+        return False, ket_qua
+
+    bay_gio = datetime.now()
+    cay_moi = [
+        {'ma_cay': ma_cay, 'loai_cay': ten_moi[ma_cay], 'ton_kho': 0.0,
+         'tim_kiem': tao_chuoi_tim_kiem(ma_cay, ten_moi[ma_cay]), 'created_at': bay_gio, 'updated_at': bay_gio}
+        for ma_cay in dict.fromkeys(l['ma_cay'] for l in hop_le) if ma_cay not in cay_theo_ma
+    ]
+    doi_ten = [
+        {'b_id': row.id, 'b_loai_cay': ten_moi[ma_cay], 'b_tim_kiem': tao_chuoi_tim_kiem(ma_cay, ten_moi[ma_cay])}
+        for ma_cay, row in cay_theo_ma.items() if ma_cay in ten_moi and ten_moi[ma_cay] != row.loai_cay
+    ]
+
+    # Tạo cây mới hàng loạt rồi lấy id
+    if cay_moi:
+        for lo in _chia_lo(cay_moi):
+            db.session.execute(db.insert(CayXanh.__table__), lo)
+        cay_theo_ma.update(_lay_cay_theo_ma([c['ma_cay'] for c in cay_moi], CayXanh.id, CayXanh.loai_cay))
+
+    bang = CayXanh.__table__
+    if doi_ten:
+        db.session.execute(
+            bang.update().where(bang.c.id == db.bindparam('b_id')).values(
+                loai_cay=db.bindparam('b_loai_cay'), tim_kiem=db.bindparam('b_tim_kiem'), updated_at=bay_gio
+            ), doi_ten
+        )
+
+    # Phiếu nhập hàng loạt
+    phieu_nhap = [
+        {'cay_xanh_id': cay_theo_ma[l['ma_cay']].id, 'so_luong': l['so_luong'], 'gia_nhap': l['gia_nhap'],
+         'phi_ship': l['phi_ship'], 'tong_tien': l['so_luong'] * l['gia_nhap'] + l['phi_ship'],
+         'ngay_nhap': l['ngay_nhap'], 'ghi_chu': l['ghi_chu'], 'created_at': bay_gio}
+        for l in hop_le
+    ]
+    for lo in _chia_lo(phieu_nhap):
+        db.session.execute(db.insert(NhapKho.__table__), lo)
+    ghi_so_lieu_nhap(phieu_nhap)
+
+    # Cộng tồn kho: gộp theo cây, 1 câu UPDATE (executemany) nguyên tử
+    tang = {}
+    for l in hop_le:
+        cay_id = cay_theo_ma[l['ma_cay']].id
+        tang[cay_id] = tang.get(cay_id, 0.0) + l['so_luong']
+    if tang:
+        db.session.execute(
+            bang.update().where(bang.c.id == db.bindparam('b_id')).values(
+                ton_kho=bang.c.ton_kho + db.bindparam('b_so_luong'), updated_at=bay_gio
+            ), [{'b_id': cay_id, 'b_so_luong': so_luong} for cay_id, so_luong in tang.items()]
+        )
+
+    return True, ket_qua
+
+def bat_dau_savepoint():
+    """db.session.begin_nested() giữ được tính nguyên tử trên SQLite
+
+    pysqlite không tự BEGIN trước SAVEPOINT, khi đó RELEASE sẽ commit luôn => mở transaction trước.
+    """
+    conn = db.session.connection()
+    if conn.dialect.name == 'sqlite' and not conn.connection.driver_connection.in_transaction:
+        conn.exec_driver_sql('BEGIN')
+    return db.session.begin_nested()
+
+def _tru_ton_kho(giam):
+    """Trừ tồn kho {cay_id: số lượng} bằng UPDATE có điều kiện theo lô, False nếu có cây không đủ hàng"""
+    bang = CayXanh.__table__
+    # Mỗi cây dùng 5 tham số: id trong IN và 2 cặp WHEN/THEN (ở SET và WHERE)
+    for lo in _chia_lo(list(giam), _kich_thuoc_lo(5)):
+        so_luong_theo_id = db.case({cay_id: giam[cay_id] for cay_id in lo}, value=bang.c.id)
+        ket_qua_update = db.session.execute(
+            bang.update()
+            .where(bang.c.id.in_(lo), bang.c.ton_kho >= so_luong_theo_id)
+            .values(ton_kho=bang.c.ton_kho - so_luong_theo_id, updated_at=datetime.now())
+        )
+        if ket_qua_update.rowcount != len(lo):
+            return False
+    return True
+
+def xuat_hang_loat(lines, ngay_mac_dinh=None, ly_do_mac_dinh='', ghi_chu_mac_dinh=''):
+    """Ghi nhiều dòng xuất hàng theo kiểu tất cả hoặc không (chưa commit)
+
+    Trả về (thanh_cong, ket_qua_tung_dong). Nếu có dòng lỗi thì không ghi gì cả.
+    """
+    ngay_mac_dinh = ngay_mac_dinh or date.today()
+    ket_qua = []
+    hop_le = []
+    for i, line in enumerate(lines):
+        try:
+            if not isinstance(line, dict):
+                raise ValueError('Dòng phải là object JSON')
+            ma_cay = _doc_chuoi(line.get('ma_cay'), 'Mã cây')
+            if not ma_cay:
+                raise ValueError('Thiếu mã cây')
+            so_luong = _doc_so(line.get('so_luong'), 'Số lượng')
+            if so_luong <= 0:
+                raise ValueError('Số lượng phải lớn hơn 0')
+            hop_le.append({
+                'dong': i, 'ma_cay': ma_cay, 'so_luong': so_luong,
+                'ngay_xuat': _doc_ngay(line.get('ngay_xuat'), ngay_mac_dinh),
+                'ly_do': _doc_chuoi(line.get('ly_do', ly_do_mac_dinh), 'Lý do'),
+                'ghi_chu': _doc_chuoi(line.get('ghi_chu', ghi_chu_mac_dinh), 'Ghi chú'),
+            })
+            ket_qua.append({'dong': i, 'ma_cay': ma_cay, 'success': True, 'message': 'Xuất hàng thành công!'})
+        except ValueError as e:
+            ket_qua.append({'dong': i, 'ma_cay': line.get('ma_cay') if isinstance(line, dict) else None,
+                            'success': False, 'message': str(e)})
+
+    def kiem_tra_ton_kho():
+        # Kiểm tra tồn kho mọi dòng bằng 1 query (cộng dồn các dòng cùng mã cây)
+        cay_theo_ma = _lay_cay_theo_ma({l['ma_cay'] for l in hop_le}, CayXanh.id, CayXanh.ton_kho)
+        can_xuat = {}
+        for l in hop_le:
+            can_xuat[l['ma_cay']] = can_xuat.get(l['ma_cay'], 0.0) + l['so_luong']
+        for l in hop_le:
+            cay = cay_theo_ma.get(l['ma_cay'])
+            if cay is None:
+                ket_qua[l['dong']].update(success=False, message='Không tìm thấy mã cây!')
+            elif can_xuat[l['ma_cay']] > (cay.ton_kho or 0):
+                ket_qua[l['dong']].update(
+                    success=False,
+                    message=f"Tồn kho không đủ! Hiện có: {cay.ton_kho or 0}, cần xuất: {can_xuat[l['ma_cay']]}"
+                )
+        return cay_theo_ma, can_xuat
+
+    for _ in range(2):
+        cay_theo_ma, can_xuat = kiem_tra_ton_kho()
+        if not all(r['success'] for r in ket_qua):
+            return False, ket_qua
+
+        giam = {cay_theo_ma[ma_cay].id: so_luong for ma_cay, so_luong in can_xuat.items()}
+        savepoint = bat_dau_savepoint()
+        if _tru_ton_kho(giam):
+            savepoint.commit()
+            break
+        # Tồn kho vừa bị request khác thay đổi: chỉ hủy phần trừ kho (giữ việc khác trong session),
+        # kiểm tra lại theo số liệu mới (đánh dấu dòng không đủ hàng) rồi thử lại 1 lần nếu vẫn đủ
+        savepoint.rollback()
+    else:
+        for l in hop_le:
+            ket_qua[l['dong']].update(success=False, message='Tồn kho vừa thay đổi, vui lòng thử lại!')
+        return False, ket_qua
+
+    bay_gio = datetime.now()
+    phieu_xuat = [
+        {'cay_xanh_id': cay_theo_ma[l['ma_cay']].id, 'so_luong': l['so_luong'], 'ngay_xuat': l['ngay_xuat'],
+         'ly_do': l['ly_do'], 'ghi_chu': l['ghi_chu'], 'created_at': bay_gio}
+        for l in hop_le
+    ]
+    for lo in _chia_lo(phieu_xuat):
+        db.session.execute(db.insert(XuatKho.__table__), lo)
+    ghi_so_lieu_xuat(phieu_xuat)
+    return True, ket_qua
+
+# Kiểm tra các query hay dùng có dùng index không (EXPLAIN), chạy: flask --app app explain-queries
+def cac_query_thuong_dung():
+    """[(tên, statement)] các query nóng trên nhapkho/xuatkho"""
+    from datetime import timedelta
+    cay_id = db.session.query(CayXanh.id).limit(1).scalar() or 1
+    hom_nay = date.today()
+    cac_query = [
+        ('Lịch sử nhập của 1 cây', NhapKho.query.filter_by(cay_xanh_id=cay_id).order_by(
+            NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc()).statement),
+        ('Lịch sử xuất của 1 cây', XuatKho.query.filter_by(cay_xanh_id=cay_id).order_by(
+            XuatKho.ngay_xuat.desc(), XuatKho.created_at.desc()).statement),
+        ('Giá nhập mới nhất của 1 cây', NhapKho.query.filter_by(cay_xanh_id=cay_id).order_by(
+            NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc(), NhapKho.id.desc()).limit(1).statement),
+        ('Tổng số lượng nhập của 1 cây', db.session.query(func.sum(NhapKho.so_luong)).filter_by(
+            cay_xanh_id=cay_id).statement),
+        ('Nhập gần đây (dashboard)', db.session.query(NhapKho.id).order_by(
+            NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc()).limit(10).statement),
+        ('Xuất gần đây (dashboard)', db.session.query(XuatKho.id).order_by(
+            XuatKho.ngay_xuat.desc(), XuatKho.created_at.desc()).limit(10).statement),
+        ('Phiếu nhập 30 ngày', db.session.query(NhapKho.id).filter(
+            NhapKho.ngay_nhap >= hom_nay - timedelta(days=30), NhapKho.ngay_nhap < hom_nay + timedelta(days=1)
+        ).statement),
+    ]
+
+    # Đúng các query trang /lich-su chạy: trang đầu, trang sau (after) và trang trước (before)
+    bay_gio = datetime.now()
+    cac_trang = [('trang đầu', {}), ('trang sau', {'after': True}), ('trang trước', {'before': True})]
+    for loai in ('nhap', 'xuat'):
+        query, cot = query_lich_su(loai)
+        for ten_trang, huong in cac_trang:
+            cursor = {k: (hom_nay, bay_gio, 1) for k in huong}
+            cac_query.append((f'Lịch sử {loai} - {ten_trang}', query_trang_keyset(
+                query, cot, per_page=LICH_SU_PER_PAGE, **cursor).statement))
+    for ten_trang, huong in cac_trang:
+        cursor = {k: (hom_nay, bay_gio, 'nhap', 1) for k in huong}
+        for loai, query in cac_query_trang_bien_dong(per_page=LICH_SU_PER_PAGE, **cursor):
+            cac_query.append((f'Lịch sử all ({loai}) - {ten_trang}', query.statement))
+    return cac_query
+
+def explain_query(stmt):
+    """Kế hoạch thực thi của 1 statement: danh sách dòng text"""
+    dialect = db.engine.dialect.name
+    tien_to = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}.get(dialect, 'EXPLAIN ')
+    compiled = stmt.compile(dialect=db.engine.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[k] for k in compiled.positiontup)
+    rows = db.session.connection().exec_driver_sql(tien_to + str(compiled), params).all()
+    return [' '.join(str(v) for v in (row[-1:] if dialect == 'sqlite' else row)) for row in rows]
+
+def quet_ca_bang(ke_hoach, bang=('nhapkho', 'xuatkho')):
+    """Kế hoạch có quét toàn bộ bảng nhapkho/xuatkho không dùng index không"""
+    for dong in ke_hoach:
+        for ten in bang:
+            # SQLite: "SCAN nhapkho" (không có USING INDEX); PostgreSQL: "Seq Scan on nhapkho"
+            if dong.startswith(f'SCAN {ten}') and 'USING' not in dong:
+                return True
+            if f'Seq Scan on {ten}' in dong:
+                return True
+    return False
+
+def sap_xep_tam(ke_hoach):
+    """Kế hoạch có sắp xếp lại kết quả hoặc quét subquery (không đọc theo thứ tự index) không"""
+    for dong in ke_hoach:
+        # SQLite: "USE TEMP B-TREE FOR ORDER BY", "SCAN anon_1"; PostgreSQL: node "Sort", "Subquery Scan"
+        if 'TEMP B-TREE' in dong or 'Sort' in dong.split() or 'Subquery Scan' in dong:
+            return True
+        if dong.startswith('SCAN ') and 'USING' not in dong:
+            return True
+    return False
+
+@app.cli.command('explain-queries')
+def explain_queries_command():
+    """In kế hoạch thực thi các query nóng, báo lỗi nếu có query quét toàn bảng hoặc phải sắp xếp lại"""
+    co_loi = False
+    for ten, stmt in cac_query_thuong_dung():
+        ke_hoach = explain_query(stmt)
+        loi = quet_ca_bang(ke_hoach) or sap_xep_tam(ke_hoach)
+        co_loi = co_loi or loi
+        print(f"{'✗' if loi else '✓'} {ten}")
+        for dong in ke_hoach:
+            print(f"    {dong}")
+    if co_loi:
+        raise SystemExit(1)
+
+@app.cli.command('don-anh')
+@click.option('--thu-gom', is_flag=True, help='Xóa cả file trong storage không cây nào dùng')
+def don_anh_command(thu_gom):
+    """Xóa các ảnh trong outbox anh_can_xoa (chạy định kỳ bằng cron nếu muốn)"""
+    da_xoa, so_loi = don_anh_can_xoa()
+    print(f"✓ Deleted {da_xoa} images from outbox ({so_loi} failed)")
+    con_lai = AnhCanXoa.query.filter(AnhCanXoa.so_lan_thu >= ANH_XOA_TOI_DA_LAN_THU).count()
+    if con_lai:
+        print(f"⚠ {con_lai} images failed {ANH_XOA_TOI_DA_LAN_THU} times, see anh_can_xoa.loi")
+    if thu_gom:
+        print(f"✓ Removed {thu_gom_anh_mo_coi()} orphaned files")
+
+@app.cli.command('startup-time')
+@click.option('--module', default='app', help='Module cần đo (vd. api.index cho Vercel)')
+@click.option('--top', default=10, help='Số dòng hiển thị mỗi bảng')
+def startup_time_command(module, top):
+    """Đo thời gian import (cold start) trong process mới, báo lỗi nếu vượt COLD_START_BUDGET_MS"""
+    from startup_timing import bao_cao, goi_y_loi
+    try:
+        _, vuot, dong = bao_cao(module, top=top)
+    except RuntimeError as e:
+        print('\n'.join(goi_y_loi(module, e)))
+        raise SystemExit(1)
+    print('\n'.join(dong))
+    if vuot:
+        raise SystemExit(1)
+
 # Template context processor để sử dụng helper functions trong templates
 @app.context_processor
 def utility_processor():
@@ -326,10 +2306,15 @@ def utility_processor():
         """Helper function để check Blob URL trong templates"""
         return is_blob_url(url)
     
-    def get_image_url(hinh_anh):
-        """Helper function để lấy URL ảnh (Blob URL hoặc local URL)"""
+    def get_image_url(hinh_anh, kich_thuoc=None, hinh_anh_bien_the=None):
+        """Helper function để lấy URL ảnh (Blob URL hoặc local URL)
+
+        kich_thuoc='thumb'/'medium' dùng ảnh biến thể nếu đã tạo xong, không thì dùng ảnh gốc.
+        """
         if not hinh_anh:
             return None
+        if kich_thuoc:
+            hinh_anh = doc_bien_the_anh(hinh_anh_bien_the).get(kich_thuoc, hinh_anh)
         if is_blob_url(hinh_anh):
             return hinh_anh
         # Local file: extract filename và tạo URL
@@ -338,16 +2323,82 @@ def utility_processor():
     
     return dict(is_blob_url=is_blob_url_template, get_image_url=get_image_url)
 
-# Routes
-@app.route('/')
-def index():
-    # Ensure database tables exist
+# Cache thống kê dashboard: phục vụ từ bộ nhớ, chỉ tính lại khi dữ liệu thay đổi
+# (nhập/xuất/xóa cây/import Excel gọi xoa_cache_dashboard sau khi commit)
+DASHBOARD_CACHE_KEY = 'dashboard:thong_ke'
+DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 300))
+dashboard_cache = CacheStore(LRUCache(maxsize=16, ttl=DASHBOARD_CACHE_TTL))
+
+def xoa_cache_dashboard():
+    """Xóa thống kê dashboard đã cache (gọi sau mỗi lần commit thay đổi dữ liệu)"""
     try:
-        db.create_all()
+        dashboard_cache.delete(DASHBOARD_CACHE_KEY)
     except Exception as e:
-        print(f"Warning: Could not ensure tables exist: {e}")
-    
-    # Dashboard statistics
+        print(f"Warning: Could not invalidate dashboard cache: {e}")
+
+# Gợi ý cây (autocomplete): index tiền tố trong bộ nhớ trên ma_cay/loai_cay (bỏ dấu).
+# Cập nhật từng cây sau mỗi lần ghi; nạp lại toàn bộ sau import hoặc sau GOI_Y_INDEX_TTL giây
+# (để thấy thay đổi từ process khác).
+GOI_Y_INDEX_TTL = int(os.environ.get('GOI_Y_INDEX_TTL', 300))
+goi_y_index = PrefixIndex(chuan_hoa=bo_dau)
+_goi_y_nap_luc = None
+
+def _lay_goi_y_index():
+    """Index gợi ý, nạp lại từ database (1 query) nếu chưa có hoặc đã cũ"""
+    global _goi_y_nap_luc
+    if _goi_y_nap_luc is None or time.monotonic() - _goi_y_nap_luc > GOI_Y_INDEX_TTL:
+        goi_y_index.nap_lai(
+            (ma_cay, (ma_cay, loai_cay), {'loai_cay': loai_cay, 'ton_kho': ton_kho or 0})
+            for ma_cay, loai_cay, ton_kho in db.session.query(CayXanh.ma_cay, CayXanh.loai_cay, CayXanh.ton_kho)
+        )
+        _goi_y_nap_luc = time.monotonic()
+    return goi_y_index
+
+def cap_nhat_goi_y(ma_cays):
+    """Cập nhật index gợi ý cho các cây vừa thay đổi (gọi sau khi commit)"""
+    if _goi_y_nap_luc is None:
+        return  # Chưa nạp: lần dùng đầu tiên sẽ nạp đủ
+    try:
+        ma_cays = set(ma_cays)
+        cay_theo_ma = _lay_cay_theo_ma(ma_cays, CayXanh.loai_cay, CayXanh.ton_kho)
+        for ma_cay in ma_cays:
+            cay = cay_theo_ma.get(ma_cay)
+            if cay is None:
+                goi_y_index.xoa(ma_cay)
+            else:
+                goi_y_index.cap_nhat(
+                    ma_cay, (ma_cay, cay.loai_cay), {'loai_cay': cay.loai_cay, 'ton_kho': cay.ton_kho or 0}
+                )
+    except Exception as e:
+        print(f"Warning: Could not update typeahead index: {e}")
+        xoa_goi_y_index()
+
+def xoa_goi_y_index():
+    """Đánh dấu index gợi ý cần nạp lại (sau import Excel)"""
+    global _goi_y_nap_luc
+    _goi_y_nap_luc = None
+
+# Cache /api/cay/<ma_cay>: ETag = id cây + updated_at + id phiếu nhập mới nhất (1 query nhẹ).
+# Trình duyệt gửi lại If-None-Match => trả 304; nếu không thì dùng payload JSON đã serialize sẵn.
+API_CAY_CACHE_SIZE = int(os.environ.get('API_CAY_CACHE_SIZE', 512))
+api_cay_cache = CacheStore(LRUCache(maxsize=API_CAY_CACHE_SIZE, ttl=0))
+
+def phien_ban_cay(ma_cay):
+    """(cay_id, etag, last_modified) của 1 cây, hoặc None nếu không có"""
+    nhap_moi_nhat = db.select(func.max(NhapKho.id)).where(
+        NhapKho.cay_xanh_id == CayXanh.id
+    ).correlate(CayXanh).scalar_subquery()
+    row = db.session.query(CayXanh.id, CayXanh.updated_at, nhap_moi_nhat).filter(
+        CayXanh.ma_cay == ma_cay
+    ).first()
+    if row is None:
+        return None
+    cay_id, updated_at, nhap_id = row
+    updated_at = updated_at or datetime(1970, 1, 1)
+    return cay_id, f"{cay_id}-{updated_at.timestamp():.6f}-{nhap_id or 0}", updated_at
+
+def tinh_thong_ke_dashboard():
+    """Tính toàn bộ số liệu dashboard, trả về dict dữ liệu thuần (không chứa ORM object)"""
     try:
         total_cay = CayXanh.query.count()
     except Exception as e:
@@ -361,54 +2412,87 @@ def index():
         total_ton_kho = 0
     
     # Tổng giá trị tồn kho (lấy giá nhập mới nhất của mỗi cây)
-    tong_gia_tri = 0
     try:
-        for cay in CayXanh.query.all():
-            nhap_moi_nhat = NhapKho.query.filter_by(cay_xanh_id=cay.id).order_by(NhapKho.ngay_nhap.desc()).first()
-            if nhap_moi_nhat and nhap_moi_nhat.gia_nhap and cay.ton_kho:
-                tong_gia_tri += float(cay.ton_kho) * float(nhap_moi_nhat.gia_nhap)
+        tong_gia_tri = tong_gia_tri_ton_kho()
     except Exception as e:
         print(f"Error calculating tong_gia_tri: {e}")
         tong_gia_tri = 0
     
-    # Nhập xuất trong tháng
+    # Nhập xuất trong tháng (đọc từ bảng bien_dong_thang)
     thang_hien_tai = datetime.now().month
     nam_hien_tai = datetime.now().year
     
     try:
-        tong_nhap_thang = db.session.query(func.sum(NhapKho.so_luong)).filter(
-            extract('month', NhapKho.ngay_nhap) == thang_hien_tai,
-            extract('year', NhapKho.ngay_nhap) == nam_hien_tai
-        ).scalar() or 0
+        tong_nhap_thang, tong_xuat_thang = db.session.query(
+            func.sum(BienDongThang.so_luong_nhap), func.sum(BienDongThang.so_luong_xuat)
+        ).filter(BienDongThang.thang == date(nam_hien_tai, thang_hien_tai, 1)).one()
+        tong_nhap_thang = tong_nhap_thang or 0
+        tong_xuat_thang = tong_xuat_thang or 0
     except Exception as e:
-        print(f"Error querying tong_nhap_thang: {e}")
+        print(f"Error querying tong_nhap_thang/tong_xuat_thang: {e}")
         tong_nhap_thang = 0
-    
-    try:
-        tong_xuat_thang = db.session.query(func.sum(XuatKho.so_luong)).filter(
-            extract('month', XuatKho.ngay_xuat) == thang_hien_tai,
-            extract('year', XuatKho.ngay_xuat) == nam_hien_tai
-        ).scalar() or 0
-    except Exception as e:
-        print(f"Error querying tong_xuat_thang: {e}")
         tong_xuat_thang = 0
     
     # Top 10 cây có tồn kho cao nhất
-    top_ton_kho = CayXanh.query.order_by(CayXanh.ton_kho.desc()).limit(10).all()
+    top_ton_kho = [
+        {'ma_cay': c.ma_cay, 'loai_cay': c.loai_cay, 'ton_kho': c.ton_kho, 'hinh_anh': c.hinh_anh,
+         'hinh_anh_bien_the': c.hinh_anh_bien_the}
+        for c in CayXanh.query.order_by(CayXanh.ton_kho.desc()).limit(10).all()
+    ]
     
-    # Lịch sử nhập xuất gần đây
-    lich_su_nhap = NhapKho.query.order_by(NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc()).limit(10).all()
-    lich_su_xuat = XuatKho.query.order_by(XuatKho.ngay_xuat.desc(), XuatKho.created_at.desc()).limit(10).all()
+    # Lịch sử nhập xuất gần đây (join sẵn loại cây để không phải lazy load)
+    lich_su_nhap = [
+        {'ngay_nhap': r.ngay_nhap, 'loai_cay': r.loai_cay, 'so_luong': r.so_luong, 'gia_nhap': r.gia_nhap}
+        for r in db.session.query(
+            NhapKho.ngay_nhap, NhapKho.so_luong, NhapKho.gia_nhap, CayXanh.loai_cay
+        ).join(CayXanh, NhapKho.cay_xanh_id == CayXanh.id).order_by(
+            NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc()
+        ).limit(10).all()
+    ]
+    lich_su_xuat = [
+        {'ngay_xuat': r.ngay_xuat, 'loai_cay': r.loai_cay, 'so_luong': r.so_luong, 'ly_do': r.ly_do}
+        for r in db.session.query(
+            XuatKho.ngay_xuat, XuatKho.so_luong, XuatKho.ly_do, CayXanh.loai_cay
+        ).join(CayXanh, XuatKho.cay_xanh_id == CayXanh.id).order_by(
+            XuatKho.ngay_xuat.desc(), XuatKho.created_at.desc()
+        ).limit(10).all()
+    ]
+    
+    return {
+        'thang': (nam_hien_tai, thang_hien_tai),
+        'total_cay': total_cay,
+        'total_ton_kho': total_ton_kho,
+        'tong_gia_tri': tong_gia_tri,
+        'tong_nhap_thang': tong_nhap_thang,
+        'tong_xuat_thang': tong_xuat_thang,
+        'top_ton_kho': top_ton_kho,
+        'lich_su_nhap': lich_su_nhap,
+        'lich_su_xuat': lich_su_xuat,
+    }
+
+def lay_thong_ke_dashboard():
+    """Lấy thống kê dashboard từ cache, tính lại nếu chưa có hoặc đã sang tháng mới"""
+    thong_ke = dashboard_cache.get(DASHBOARD_CACHE_KEY)
+    if thong_ke is None or thong_ke['thang'] != (datetime.now().year, datetime.now().month):
+        thong_ke = tinh_thong_ke_dashboard()
+        dashboard_cache.set(DASHBOARD_CACHE_KEY, thong_ke)
+    return thong_ke
+
+# Routes
+@app.route('/')
+def index():
+    # Dashboard statistics
+    thong_ke = lay_thong_ke_dashboard()
     
     return render_template('index.html',
-                         total_cay=total_cay,
-                         total_ton_kho=total_ton_kho,
-                         tong_gia_tri=tong_gia_tri,
-                         tong_nhap_thang=tong_nhap_thang,
-                         tong_xuat_thang=tong_xuat_thang,
-                         top_ton_kho=top_ton_kho,
-                         lich_su_nhap=lich_su_nhap,
-                         lich_su_xuat=lich_su_xuat)
+                         total_cay=thong_ke['total_cay'],
+                         total_ton_kho=thong_ke['total_ton_kho'],
+                         tong_gia_tri=thong_ke['tong_gia_tri'],
+                         tong_nhap_thang=thong_ke['tong_nhap_thang'],
+                         tong_xuat_thang=thong_ke['tong_xuat_thang'],
+                         top_ton_kho=thong_ke['top_ton_kho'],
+                         lich_su_nhap=thong_ke['lich_su_nhap'],
+                         lich_su_xuat=thong_ke['lich_su_xuat'])
 
 @app.route('/ton-kho')
 def ton_kho():
@@ -419,12 +2503,8 @@ def ton_kho():
     query = CayXanh.query
     
     if search:
-        query = query.filter(
-            db.or_(
-                CayXanh.ma_cay.ilike(f'%{search}%'),
-                CayXanh.loai_cay.ilike(f'%{search}%')
-            )
-        )
+        # Tìm không phân biệt dấu: "cay kim tien" khớp "Cây Kim Tiền"
+        query = loc_tim_kiem(query, search)
     
     pagination = query.order_by(CayXanh.ton_kho.desc()).paginate(
         page=page, per_page=per_page, error_out=False
@@ -470,20 +2550,54 @@ def nhap_hang():
         )
         db.session.add(nhap_kho)
         
-        # Cập nhật tồn kho
-        cay.ton_kho += so_luong
-        cay.updated_at = datetime.now()
-        
         try:
+            # Cập nhật tồn kho (UPDATE nguyên tử, không ghi đè thay đổi của request khác)
+            db.session.flush()
+            cong_ton_kho(cay.id, so_luong)
+            ghi_so_lieu_nhap([{'cay_xanh_id': cay.id, 'so_luong': so_luong, 'tong_tien': tong_tien, 'ngay_nhap': ngay_nhap}])
             db.session.commit()
+            xoa_cache_dashboard()
+            cap_nhat_goi_y([ma_cay])
             return jsonify({'success': True, 'message': 'Nhập hàng thành công!'})
         except Exception as e:
             db.session.rollback()
             return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'})
     
-    # GET: Hiển thị form
-    danh_sach_cay = CayXanh.query.order_by(CayXanh.loai_cay).all()
-    return render_template('nhap_hang.html', danh_sach_cay=danh_sach_cay, today=date.today().strftime('%Y-%m-%d'))
+    # GET: Hiển thị form (danh sách cây gợi ý lấy qua /api/goi-y-cay khi gõ)
+    return render_template('nhap_hang.html', today=date.today().strftime('%Y-%m-%d'))
+
+@app.route('/api/nhap-hang/batch', methods=['POST'])
+def api_nhap_hang_batch():
+    """Nhập nhiều dòng hàng trong 1 request, tất cả hoặc không: {"ngay_nhap": ..., "lines": [{ma_cay, loai_cay, so_luong, gia_nhap, phi_ship}]}"""
+    data = request.get_json(silent=True) or {}
+    lines = data.get('lines')
+    if not isinstance(lines, list) or not lines:
+        return jsonify({'success': False, 'message': 'Thiếu danh sách dòng nhập hàng (lines)!'}), 400
+    if len(lines) > MAX_DONG_HANG_LOAT:
+        return jsonify({'success': False, 'message': f'Tối đa {MAX_DONG_HANG_LOAT} dòng mỗi lần!'}), 400
+    
+    try:
+        ngay_mac_dinh = _doc_ngay(data.get('ngay_nhap'), date.today())
+        thanh_cong, ket_qua = nhap_hang_loat(lines, ngay_mac_dinh, data.get('ghi_chu', ''))
+        if not thanh_cong:
+            db.session.rollback()
+            so_loi = sum(1 for r in ket_qua if not r['success'])
+            return jsonify({
+                'success': False,
+                'message': f'Có {so_loi}/{len(ket_qua)} dòng không hợp lệ, chưa nhập dòng nào.',
+                'lines': ket_qua
+            })
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'})
+    
+    xoa_cache_dashboard()
+    cap_nhat_goi_y(r['ma_cay'] for r in ket_qua)
+    return jsonify({'success': True, 'message': f'Đã nhập {len(ket_qua)} dòng.', 'lines': ket_qua})
 
 @app.route('/xuat-hang', methods=['GET', 'POST'])
 def xuat_hang():
@@ -497,79 +2611,281 @@ def xuat_hang():
         ghi_chu = data.get('ghi_chu', '')
         
         # Tìm cây
-        cay = CayXanh.query.filter_by(ma_cay=ma_cay).first()
-        if not cay:
+        cay_id = db.session.query(CayXanh.id).filter_by(ma_cay=ma_cay).scalar()
+        if not cay_id:
             return jsonify({'success': False, 'message': 'Không tìm thấy mã cây!'})
         
-        # Kiểm tra tồn kho
-        ton_kho_hien_tai = cay.ton_kho or 0
-        if ton_kho_hien_tai < so_luong:
-            return jsonify({'success': False, 'message': f'Tồn kho không đủ! Hiện có: {ton_kho_hien_tai}'})
-        
-        # Tạo phiếu xuất
-        xuat_kho = XuatKho(
-            cay_xanh_id=cay.id,
-            so_luong=so_luong,
-            ngay_xuat=ngay_xuat,
-            ly_do=ly_do,
-            ghi_chu=ghi_chu
-        )
-        db.session.add(xuat_kho)
-        
-        # Cập nhật tồn kho
-        cay.ton_kho -= so_luong
-        cay.updated_at = datetime.now()
-        
         try:
+            # Kiểm tra và trừ tồn kho trong 1 câu UPDATE có điều kiện
+            if tru_ton_kho(cay_id, so_luong) is None:
+                db.session.rollback()
+                ton_kho_hien_tai = db.session.query(CayXanh.ton_kho).filter_by(id=cay_id).scalar() or 0
+                return jsonify({'success': False, 'message': f'Tồn kho không đủ! Hiện có: {ton_kho_hien_tai}'})
+            
+            ghi_so_lieu_xuat([{'cay_xanh_id': cay_id, 'so_luong': so_luong, 'ngay_xuat': ngay_xuat}])
+            
+            # Tạo phiếu xuất
+            xuat_kho = XuatKho(
+                cay_xanh_id=cay_id,
+                so_luong=so_luong,
+                ngay_xuat=ngay_xuat,
+                ly_do=ly_do,
+                ghi_chu=ghi_chu
+            )
+            db.session.add(xuat_kho)
+            
             db.session.commit()
+            xoa_cache_dashboard()
+            cap_nhat_goi_y([ma_cay])
             return jsonify({'success': True, 'message': 'Xuất hàng thành công!'})
         except Exception as e:
             db.session.rollback()
             return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'})
     
-    # GET: Hiển thị form
-    danh_sach_cay = CayXanh.query.filter(
-        db.or_(CayXanh.ton_kho > 0, CayXanh.ton_kho.is_(None))
-    ).order_by(CayXanh.loai_cay).all()
-    # Lọc lại trong Python để xử lý None
-    danh_sach_cay = [c for c in danh_sach_cay if (c.ton_kho or 0) > 0]
-    return render_template('xuat_hang.html', danh_sach_cay=danh_sach_cay, today=date.today().strftime('%Y-%m-%d'))
+    # GET: Hiển thị form (chỉ gợi ý cây còn hàng qua /api/goi-y-cay?con_hang=1)
+    return render_template('xuat_hang.html', today=date.today().strftime('%Y-%m-%d'))
+
+@app.route('/api/xuat-hang/batch', methods=['POST'])
+def api_xuat_hang_batch():
+    """Xuất nhiều dòng hàng (1 đơn hàng) trong 1 request, tất cả hoặc không"""
+    data = request.get_json(silent=True) or {}
+    lines = data.get('lines')
+    if not isinstance(lines, list) or not lines:
+        return jsonify({'success': False, 'message': 'Thiếu danh sách dòng xuất hàng (lines)!'}), 400
+    if len(lines) > MAX_DONG_HANG_LOAT:
+        return jsonify({'success': False, 'message': f'Tối đa {MAX_DONG_HANG_LOAT} dòng mỗi lần!'}), 400
+    
+    try:
+        ngay_mac_dinh = _doc_ngay(data.get('ngay_xuat'), date.today())
+        thanh_cong, ket_qua = xuat_hang_loat(lines, ngay_mac_dinh, data.get('ly_do', ''), data.get('ghi_chu', ''))
+        if not thanh_cong:
+            db.session.rollback()
+            so_loi = sum(1 for r in ket_qua if not r['success'])
+            return jsonify({
+                'success': False,
+                'message': f'Có {so_loi}/{len(ket_qua)} dòng không hợp lệ, chưa xuất dòng nào.',
+                'lines': ket_qua
+            })
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'})
+    
+    xoa_cache_dashboard()
+    cap_nhat_goi_y(r['ma_cay'] for r in ket_qua)
+    return jsonify({'success': True, 'message': f'Đã xuất {len(ket_qua)} dòng.', 'lines': ket_qua})
 
 @app.route('/lich-su')
 def lich_su():
     loai = request.args.get('loai', 'all')  # all, nhap, xuat
-    page = request.args.get('page', 1, type=int)
-    per_page = 50
+    per_page = LICH_SU_PER_PAGE
+    
+    after = request.args.get('after')
+    before = request.args.get('before')
+    tu = request.args.get('tu', 0, type=int)
     
     if loai == 'nhap':
-        pagination = NhapKho.query.order_by(
-            NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc()
-        ).paginate(page=page, per_page=per_page, error_out=False)
+        pagination = phan_trang_keyset(*query_lich_su(loai), after=after, before=before, per_page=per_page, tu=tu)
+        pagination.total = dem_gan_dung(NhapKho)
         return render_template('lich_su_nhap.html', pagination=pagination, loai=loai)
     elif loai == 'xuat':
-        pagination = XuatKho.query.order_by(
-            XuatKho.ngay_xuat.desc(), XuatKho.created_at.desc()
-        ).paginate(page=page, per_page=per_page, error_out=False)
+        pagination = phan_trang_keyset(*query_lich_su(loai), after=after, before=before, per_page=per_page, tu=tu)
+        pagination.total = dem_gan_dung(XuatKho)
         return render_template('lich_su_xuat.html', pagination=pagination, loai=loai)
     else:
-        # Hiển thị cả hai
-        return render_template('lich_su.html', loai=loai)
+        # Hiển thị cả hai: dòng thời gian nhập + xuất
+        pagination = phan_trang_bien_dong(after=after, before=before, per_page=per_page, tu=tu)
+        pagination.total = dem_gan_dung(NhapKho) + dem_gan_dung(XuatKho)
+        return render_template('lich_su.html', pagination=pagination, loai=loai)
+
+@app.route('/lich-su/export')
+def export_lich_su():
+    """Xuất toàn bộ lịch sử nhập xuất (CSV hoặc JSON), stream từng lô không nạp hết vào bộ nhớ"""
+    from flask import Response, stream_with_context
+    dinh_dang = request.args.get('format', 'csv')
+    try:
+        tu_ngay = datetime.strptime(request.args['tu_ngay'], '%Y-%m-%d').date() if request.args.get('tu_ngay') else None
+        den_ngay = datetime.strptime(request.args['den_ngay'], '%Y-%m-%d').date() if request.args.get('den_ngay') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Ngày không hợp lệ (định dạng YYYY-MM-DD)!'}), 400
+    
+    rows = doc_bien_dong(tu_ngay, den_ngay)
+    ten_file = f"lich_su_nhap_xuat_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    if dinh_dang == 'json':
+        return Response(stream_with_context(stream_bien_dong_json(rows)), mimetype='application/json',
+                        headers={'Content-Disposition': f'attachment; filename={ten_file}.json'})
+    return Response(stream_with_context(stream_bien_dong_csv(rows)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={ten_file}.csv'})
 
 @app.route('/api/cay/<path:ma_cay>')
 def api_cay(ma_cay):
     ma_cay = unquote(ma_cay)
     
-    cay = CayXanh.query.filter_by(ma_cay=ma_cay).first()
-    if cay:
-        nhap_moi_nhat = NhapKho.query.filter_by(cay_xanh_id=cay.id).order_by(NhapKho.ngay_nhap.desc()).first()
+    phien_ban = phien_ban_cay(ma_cay)
+    if phien_ban is None:
+        return jsonify({'success': False, 'message': 'Không tìm thấy!'})
+    cay_id, etag, last_modified = phien_ban
+    
+    # Client đã có bản mới nhất
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        cache_key = f'api_cay:{ma_cay}'
+        da_cache = api_cay_cache.get(cache_key)
+        if da_cache and da_cache[0] == etag:
+            payload = da_cache[1]
+        else:
+            cay = db.session.get(CayXanh, cay_id)
+            nhap_moi_nhat = NhapKho.query.filter_by(cay_xanh_id=cay.id).order_by(
+                NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc(), NhapKho.id.desc()
+            ).first()
+            payload = jsonify({
+                'success': True,
+                'ma_cay': cay.ma_cay,
+                'loai_cay': cay.loai_cay,
+                'ton_kho': cay.ton_kho,
+                'gia_nhap_moi_nhat': nhap_moi_nhat.gia_nhap if nhap_moi_nhat else None
+            }).get_data()
+            api_cay_cache.set(cache_key, (etag, payload))
+        response = app.response_class(payload, mimetype='application/json')
+    
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True  # Luôn hỏi lại server, server trả 304 nếu không đổi
+    return response
+
+@app.route('/api/goi-y-cay')
+def api_goi_y_cay():
+    """Gợi ý cây theo tiền tố mã cây/loại cây (không dấu): /api/goi-y-cay?q=buoi&con_hang=1&limit=10"""
+    q = request.args.get('q', '').strip()
+    con_hang = request.args.get('con_hang') in ('1', 'true')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    
+    ket_qua = _lay_goi_y_index().tim(
+        q, limit=limit, loc=(lambda cay: cay['ton_kho'] > 0) if con_hang else None
+    )
+    return jsonify({
+        'success': True,
+        'items': [
+            {'ma_cay': ma_cay, 'loai_cay': cay['loai_cay'], 'ton_kho': cay['ton_kho']}
+            for ma_cay, cay in ket_qua
+        ]
+    })
+
+@app.route('/api/cay-hang-loat', methods=['GET', 'POST'])
+def api_cay_hang_loat():
+    """Tra cứu nhiều mã cây cùng lúc (tồn kho + giá nhập mới nhất) bằng 2 câu query
+
+    GET ?ma_cay=A,B,C hoặc POST {"ma_cay": [...]}; thêm format=array để nhận dạng mảng gọn.
+    """
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    ma_cays = data.get('ma_cay')
+    if ma_cays is None:
+        ma_cays = request.args.get('ma_cay', '').split(',')
+    if not isinstance(ma_cays, list):
+        return jsonify({'success': False, 'message': 'ma_cay phải là danh sách mã cây!'}), 400
+    ma_cays = list(dict.fromkeys(str(m).strip() for m in ma_cays if str(m).strip()))
+    if not ma_cays:
+        return jsonify({'success': False, 'message': 'Thiếu danh sách mã cây!'}), 400
+    if len(ma_cays) > MAX_DONG_HANG_LOAT:
+        return jsonify({'success': False, 'message': f'Tối đa {MAX_DONG_HANG_LOAT} mã cây mỗi lần!'}), 400
+    
+    cay_theo_ma = _lay_cay_theo_ma(ma_cays, CayXanh.id, CayXanh.loai_cay, CayXanh.ton_kho)
+    gia_theo_id = {}
+    cay_ids = [row.id for row in cay_theo_ma.values()]
+    for lo in _chia_lo(cay_ids):
+        gia_moi_nhat = gia_nhap_moi_nhat_subquery(lo)
+        gia_theo_id.update(db.session.query(gia_moi_nhat.c.cay_xanh_id, gia_moi_nhat.c.gia_nhap).all())
+    
+    tim_thay = [m for m in ma_cays if m in cay_theo_ma]
+    khong_tim_thay = [m for m in ma_cays if m not in cay_theo_ma]
+    dinh_dang = data.get('format') or request.args.get('format', 'json')
+    if dinh_dang == 'array':
         return jsonify({
             'success': True,
-            'ma_cay': cay.ma_cay,
-            'loai_cay': cay.loai_cay,
-            'ton_kho': cay.ton_kho,
-            'gia_nhap_moi_nhat': nhap_moi_nhat.gia_nhap if nhap_moi_nhat else None
+            'columns': ['ma_cay', 'loai_cay', 'ton_kho', 'gia_nhap_moi_nhat'],
+            'rows': [
+                [m, cay_theo_ma[m].loai_cay, cay_theo_ma[m].ton_kho, gia_theo_id.get(cay_theo_ma[m].id)]
+                for m in tim_thay
+            ],
+            'not_found': khong_tim_thay
         })
-    return jsonify({'success': False, 'message': 'Không tìm thấy!'})
+    return jsonify({
+        'success': True,
+        'items': {
+            m: {
+                'ma_cay': m,
+                'loai_cay': cay_theo_ma[m].loai_cay,
+                'ton_kho': cay_theo_ma[m].ton_kho,
+                'gia_nhap_moi_nhat': gia_theo_id.get(cay_theo_ma[m].id)
+            }
+            for m in tim_thay
+        },
+        'not_found': khong_tim_thay
+    })
+
+@app.route('/api/ton-kho-theo-ngay')
+def api_ton_kho_theo_ngay():
+    """Tồn kho cuối ngày của mọi cây: /api/ton-kho-theo-ngay?ngay=YYYY-MM-DD"""
+    try:
+        ngay = _doc_ngay(request.args.get('ngay'), date.today())
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'ngay': ngay.isoformat(),
+        'items': [
+            {'ma_cay': ma_cay, 'loai_cay': loai_cay, 'ton_kho': ton_kho}
+            for ma_cay, loai_cay, ton_kho in ton_kho_theo_ngay(ngay)
+        ]
+    })
+
+@app.route('/api/gia-von')
+def api_gia_von():
+    """Giá vốn và giá trị tồn (bình quân, FIFO) của mọi cây, đọc từ bảng gia_von_cay"""
+    rows = db.session.query(CayXanh.ma_cay, CayXanh.loai_cay, GiaVonCay).join(
+        GiaVonCay, GiaVonCay.cay_xanh_id == CayXanh.id
+    ).order_by(CayXanh.loai_cay).all()
+    return jsonify({
+        'success': True,
+        'items': [
+            {
+                'ma_cay': ma_cay,
+                'loai_cay': loai_cay,
+                'so_luong': gv.so_luong,
+                'don_gia_binh_quan': gv.don_gia_binh_quan,
+                'gia_tri_binh_quan': gv.gia_tri_binh_quan,
+                'gia_von_binh_quan': gv.gia_von_binh_quan,
+                'gia_tri_fifo': gv.gia_tri_fifo,
+                'gia_von_fifo': gv.gia_von_fifo,
+            }
+            for ma_cay, loai_cay, gv in rows
+        ]
+    })
+
+@app.route('/api/thong-ke-thang')
+def api_thong_ke_thang():
+    """Nhập/xuất theo tháng cho biểu đồ: /api/thong-ke-thang?so_thang=12"""
+    so_thang = min(max(request.args.get('so_thang', 12, type=int), 1), 120)
+    hom_nay = date.today()
+    thang = hom_nay.year * 12 + hom_nay.month - so_thang
+    tu_thang = date(thang // 12, thang % 12 + 1, 1)
+    return jsonify({
+        'success': True,
+        'items': [
+            {
+                'thang': r.thang.strftime('%Y-%m'),
+                'so_luong_nhap': r.so_luong_nhap or 0,
+                'so_luong_xuat': r.so_luong_xuat or 0,
+                'gia_tri_nhap': r.gia_tri_nhap or 0,
+            }
+            for r in thong_ke_theo_thang(tu_thang, hom_nay)
+        ]
+    })
 
 @app.route('/cay/<path:ma_cay>')
 def chi_tiet_cay(ma_cay):
@@ -583,12 +2899,12 @@ def chi_tiet_cay(ma_cay):
     
     # Lấy lịch sử nhập
     lich_su_nhap = NhapKho.query.filter_by(cay_xanh_id=cay.id).order_by(
-        NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc()
+        NhapKho.ngay_nhap.desc(), NhapKho.created_at.desc(), NhapKho.id.desc()
     ).all()
     
     # Lấy lịch sử xuất
     lich_su_xuat = XuatKho.query.filter_by(cay_xanh_id=cay.id).order_by(
-        XuatKho.ngay_xuat.desc(), XuatKho.created_at.desc()
+        XuatKho.ngay_xuat.desc(), XuatKho.created_at.desc(), XuatKho.id.desc()
     ).all()
     
     # Tính tổng tiền nhập
@@ -600,7 +2916,11 @@ def chi_tiet_cay(ma_cay):
     # Tính tổng số lượng xuất
     tong_so_luong_xuat = db.session.query(func.sum(XuatKho.so_luong)).filter_by(cay_xanh_id=cay.id).scalar() or 0
     
+    # Giá vốn (bình quân/FIFO) đã tính sẵn
+    gia_von = db.session.get(GiaVonCay, cay.id)
+    
     return render_template('chi_tiet_cay.html',
+                         gia_von=gia_von,
                          cay=cay,
                          lich_su_nhap=lich_su_nhap,
                          lich_su_xuat=lich_su_xuat,
@@ -625,27 +2945,19 @@ def xoa_cay(ma_cay):
     ma_cay_value = cay.ma_cay
     
     try:
-        # Xóa ảnh nếu có
-        if cay.hinh_anh:
-            if is_blob_url(cay.hinh_anh):
-                # Xóa từ Blob storage
-                blob_token = os.environ.get('BLOB_READ_WRITE_TOKEN')
-                if blob_token:
-                    delete_from_vercel_blob(cay.hinh_anh, blob_token)
-            else:
-                # Xóa file local
-                old_filename = os.path.basename(cay.hinh_anh)
-                old_path = os.path.join(app.config['UPLOAD_FOLDER'], old_filename)
-                if os.path.exists(old_path):
-                    try:
-                        os.remove(old_path)
-                    except:
-                        pass
+        # Ảnh (kể cả ảnh biến thể) vào outbox, xóa nền nếu không còn cây nào dùng
+        co_anh_xoa = them_anh_can_xoa(cay.hinh_anh, cay.hinh_anh_bien_the)
         
         # Xóa cây (cascade sẽ tự động xóa lịch sử nhập xuất)
+        xoa_so_lieu_cay(cay.id)
         db.session.delete(cay)
         db.session.commit()
         
+        xoa_cache_dashboard()
+        cap_nhat_goi_y([ma_cay_value])
+        if co_anh_xoa:
+            hen_don_anh()
+        
         if request.is_json:
             return jsonify({'success': True, 'message': f'Đã xóa cây {ma_cay_value} ({ten_cay}) thành công!'})
         
@@ -682,66 +2994,42 @@ def upload_anh_cay(ma_cay):
     
     if file and allowed_file(file.filename):
         try:
-            # Tạo tên file an toàn: ma_cay_timestamp.extension
+            # Tên file theo nội dung: sha256.extension => ảnh giống nhau chỉ lưu 1 lần
             filename = secure_filename(file.filename)
             extension = filename.rsplit('.', 1)[1].lower()
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            new_filename = f"{ma_cay}_{timestamp}.{extension}"
-            
-            # Xóa ảnh cũ nếu có
-            if cay.hinh_anh:
-                if is_blob_url(cay.hinh_anh):
-                    # Xóa từ Blob storage
-                    blob_token = os.environ.get('BLOB_READ_WRITE_TOKEN')
-                    if blob_token:
-                        delete_from_vercel_blob(cay.hinh_anh, blob_token)
-                else:
-                    # Xóa file local
-                    old_filename = os.path.basename(cay.hinh_anh)
-                    old_path = os.path.join(app.config['UPLOAD_FOLDER'], old_filename)
-                    if os.path.exists(old_path):
-                        try:
-                            os.remove(old_path)
-                        except:
-                            pass
+            file.seek(0)
+            file_content = file.read()
+            new_filename = f"{hashlib.sha256(file_content).hexdigest()}.{extension}"
+            content_type = file.content_type or f'image/{extension}'
+            anh_cu = (cay.hinh_anh, cay.hinh_anh_bien_the)
             
-            # Upload to Vercel Blob storage nếu có BLOB_READ_WRITE_TOKEN
-            blob_token = os.environ.get('BLOB_READ_WRITE_TOKEN')
-            if blob_token:
-                # Đọc file content
-                file.seek(0)
-                file_content = file.read()
-                
-                # Upload to Blob storage
-                content_type = file.content_type or f'image/{extension}'
-                try:
-                    blob_url = upload_to_vercel_blob(file_content, new_filename, content_type, blob_token)
-                    # Lưu Blob URL vào database
-                    cay.hinh_anh = blob_url
-                except Exception as e:
-                    print(f"Error uploading to Blob storage: {e}")
-                    # Fallback to local storage
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-                    file.seek(0)
-                    file.save(file_path)
-                    if os.environ.get('VERCEL') or os.environ.get('VERCEL_ENV'):
-                        cay.hinh_anh = f"/uploads/images/{new_filename}"
-                    else:
-                        cay.hinh_anh = f"uploads/images/{new_filename}"
+            # Ảnh đã có (cây khác hoặc chính cây này dùng): dùng lại, không upload
+            # (có Blob token thì chỉ dùng lại ảnh đã ở trên Blob)
+            da_co = db.session.query(CayXanh.hinh_anh, CayXanh.hinh_anh_bien_the).filter(
+                CayXanh.hinh_anh.endswith('/' + new_filename)
+            ).first()
+            if da_co and lay_blob_storage() and not is_blob_url(da_co.hinh_anh):
+                da_co = None
+            if da_co:
+                cay.hinh_anh, cay.hinh_anh_bien_the = da_co
             else:
-                # Fallback: Lưu local
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-                file.seek(0)
-                file.save(file_path)
-                
-                # Lưu đường dẫn vào database (relative path)
-                if os.environ.get('VERCEL') or os.environ.get('VERCEL_ENV'):
-                    cay.hinh_anh = f"/uploads/images/{new_filename}"
-                else:
-                    cay.hinh_anh = f"uploads/images/{new_filename}"
+                # Upload lên Vercel Blob (nếu có BLOB_READ_WRITE_TOKEN) ngay trong request:
+                # lỗi thì không đổi ảnh của cây
+                cay.hinh_anh = luu_file_anh(file_content, new_filename, content_type)
+                cay.hinh_anh_bien_the = None
+            
+            # Ảnh cũ (kể cả ảnh biến thể) vào outbox, xóa nền nếu không còn cây nào dùng
+            co_anh_xoa = anh_cu[0] != cay.hinh_anh and them_anh_can_xoa(*anh_cu)
             
             cay.updated_at = datetime.now()
             db.session.commit()
+            xoa_cache_dashboard()
+            if co_anh_xoa:
+                hen_don_anh()
+            
+            # Tạo thumbnail/ảnh vừa trong hàng đợi nền, không chặn request
+            if ho_tro_bien_the() and (not da_co or not cay.hinh_anh_bien_the):
+                hang_doi_anh.submit(tao_bien_the_anh, cay.hinh_anh, file_content)
             
             flash('Upload ảnh thành công!', 'success')
         except RequestEntityTooLarge:
@@ -758,13 +3046,24 @@ def upload_anh_cay(ma_cay):
 def uploaded_file(filename):
     """Serve uploaded images (fallback for local files, Blob URLs are served directly)"""
     upload_folder = app.config['UPLOAD_FOLDER']
-    file_path = os.path.join(upload_folder, filename)
     
-    if os.path.exists(file_path):
-        return send_from_directory(upload_folder, filename)
-    else:
+    # Ảnh lưu theo hash nội dung không bao giờ đổi: cache vĩnh viễn, ETag = hash
+    ten = os.path.splitext(filename)[0]
+    co_dinh = ANH_THEO_NOI_DUNG.match(filename) is not None
+    try:
+        response = send_from_directory(
+            upload_folder, filename,
+            etag=ten if co_dinh else True,
+            max_age=ANH_CACHE_MAX_AGE if co_dinh else None,
+            conditional=True  # If-None-Match => 304, Range => 206
+        )
+    except NotFound:
         # Fallback: trả về 404 hoặc placeholder
         return "Image not found", 404
+    if co_dinh:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
 
 @app.route('/import-excel', methods=['GET', 'POST'])
 def import_excel():
@@ -778,95 +3077,53 @@ def import_excel():
             flash('Không có file được chọn!', 'error')
             return redirect(url_for('import_excel'))
         
+        # File lớn hoặc CSV: import streaming theo từng lô (file .xls cũ vẫn phải đọc bằng pandas)
+        ten_file = file.filename.lower()
+        streaming = (
+            ten_file.endswith('.csv')
+            or (not ten_file.endswith('.xls') and (
+                request.form.get('streaming') or (request.content_length or 0) > STREAMING_IMPORT_THRESHOLD
+            ))
+        )
+        # Mặc định chạy nền: trả về ngay, trang tiến độ tự cập nhật
+        if request.form.get('chay_nen') and not ten_file.endswith('.xls'):
+            try:
+                job = tao_import_job(file)
+            except Exception as e:
+                db.session.rollback()
+                flash(f'Lỗi khi import: {str(e)}', 'error')
+                return redirect(url_for('import_excel'))
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify({'success': True, 'job': import_job_to_dict(job)}), 202
+            return redirect(url_for('import_job_status', job_id=job.id))
+        
+        if streaming:
+            ket_qua = import_streaming(file.stream, ten_file)
+            if ket_qua['so_lo']:
+                xoa_cache_dashboard()
+                xoa_goi_y_index()
+            if ket_qua['loi'] == 'thieu_cot':
+                flash('File Excel phải có các cột: Tên hàng, Số lượng, Giá tiền, Ngày (Phí ship là tùy chọn)', 'error')
+            elif ket_qua['loi']:
+                flash(f"Lỗi khi import: {ket_qua['loi']} (đã import {ket_qua['so_dong']} dòng trước khi lỗi)", 'error')
+            else:
+                flash(f"Import thành công! Đã import {ket_qua['so_cay_moi']} hàng mới và cập nhật tồn kho "
+                      f"({ket_qua['so_dong']} dòng, {ket_qua['so_lo']} lô).", 'success')
+            return redirect(url_for('import_excel'))
+        
         try:
             # Đọc file Excel - format đơn giản: Tên hàng, Số lượng, Giá tiền, Ngày
-            df = pd.read_excel(file)
-            
-            # Tìm các cột (hỗ trợ nhiều tên cột khác nhau)
-            ten_hang_col = None
-            so_luong_col = None
-            gia_tien_col = None
-            phi_ship_col = None
-            ngay_col = None
+            df = doc_file_excel(file)
             
-            for col in df.columns:
-                col_lower = str(col).lower().strip()
-                if 'tên' in col_lower or 'hàng' in col_lower or 'loại' in col_lower or 'cây' in col_lower:
-                    ten_hang_col = col
-                elif 'số lượng' in col_lower or 'sl' in col_lower or 'quantity' in col_lower:
-                    so_luong_col = col
-                elif 'giá' in col_lower or 'price' in col_lower or 'giá tiền' in col_lower:
-                    gia_tien_col = col
-                elif 'phí' in col_lower and 'ship' in col_lower:
-                    phi_ship_col = col
-                elif 'ngày' in col_lower or 'date' in col_lower:
-                    ngay_col = col
-            
-            if not ten_hang_col or not so_luong_col or not gia_tien_col or not ngay_col:
+            ket_qua = import_dataframe(df)
+            if ket_qua is None:
                 flash('File Excel phải có các cột: Tên hàng, Số lượng, Giá tiền, Ngày (Phí ship là tùy chọn)', 'error')
                 return redirect(url_for('import_excel'))
-            
-            imported = 0
-            
-            for _, row in df.iterrows():
-                ten_hang = str(row.get(ten_hang_col, '')).strip()
-                so_luong = row.get(so_luong_col)
-                gia_tien = row.get(gia_tien_col)
-                phi_ship = row.get(phi_ship_col) if phi_ship_col else None
-                ngay_nhap = row.get(ngay_col)
-                
-                # Bỏ qua dòng trống
-                if pd.isna(ten_hang) or ten_hang == '' or ten_hang == 'nan':
-                    continue
-                
-                # Xử lý số lượng, giá và phí ship (cho phép số lượng = 0)
-                try:
-                    so_luong = float(so_luong) if pd.notna(so_luong) else 0.0
-                    gia_tien = float(gia_tien) if pd.notna(gia_tien) else 0.0
-                    phi_ship = float(phi_ship) if pd.notna(phi_ship) and phi_ship_col else 0.0
-                    ngay_nhap = pd.to_datetime(ngay_nhap).date() if pd.notna(ngay_nhap) else date.today()
-                except:
-                    # Nếu không parse được, đặt giá trị mặc định
-                    so_luong = 0.0
-                    gia_tien = 0.0
-                    phi_ship = 0.0
-                    ngay_nhap = date.today()
-                
-                # Tạo mã cây tự động từ tên hàng (hoặc tìm nếu đã có)
-                # Sử dụng tên hàng làm mã cây nếu chưa có mã
-                ma_cay = ten_hang[:50]  # Giới hạn độ dài mã cây
-                
-                # Tìm hoặc tạo cây
-                cay = CayXanh.query.filter_by(ma_cay=ma_cay).first()
-                if not cay:
-                    cay = CayXanh(ma_cay=ma_cay, loai_cay=ten_hang, ton_kho=0)
-                    db.session.add(cay)
-                    db.session.flush()
-                    imported += 1
-                else:
-                    # Cập nhật tên nếu khác
-                    if cay.loai_cay != ten_hang:
-                        cay.loai_cay = ten_hang
-                
-                # Chỉ tạo phiếu nhập nếu số lượng > 0
-                if so_luong > 0 and gia_tien > 0:
-                    tong_tien = (so_luong * gia_tien) + phi_ship
-                    nhap_kho = NhapKho(
-                        cay_xanh_id=cay.id,
-                        so_luong=so_luong,
-                        gia_nhap=gia_tien,
-                        phi_ship=phi_ship,
-                        tong_tien=tong_tien,
-                        ngay_nhap=ngay_nhap,
-                        ghi_chu='Import từ Excel'
-                    )
-                    db.session.add(nhap_kho)
-                
-                # Cập nhật tồn kho (kể cả số lượng = 0)
-                cay.ton_kho = so_luong
-                cay.updated_at = datetime.now()
+            imported, _ = ket_qua
             
             db.session.commit()
+            xoa_cache_dashboard()
+            xoa_goi_y_index()
             flash(f'Import thành công! Đã import {imported} hàng mới và cập nhật tồn kho.', 'success')
         except Exception as e:
             db.session.rollback()
@@ -878,12 +3135,27 @@ def import_excel():
     
     return render_template('import_excel.html')
 
-# Initialize database - lazy initialization in api/index.py for Vercel
+@app.route('/import-excel/jobs/<int:job_id>')
+def import_job_status(job_id):
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        flash('Không tìm thấy lần import!', 'error')
+        return redirect(url_for('import_excel'))
+    return render_template('import_job.html', job=import_job_to_dict(job))
+
+@app.route('/api/import-jobs/<int:job_id>')
+def api_import_job(job_id):
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Không tìm thấy!'}), 404
+    return jsonify({'success': True, 'job': import_job_to_dict(job)})
+
+# Initialize database - schema check in api/index.py for Vercel
 # For local development, initialize here
 if __name__ == '__main__':
     try:
         with app.app_context():
-            db.create_all()
+            kiem_tra_schema()
     except Exception as e:
         print(f"Warning: Could not initialize database: {e}")
     app.run(debug=True, host='0.0.0.0', port=5000)
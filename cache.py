@@ -0,0 +1,95 @@
+"""
+Bộ nhớ đệm (cache) in-process dạng LRU có TTL.
+
+Backend mặc định là LRUCache trong bộ nhớ của process. Có thể thay bằng
+backend dùng chung (Redis, Memcached...) miễn là có các method
+get(key, default) / set(key, value, ttl) / delete(key) / clear().
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Cache LRU thread-safe, mỗi key hết hạn sau `ttl` giây"""
+
+    def __init__(self, maxsize=128, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Lấy giá trị theo key (None/default nếu không có hoặc đã hết hạn)"""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            het_han, value = item
+            if het_han is not None and het_han <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Lưu giá trị, loại bỏ key ít dùng nhất nếu vượt quá maxsize"""
+        ttl = self.ttl if ttl is None else ttl
+        het_han = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (het_han, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Xóa 1 key khỏi cache"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CacheStore:
+    """Cache có backend thay được (mặc định: LRUCache in-process)"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or LRUCache()
+
+    def set_backend(self, backend):
+        """Thay backend, ví dụ một client Redis có get/set/delete"""
+        self.backend = backend
+
+    def get(self, key, default=None):
+        return self.backend.get(key, default)
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def get_or_set(self, key, factory, ttl=None):
+        """Trả về giá trị trong cache, nếu chưa có thì gọi factory() rồi lưu lại"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
@@ -0,0 +1,146 @@
+"""
+Đọc và chuẩn hóa dữ liệu file Excel/CSV import (không ghi database).
+
+pandas và openpyxl chỉ được import trong các hàm cần dùng, để khởi động
+ứng dụng (cold start trên Vercel) không phải nạp các thư viện nặng này.
+"""
+
+from datetime import date
+
+SO_DONG_TIM_TIEU_DE = 10  # Tìm dòng tiêu đề trong 10 dòng đầu
+
+
+def doc_file_excel(file):
+    """Đọc cả file Excel vào 1 DataFrame"""
+    import pandas as pd
+    return pd.read_excel(file)
+
+
+def tao_dataframe(cac_dong, so_cot):
+    """DataFrame từ các dòng (tuple) đã đọc, cột đánh số 0..so_cot-1"""
+    import pandas as pd
+    return pd.DataFrame.from_records(cac_dong, columns=range(so_cot))
+
+
+def tim_cot_excel(columns):
+    """Tìm các cột Tên hàng, Số lượng, Giá tiền, Phí ship, Ngày (hỗ trợ nhiều tên cột khác nhau)"""
+    cot = {'ten_hang': None, 'so_luong': None, 'gia_tien': None, 'phi_ship': None, 'ngay': None}
+    for col in columns:
+        col_lower = str(col).lower().strip()
+        if 'tên' in col_lower or 'hàng' in col_lower or 'loại' in col_lower or 'cây' in col_lower:
+            cot['ten_hang'] = col
+        elif 'số lượng' in col_lower or 'sl' in col_lower or 'quantity' in col_lower:
+            cot['so_luong'] = col
+        elif 'giá' in col_lower or 'price' in col_lower or 'giá tiền' in col_lower:
+            cot['gia_tien'] = col
+        elif 'phí' in col_lower and 'ship' in col_lower:
+            cot['phi_ship'] = col
+        elif 'ngày' in col_lower or 'date' in col_lower:
+            cot['ngay'] = col
+    return cot
+
+
+def du_cot_bat_buoc(cot):
+    """File phải có đủ các cột Tên hàng, Số lượng, Giá tiền, Ngày"""
+    return all(cot[k] is not None for k in ('ten_hang', 'so_luong', 'gia_tien', 'ngay'))
+
+
+def chuan_hoa_du_lieu_excel(df, cot):
+    """Chuẩn hóa DataFrame thành các cột ma_cay, ten_hang, so_luong, gia_nhap, phi_ship, ngay_nhap"""
+    import pandas as pd
+
+    ten_hang = df[cot['ten_hang']].astype(str).str.strip()
+    hop_le = df[cot['ten_hang']].notna() & (ten_hang != '') & (ten_hang != 'nan')
+    df = df[hop_le]
+    ten_hang = ten_hang[hop_le]
+
+    def so(col):
+        if col is None:
+            return pd.Series(0.0, index=df.index), pd.Series(False, index=df.index)
+        goc = df[col]
+        gia_tri = pd.to_numeric(goc, errors='coerce')
+        # Ô có dữ liệu nhưng không phải số => dòng lỗi
+        return gia_tri.fillna(0.0).astype(float), goc.notna() & gia_tri.isna()
+
+    so_luong, loi_so_luong = so(cot['so_luong'])
+    gia_nhap, loi_gia = so(cot['gia_tien'])
+    phi_ship, loi_phi_ship = so(cot['phi_ship'])
+
+    ngay_goc = df[cot['ngay']]
+    ngay = pd.to_datetime(ngay_goc, errors='coerce', format='mixed')
+    loi_ngay = ngay_goc.notna() & ngay.isna()
+    ngay_nhap = ngay.dt.date.where(ngay.notna(), date.today())
+
+    # Dòng không parse được: đặt giá trị mặc định cho cả dòng
+    loi = loi_so_luong | loi_gia | loi_phi_ship | loi_ngay
+    so_luong = so_luong.mask(loi, 0.0)
+    gia_nhap = gia_nhap.mask(loi, 0.0)
+    phi_ship = phi_ship.mask(loi, 0.0)
+    ngay_nhap = ngay_nhap.mask(loi, date.today())
+
+    return pd.DataFrame({
+        'ma_cay': ten_hang.str.slice(0, 50),  # Sử dụng tên hàng làm mã cây, giới hạn độ dài
+        'ten_hang': ten_hang,
+        'so_luong': so_luong,
+        'gia_nhap': gia_nhap,
+        'phi_ship': phi_ship,
+        'ngay_nhap': ngay_nhap,
+        'loi': loi,
+    })
+
+
+def doc_dong_file(file, filename):
+    """Generator trả về từng dòng (tuple giá trị) của file .xlsx hoặc .csv mà không nạp cả file"""
+    if filename.lower().endswith('.csv'):
+        import csv
+        import io
+        text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        try:
+            for row in csv.reader(text):
+                yield tuple(v if v.strip() != '' else None for v in row)
+        finally:
+            text.detach()
+        return
+
+    from openpyxl import load_workbook
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield row
+    finally:
+        wb.close()
+
+
+def tim_dong_tieu_de(rows):
+    """Tìm dòng tiêu đề trong các dòng đầu, trả về (vị trí các cột, số cột) hoặc None"""
+    for _ in range(SO_DONG_TIM_TIEU_DE):
+        header = next(rows, None)
+        if header is None:
+            return None
+        cot = tim_cot_excel(header)
+        if du_cot_bat_buoc(cot):
+            # tim_cot_excel lấy cột khớp cuối cùng => lấy vị trí cuối cùng của tên cột đó
+            vi_tri = {
+                k: (max(i for i, h in enumerate(header) if h == ten) if ten is not None else None)
+                for k, ten in cot.items()
+            }
+            return vi_tri, len(header)
+    return None
+
+
+def uoc_tinh_so_dong(path, filename):
+    """Ước tính số dòng dữ liệu của file (để tính % và thời gian còn lại), None nếu không biết"""
+    try:
+        if filename.lower().endswith('.csv'):
+            with open(path, 'rb') as f:
+                return max(sum(1 for _ in f) - 1, 0)
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True)
+        try:
+            max_row = wb.active.max_row
+        finally:
+            wb.close()
+        return max(max_row - 1, 0) if max_row else None
+    except Exception as e:
+        print(f"Warning: Could not estimate row count: {e}")
+        return None
@@ -0,0 +1,61 @@
+"""
+Tạo ảnh biến thể (thumbnail, ảnh vừa) dạng WebP từ ảnh gốc upload.
+
+Dùng Pillow nếu đã cài (`pip install Pillow`); nếu không có Pillow thì
+không tạo biến thể và giao diện dùng ảnh gốc. Pillow chỉ được import khi
+thực sự tạo ảnh (không làm chậm lúc khởi động).
+"""
+
+import importlib.util
+import io
+import json
+
+# Tên biến thể -> cạnh dài nhất (px)
+KICH_THUOC_BIEN_THE = {
+    'thumb': 160,
+    'medium': 640,
+}
+CHAT_LUONG_WEBP = 80
+
+
+_co_pillow = None
+
+
+def ho_tro_bien_the():
+    """Có tạo được ảnh biến thể không (đã cài Pillow)"""
+    global _co_pillow
+    if _co_pillow is None:
+        _co_pillow = importlib.util.find_spec('PIL') is not None  # Pillow là dependency tùy chọn
+    return _co_pillow
+
+
+def doc_bien_the_anh(hinh_anh_bien_the):
+    """{ten_bien_the: đường dẫn} từ cột hinh_anh_bien_the (JSON)"""
+    if not hinh_anh_bien_the:
+        return {}
+    try:
+        return json.loads(hinh_anh_bien_the)
+    except ValueError:
+        return {}
+
+
+def tao_bien_the(noi_dung, kich_thuoc=None):
+    """Tạo các biến thể WebP từ bytes ảnh gốc: {ten: bytes}, rỗng nếu không có Pillow"""
+    if not ho_tro_bien_the():
+        return {}
+    from PIL import Image, ImageOps
+    kich_thuoc = kich_thuoc or KICH_THUOC_BIEN_THE
+
+    with Image.open(io.BytesIO(noi_dung)) as anh:
+        anh = ImageOps.exif_transpose(anh)  # Xoay đúng chiều ảnh chụp điện thoại
+        if anh.mode not in ('RGB', 'RGBA'):
+            anh = anh.convert('RGBA' if 'transparency' in anh.info else 'RGB')
+
+        bien_the = {}
+        for ten, canh in kich_thuoc.items():
+            ban_sao = anh.copy()
+            ban_sao.thumbnail((canh, canh), Image.LANCZOS)
+            buf = io.BytesIO()
+            ban_sao.save(buf, 'WEBP', quality=CHAT_LUONG_WEBP, method=4)
+            bien_the[ten] = buf.getvalue()
+        return bien_the
@@ -0,0 +1,89 @@
+"""
+Index tìm theo tiền tố (prefix) trong bộ nhớ cho ô gợi ý (autocomplete).
+
+Lưu các khóa đã chuẩn hóa trong 1 mảng đã sắp xếp, tìm bằng bisect:
+tìm kiếm O(log n + k), thêm/xóa 1 mục O(n) (chỉ là dịch mảng, rất nhanh với vài nghìn mục).
+"""
+
+import bisect
+import threading
+
+
+class PrefixIndex:
+    """Index tiền tố thread-safe: mỗi mục có 1 mã, nhiều khóa tìm kiếm và dữ liệu kèm theo"""
+
+    def __init__(self, chuan_hoa=None):
+        self.chuan_hoa = chuan_hoa or (lambda text: str(text or '').lower())
+        self._khoa = []  # [(khoa, ma)] đã sắp xếp
+        self._muc = {}  # ma -> (cac_khoa, du_lieu)
+        self._lock = threading.Lock()
+
+    def _tao_khoa(self, cac_chuoi):
+        """Khóa của 1 mục: từng chuỗi đã chuẩn hóa + từng từ trong chuỗi"""
+        khoa = set()
+        for chuoi in cac_chuoi:
+            chuoi = self.chuan_hoa(chuoi)
+            if not chuoi:
+                continue
+            khoa.add(chuoi)
+            khoa.update(chuoi.split())
+        return khoa
+
+    def _xoa_khoa(self, ma):
+        muc = self._muc.pop(ma, None)
+        if muc is None:
+            return
+        for khoa in muc[0]:
+            i = bisect.bisect_left(self._khoa, (khoa, ma))
+            if i < len(self._khoa) and self._khoa[i] == (khoa, ma):
+                del self._khoa[i]
+
+    def cap_nhat(self, ma, cac_chuoi, du_lieu=None):
+        """Thêm hoặc cập nhật 1 mục"""
+        cac_khoa = self._tao_khoa(cac_chuoi)
+        with self._lock:
+            self._xoa_khoa(ma)
+            for khoa in cac_khoa:
+                bisect.insort(self._khoa, (khoa, ma))
+            self._muc[ma] = (cac_khoa, du_lieu)
+
+    def xoa(self, ma):
+        """Xóa 1 mục khỏi index"""
+        with self._lock:
+            self._xoa_khoa(ma)
+
+    def nap_lai(self, cac_muc):
+        """Xây lại toàn bộ index từ [(ma, cac_chuoi, du_lieu)]"""
+        khoa_moi = []
+        muc_moi = {}
+        for ma, cac_chuoi, du_lieu in cac_muc:
+            cac_khoa = self._tao_khoa(cac_chuoi)
+            khoa_moi.extend((khoa, ma) for khoa in cac_khoa)
+            muc_moi[ma] = (cac_khoa, du_lieu)
+        khoa_moi.sort()
+        with self._lock:
+            self._khoa = khoa_moi
+            self._muc = muc_moi
+
+    def tim(self, tien_to, limit=10, loc=None):
+        """Tối đa `limit` mục có khóa bắt đầu bằng tien_to: [(ma, du_lieu)], lọc thêm bằng loc(du_lieu)"""
+        tien_to = self.chuan_hoa(tien_to)
+        ket_qua = []
+        da_co = set()
+        with self._lock:
+            i = bisect.bisect_left(self._khoa, (tien_to, ''))
+            while i < len(self._khoa) and len(ket_qua) < limit:
+                khoa, ma = self._khoa[i]
+                i += 1
+                if not khoa.startswith(tien_to):
+                    break
+                if ma in da_co:
+                    continue
+                da_co.add(ma)
+                du_lieu = self._muc[ma][1]
+                if loc is None or loc(du_lieu):
+                    ket_qua.append((ma, du_lieu))
+        return ket_qua
+
+    def __len__(self):
+        return len(self._muc)
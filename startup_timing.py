@@ -0,0 +1,94 @@
+"""
+Đo thời gian khởi động (cold start) của ứng dụng.
+
+Import module trong 1 process Python mới với `-X importtime`, rồi tổng hợp
+thời gian theo từng import trực tiếp và theo package gốc. Dùng qua
+`flask --app app startup-time` hoặc `python startup_timing.py [module]`.
+"""
+
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+THU_MUC = os.path.dirname(os.path.abspath(__file__))
+# Ngân sách thời gian import (ms), vượt quá thì lệnh trả mã lỗi 1
+NGAN_SACH_MS = int(os.environ.get('COLD_START_BUDGET_MS', 1000))
+
+
+def do_thoi_gian_import(module='app'):
+    """Import module trong process mới, trả về [(ten, self_us, cumulative_us, cap)] theo thứ tự importtime"""
+    ket_qua = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=THU_MUC,
+    )
+    if ket_qua.returncode != 0:
+        loi = [dong for dong in ket_qua.stderr.strip().splitlines() if not dong.startswith('import time:')]
+        raise RuntimeError(f"Cannot import {module}: {(loi or ['unknown error'])[-1]}")
+
+    cac_dong = []
+    for dong in ket_qua.stderr.splitlines():
+        if not dong.startswith('import time:'):
+            continue
+        self_us, cumulative_us, ten = dong[len('import time:'):].split('|', 2)
+        if not self_us.strip().isdigit():
+            continue  # Dòng tiêu đề "self [us] | cumulative | imported package"
+        cap = (len(ten) - len(ten.lstrip()) - 1) // 2
+        cac_dong.append((ten.strip(), int(self_us), int(cumulative_us), cap))
+
+    # Chỉ giữ các import do module gây ra: importtime in module con trước module cha,
+    # các dòng trước đó là import lúc khởi động interpreter (site, encodings...)
+    cuoi = max(i for i, (ten, _, _, cap) in enumerate(cac_dong) if ten == module and cap == 0)
+    dau = cuoi
+    while dau > 0 and cac_dong[dau - 1][3] > 0:
+        dau -= 1
+    return cac_dong[dau:cuoi + 1]
+
+
+def goi_y_loi(module, loi):
+    """Dòng thông báo khi không import được module (thay cho traceback)"""
+    dong = [f'✗ {loi}']
+    if module.startswith('api.'):
+        # api/index.py đặt VERCEL=1 => app bắt buộc PostgreSQL và kiểm tra schema ngay khi import
+        dong.append('  api.index runs with VERCEL=1: set DATABASE_URL or POSTGRES_URL to a reachable '
+                    'PostgreSQL database, or measure `--module app` locally.')
+    return dong
+
+
+def bao_cao(module='app', top=10, ngan_sach_ms=None):
+    """Báo cáo thời gian import: (tổng ms, vượt ngân sách không, các dòng text)"""
+    ngan_sach_ms = NGAN_SACH_MS if ngan_sach_ms is None else ngan_sach_ms
+    cac_dong = do_thoi_gian_import(module)
+    tong_ms = cac_dong[-1][2] / 1000
+
+    # Import trực tiếp của module (cấp 1) theo thời gian tích lũy
+    truc_tiep = sorted(
+        ((ten, cumulative) for ten, _, cumulative, cap in cac_dong if cap == 1),
+        key=lambda x: x[1], reverse=True,
+    )
+    # Thời gian riêng (self) cộng theo package gốc
+    theo_package = defaultdict(int)
+    for ten, self_us, _, _ in cac_dong:
+        theo_package[ten.split('.')[0]] += self_us
+
+    vuot = tong_ms > ngan_sach_ms
+    dong = [f"{'✗' if vuot else '✓'} import {module}: {tong_ms:.0f} ms (budget {ngan_sach_ms} ms)"]
+    dong.append('  Slowest direct imports (cumulative):')
+    dong.extend(f'    {ten:<30} {us / 1000:8.1f} ms' for ten, us in truc_tiep[:top])
+    dong.append('  Slowest packages (self time):')
+    dong.extend(
+        f'    {ten:<30} {us / 1000:8.1f} ms'
+        for ten, us in sorted(theo_package.items(), key=lambda x: x[1], reverse=True)[:top]
+    )
+    return tong_ms, vuot, dong
+
+
+if __name__ == '__main__':
+    module = sys.argv[1] if len(sys.argv) > 1 else 'app'
+    try:
+        _, vuot, dong = bao_cao(module)
+    except RuntimeError as e:
+        print('\n'.join(goi_y_loi(module, e)))
+        sys.exit(1)
+    print('\n'.join(dong))
+    sys.exit(1 if vuot else 0)
@@ -0,0 +1,198 @@
+"""
+Lưu trữ file ảnh: Vercel Blob hoặc thư mục local, kèm hàng đợi chạy nền.
+
+Backend có put(ten_file, noi_dung, content_type) -> giá trị lưu vào database,
+delete(cac_duong_dan) và liet_ke() (để dọn file mồ côi), lỗi thì raise.
+VercelBlobStorage dùng chung 1 requests.Session (giữ kết nối, tự thử lại khi
+lỗi mạng/5xx/429); LocalStorage ghi vào 1 thư mục, dùng khi không có Blob
+token và khi test.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+BLOB_API_URL = 'https://blob.vercel-storage.com'
+# Mã lỗi tạm thời của Blob API => thử lại
+MA_LOI_THU_LAI = (408, 429, 500, 502, 503, 504)
+
+
+def is_blob_url(url):
+    """Kiểm tra xem URL có phải là Vercel Blob URL không"""
+    if not url:
+        return False
+    return 'blob.vercel-storage.com' in url
+
+
+class VercelBlobStorage:
+    """Client Vercel Blob REST API dùng chung pool kết nối, thử lại với backoff lũy thừa"""
+
+    def __init__(self, token, api_url=BLOB_API_URL, timeout=(5, 30), so_lan_thu=3, backoff=0.5, pool_size=4):
+        self.token = token
+        self.api_url = api_url
+        self.timeout = timeout  # (connect, read) giây
+        self.so_lan_thu = so_lan_thu
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _lay_session(self):
+        """requests.Session tạo 1 lần (import requests khi cần)"""
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(
+                    total=self.so_lan_thu,
+                    backoff_factor=self.backoff,
+                    status_forcelist=MA_LOI_THU_LAI,
+                    allowed_methods=None,  # put/delete đều là POST; tên file theo hash nên gửi lại an toàn
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                session = requests.Session()
+                session.mount(self.api_url, HTTPAdapter(pool_maxsize=self.pool_size, max_retries=retry))
+                session.headers['Authorization'] = f'Bearer {self.token}'
+                self._session = session
+            return self._session
+
+    def put(self, ten_file, noi_dung, content_type):
+        """Upload file vào images/<ten_file>, trả về URL public"""
+        response = self._lay_session().post(
+            f'{self.api_url}/put',
+            data={'pathname': f'images/{ten_file}', 'addRandomSuffix': 'false'},
+            files={'file': (ten_file, noi_dung, content_type)},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        result = response.json()
+        # The API returns the URL in different possible fields
+        return result.get('url') or result.get('href') or result.get('downloadUrl') or result.get('pathname')
+
+    def delete(self, cac_duong_dan):
+        """Xóa nhiều blob trong 1 request (bỏ qua đường dẫn không phải Blob URL)"""
+        urls = [url for url in cac_duong_dan if is_blob_url(url)]
+        if not urls:
+            return
+        response = self._lay_session().post(
+            f'{self.api_url}/delete', json={'urls': urls}, timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+    def liet_ke(self, tien_to='images/'):
+        """Duyệt mọi blob có pathname bắt đầu bằng tien_to: (url, thời điểm upload dạng timestamp)"""
+        from datetime import datetime
+        cursor = None
+        while True:
+            params = {'prefix': tien_to, 'limit': 1000}
+            if cursor:
+                params['cursor'] = cursor
+            response = self._lay_session().get(self.api_url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+            for blob in result.get('blobs', []):
+                uploaded_at = blob.get('uploadedAt')
+                thoi_gian = datetime.fromisoformat(uploaded_at).timestamp() if uploaded_at else 0
+                yield blob['url'], thoi_gian
+            cursor = result.get('cursor')
+            if not result.get('hasMore') or not cursor:
+                return
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class LocalStorage:
+    """Lưu file trong 1 thư mục local (dev, /tmp trên Vercel, test)"""
+
+    def __init__(self, thu_muc, tien_to='uploads/images/'):
+        self.thu_muc = thu_muc
+        self.tien_to = tien_to  # Tiền tố đường dẫn lưu vào database
+
+    def duong_dan_file(self, duong_dan):
+        """Đường dẫn file trên đĩa của 1 giá trị lưu trong database"""
+        return os.path.join(self.thu_muc, os.path.basename(duong_dan))
+
+    def put(self, ten_file, noi_dung, content_type=None):
+        """Ghi file (ghi ra file tạm rồi đổi tên để không ai đọc được file ghi dở)"""
+        path = os.path.join(self.thu_muc, ten_file)
+        if not os.path.exists(path):  # Tên file theo hash nội dung: đã có file thì không cần ghi lại
+            tam = f'{path}.{threading.get_ident()}.tmp'
+            with open(tam, 'wb') as f:
+                f.write(noi_dung)
+            os.replace(tam, path)
+        return self.tien_to + ten_file
+
+    def delete(self, cac_duong_dan):
+        """Xóa các file local (bỏ qua Blob URL và file không còn)"""
+        for duong_dan in cac_duong_dan:
+            if not duong_dan or is_blob_url(duong_dan):
+                continue
+            try:
+                os.remove(self.duong_dan_file(duong_dan))
+            except FileNotFoundError:
+                pass
+
+    def liet_ke(self):
+        """Duyệt mọi file trong thư mục: (đường dẫn lưu database, thời điểm sửa dạng timestamp)"""
+        try:
+            entries = list(os.scandir(self.thu_muc))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_file():
+                yield self.tien_to + entry.name, entry.stat().st_mtime
+
+
+class StorageQueue:
+    """Hàng đợi chạy nền cho việc upload/xóa file; workers=0 thì chạy ngay trong thread gọi (test)"""
+
+    def __init__(self, workers=2, ten='storage'):
+        self.workers = workers
+        self.ten = ten
+        self._executor = None
+        self._dang_chay = set()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Đưa 1 việc vào hàng đợi, trả về Future (lỗi được in ra log)"""
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            self._xong(future)
+            return future
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.ten)
+            future = self._executor.submit(fn, *args, **kwargs)
+            self._dang_chay.add(future)
+        future.add_done_callback(self._xong)
+        return future
+
+    def _xong(self, future):
+        with self._lock:
+            self._dang_chay.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Background {self.ten} job failed: {future.exception()}")
+
+    def cho_xong(self, timeout=None):
+        """Chờ các việc đang có trong hàng đợi chạy xong"""
+        with self._lock:
+            dang_chay = list(self._dang_chay)
+        wait(dang_chay, timeout=timeout)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
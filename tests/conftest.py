@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Database SQLite tạm cho test, ảnh xử lý ngay trong request
+_thu_muc_tam = tempfile.mkdtemp(prefix='cayxanh-test-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_thu_muc_tam, 'test.db')}"
+os.environ['ANH_WORKERS'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db, migrate_schema  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        migrate_schema()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,92 @@
+import io
+import os
+
+import pytest
+
+import app as app_module
+from app import CayXanh, db, local_storage
+
+
+class BlobGia:
+    """Vercel Blob giả: ghi lại các file đã put, loi=True thì put raise"""
+
+    def __init__(self, loi=False):
+        self.token = 'test-token'
+        self.loi = loi
+        self.da_put = []
+
+    def put(self, ten_file, noi_dung, content_type):
+        if self.loi:
+            raise ConnectionError('Blob unavailable')
+        self.da_put.append(ten_file)
+        return f'https://test.public.blob.vercel-storage.com/images/{ten_file}'
+
+    def delete(self, cac_duong_dan):
+        pass
+
+
+@pytest.fixture
+def blob(monkeypatch):
+    def tao(loi=False):
+        blob = BlobGia(loi)
+        monkeypatch.setenv('BLOB_READ_WRITE_TOKEN', blob.token)
+        monkeypatch.setattr(app_module, '_blob_storage', blob)
+        return blob
+    return tao
+
+
+def _upload(client, ma_cay, noi_dung):
+    return client.post(f'/cay/{ma_cay}/upload-anh', data={'file': (io.BytesIO(noi_dung), 'anh.png')},
+                       content_type='multipart/form-data')
+
+
+def _tao_cay(ma_cay, hinh_anh=None):
+    db.session.add(CayXanh(ma_cay=ma_cay, loai_cay='Sung', ton_kho=1, hinh_anh=hinh_anh))
+    db.session.commit()
+
+
+def _file_local():
+    return set(os.listdir(local_storage.thu_muc)) if os.path.isdir(local_storage.thu_muc) else set()
+
+
+def test_upload_anh_blob_loi_giu_nguyen_anh_cu(client, blob):
+    blob(loi=True)
+    _tao_cay('ANH-LOI', hinh_anh='https://test.public.blob.vercel-storage.com/images/cu.png')
+    truoc = _file_local()
+
+    response = _upload(client, 'ANH-LOI', b'anh moi khong upload duoc')
+    assert response.status_code == 302
+
+    db.session.expire_all()
+    cay = CayXanh.query.filter_by(ma_cay='ANH-LOI').one()
+    assert cay.hinh_anh == 'https://test.public.blob.vercel-storage.com/images/cu.png'
+    # Không lưu tạm vào thư mục local (trên Vercel là /tmp riêng của instance)
+    assert _file_local() == truoc
+
+
+def test_upload_anh_luu_blob_url_ngay_trong_request(client, blob):
+    gia = blob()
+    _tao_cay('ANH-OK')
+    truoc = _file_local()
+
+    _upload(client, 'ANH-OK', b'anh moi upload thanh cong')
+
+    db.session.expire_all()
+    cay = CayXanh.query.filter_by(ma_cay='ANH-OK').one()
+    assert cay.hinh_anh.startswith('https://test.public.blob.vercel-storage.com/images/')
+    assert os.path.basename(cay.hinh_anh) in gia.da_put
+    assert _file_local() == truoc
+
+
+def test_upload_anh_doi_etag_api_cay(client, blob):
+    blob()
+    _tao_cay('ANH-ETAG')
+    etag = client.get('/api/cay/ANH-ETAG').headers['ETag']
+    assert client.get('/api/cay/ANH-ETAG', headers={'If-None-Match': etag}).status_code == 304
+
+    _upload(client, 'ANH-ETAG', b'anh moi doi etag')
+
+    response = client.get('/api/cay/ANH-ETAG', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['ma_cay'] == 'ANH-ETAG'
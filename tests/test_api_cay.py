@@ -0,0 +1,40 @@
+from app import CayXanh, api_cay_cache, db
+
+
+def _tao_cay(ma_cay, ton_kho=5):
+    db.session.add(CayXanh(ma_cay=ma_cay, loai_cay='Tung', ton_kho=ton_kho))
+    db.session.commit()
+
+
+def test_if_none_match_tra_304_khong_body(client):
+    _tao_cay('ET-304')
+    response = client.get('/api/cay/ET-304')
+    assert response.status_code == 200 and response.get_json()['ton_kho'] == 5
+    etag = response.headers['ETag']
+
+    response = client.get('/api/cay/ET-304', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+
+def test_nhap_xuat_doi_etag_va_payload(client):
+    _tao_cay('ET-TK')
+    etag = client.get('/api/cay/ET-TK').headers['ETag']
+    assert api_cay_cache.get('api_cay:ET-TK')[0] in etag
+
+    assert client.post('/xuat-hang', json={
+        'ma_cay': 'ET-TK', 'so_luong': 2, 'ngay_xuat': '2026-05-01'}).get_json()['success']
+    response = client.get('/api/cay/ET-TK', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['ton_kho'] == 3
+    etag = response.headers['ETag']
+
+    assert client.post('/nhap-hang', json={
+        'ma_cay': 'ET-TK', 'so_luong': 4, 'gia_nhap': 25, 'ngay_nhap': '2026-05-02'}).get_json()['success']
+    response = client.get('/api/cay/ET-TK', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert (response.get_json()['ton_kho'], response.get_json()['gia_nhap_moi_nhat']) == (7, 25)
+    assert api_cay_cache.get('api_cay:ET-TK')[0] in response.headers['ETag']
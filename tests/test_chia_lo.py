@@ -0,0 +1,23 @@
+import sqlite3
+from datetime import datetime
+
+from app import CayXanh, _upsert_cay_xanh, db
+
+
+def test_upsert_cay_xanh_khong_vuot_999_tham_so(app):
+    # Giới hạn như SQLite cũ (< 3.32): tối đa 999 tham số mỗi câu lệnh
+    ket_noi = db.session.connection().connection.driver_connection
+    gioi_han_cu = ket_noi.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    try:
+        bay_gio = datetime.now()
+        rows = [
+            {'ma_cay': f'LO-{i}', 'loai_cay': 'Xoài', 'ton_kho': 1.0, 'tim_kiem': f'lo-{i} xoai',
+             'created_at': bay_gio, 'updated_at': bay_gio}
+            for i in range(600)
+        ]
+        _upsert_cay_xanh(rows, {})
+        db.session.commit()
+    finally:
+        ket_noi.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, gioi_han_cu)
+
+    assert CayXanh.query.filter(CayXanh.ma_cay.like('LO-%')).count() == 600
@@ -0,0 +1,19 @@
+from app import cac_query_thuong_dung, explain_query, quet_ca_bang, sap_xep_tam
+
+
+def test_query_lich_su_dung_index(app):
+    ten_query = [ten for ten, _ in cac_query_thuong_dung()]
+    for loai in ('nhap', 'xuat', 'all (nhap)', 'all (xuat)'):
+        for trang in ('trang đầu', 'trang sau', 'trang trước'):
+            assert f'Lịch sử {loai} - {trang}' in ten_query
+
+    for ten, stmt in cac_query_thuong_dung():
+        ke_hoach = explain_query(stmt)
+        assert not quet_ca_bang(ke_hoach), (ten, ke_hoach)
+        assert not sap_xep_tam(ke_hoach), (ten, ke_hoach)
+
+
+def test_sap_xep_tam_bat_union_sap_xep_lai():
+    assert sap_xep_tam(['CO-ROUTINE anon_1', 'SCAN anon_1', 'USE TEMP B-TREE FOR ORDER BY'])
+    assert sap_xep_tam(['Limit', '  ->  Sort  (cost=1.0..2.0 rows=1 width=4)'])
+    assert not sap_xep_tam(['SCAN nhapkho USING INDEX ix_nhapkho_ngay_created_id'])
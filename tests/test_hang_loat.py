@@ -0,0 +1,35 @@
+from app import CayXanh, NhapKho, db
+
+
+def _nhap(client, lines):
+    return client.post('/api/nhap-hang/batch', json={'ngay_nhap': '2026-01-05', 'lines': lines}).get_json()
+
+
+def test_nhap_hang_loat_tu_choi_so_luong_am(client):
+    ket_qua = _nhap(client, [{'ma_cay': 'HL-AM', 'loai_cay': 'Bưởi', 'so_luong': 3, 'gia_nhap': 100}])
+    assert ket_qua['success']
+
+    ket_qua = _nhap(client, [
+        {'ma_cay': 'HL-AM', 'so_luong': 1, 'gia_nhap': 20},
+        {'ma_cay': 'HL-AM', 'so_luong': -4, 'gia_nhap': 10},
+    ])
+    assert not ket_qua['success']
+    assert [dong['success'] for dong in ket_qua['lines']] == [True, False]
+
+    # Cả lô bị hủy: tồn kho và lịch sử nhập giữ nguyên
+    db.session.expire_all()
+    cay = CayXanh.query.filter_by(ma_cay='HL-AM').one()
+    assert cay.ton_kho == 3
+    assert NhapKho.query.filter_by(cay_xanh_id=cay.id).count() == 1
+
+
+def test_nhap_hang_loat_tu_choi_gia_am_va_kieu_sai(client):
+    ket_qua = _nhap(client, [
+        {'ma_cay': 'HL-GIA', 'loai_cay': 'Mận', 'so_luong': 2, 'gia_nhap': -1},
+        {'ma_cay': 'HL-GIA', 'loai_cay': 'Mận', 'so_luong': 2, 'gia_nhap': 5, 'phi_ship': -3},
+        {'ma_cay': 'HL-GIA', 'loai_cay': 123, 'so_luong': 2, 'gia_nhap': 5},
+        {'ma_cay': ['HL-GIA'], 'loai_cay': 'Mận', 'so_luong': 2, 'gia_nhap': 5},
+    ])
+    assert not ket_qua['success']
+    assert not any(dong['success'] for dong in ket_qua['lines'])
+    assert CayXanh.query.filter_by(ma_cay='HL-GIA').first() is None
@@ -0,0 +1,38 @@
+import pandas as pd
+from sqlalchemy import event
+
+from app import CayXanh, NhapKho, db, import_dataframe
+
+
+def test_import_chi_doc_id_cua_ma_cay_trong_lo(app):
+    for i in range(20):
+        db.session.add(CayXanh(ma_cay=f'IM-CU-{i}', loai_cay=f'IM-CU-{i}', ton_kho=1))
+    db.session.commit()
+
+    df = pd.DataFrame({
+        'Tên hàng': ['IM-CU-3', 'IM-MOI-1', 'IM-MOI-2'],
+        'Số lượng': [4, 2, 0],
+        'Giá tiền': [10, 20, 30],
+        'Ngày': ['2026-03-01', '2026-03-02', '2026-03-03'],
+    })
+    cac_cau = []
+
+    def ghi_lai(conn, cursor, statement, parameters, context, executemany):
+        cac_cau.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', ghi_lai)
+    try:
+        assert import_dataframe(df) == (2, 2)
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', ghi_lai)
+
+    # Mọi câu đọc cayxanh đều lọc theo mã cây (hoặc id) của lô, không quét cả bảng
+    doc_cay = [cau for cau in cac_cau if cau.startswith('SELECT') and 'FROM cayxanh' in cau]
+    assert doc_cay and all('cayxanh.ma_cay IN' in cau or 'cayxanh.id IN' in cau for cau in doc_cay)
+
+    cay = {c.ma_cay: c for c in CayXanh.query.filter(CayXanh.ma_cay.like('IM-%'))}
+    assert len(cay) == 22
+    assert (cay['IM-CU-3'].ton_kho, cay['IM-MOI-2'].ton_kho, cay['IM-CU-4'].ton_kho) == (4, 0, 1)
+    assert {n.cay_xanh_id for n in NhapKho.query.filter(NhapKho.ghi_chu == 'Import từ Excel')} == {
+        cay['IM-CU-3'].id, cay['IM-MOI-1'].id}
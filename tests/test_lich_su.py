@@ -0,0 +1,44 @@
+from datetime import date, timedelta
+
+from sqlalchemy import event
+
+from app import CayXanh, NhapKho, XuatKho, dashboard_cache, db
+
+
+def _them_phieu(tien_to, so_cay):
+    """Mỗi cây 1 phiếu nhập và 1 phiếu xuất, cây khác nhau => template phải đọc nhiều CayXanh"""
+    for i in range(so_cay):
+        cay = CayXanh(ma_cay=f'{tien_to}-{i}', loai_cay=f'Loại {i}', ton_kho=1)
+        db.session.add(cay)
+        db.session.flush()
+        ngay = date(2026, 1, 1) + timedelta(days=i)
+        db.session.add(NhapKho(cay_xanh_id=cay.id, so_luong=2, gia_nhap=10, tong_tien=20, ngay_nhap=ngay))
+        db.session.add(XuatKho(cay_xanh_id=cay.id, so_luong=1, ly_do='Bán', ngay_xuat=ngay))
+    db.session.commit()
+
+
+def _dem_query(client, url):
+    """Số câu SQL chạy khi render 1 trang (không tính cache tổng số dòng)"""
+    dashboard_cache.clear()
+    cac_cau = []
+
+    def dem(conn, cursor, statement, parameters, context, executemany):
+        cac_cau.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', dem)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', dem)
+    assert response.status_code == 200
+    return len(cac_cau)
+
+
+def test_lich_su_so_query_khong_tang_theo_so_dong(client):
+    _them_phieu('LS-IT', 3)
+    truoc = {loai: _dem_query(client, f'/lich-su?loai={loai}') for loai in ('nhap', 'xuat', 'all')}
+
+    _them_phieu('LS-NHIEU', 30)
+    sau = {loai: _dem_query(client, f'/lich-su?loai={loai}') for loai in ('nhap', 'xuat', 'all')}
+
+    assert sau == truoc
@@ -0,0 +1,76 @@
+from datetime import date
+
+import pytest
+from flask import Flask
+from sqlalchemy import inspect
+
+from app import (MIGRATIONS, SCHEMA_VERSION, BienDongThang, CayXanh, GiaVonCay, SchemaVersion, TonKhoNgay,
+                 _migration_tao_bang, db, lay_schema_version, migrate_schema)
+
+
+@pytest.fixture
+def app_rieng(tmp_path):
+    """App dùng database SQLite riêng (trống) để chạy migration từ đầu"""
+    app_moi = Flask(__name__)
+    app_moi.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'migrate.db'}"
+    db.init_app(app_moi)
+    with app_moi.app_context():
+        yield app_moi
+        db.session.remove()
+        db.engine.dispose()
+
+
+def _schema():
+    kiem_tra = inspect(db.engine)
+    return {
+        bang: ({c['name'] for c in kiem_tra.get_columns(bang)}, {i['name'] for i in kiem_tra.get_indexes(bang)})
+        for bang in kiem_tra.get_table_names()
+    }
+
+
+def test_migration_1_chi_tao_bang_ban_dau(app_rieng):
+    _migration_tao_bang()
+    schema = _schema()
+
+    assert set(schema) == {'cayxanh', 'nhapkho', 'xuatkho'}
+    assert not {'tim_kiem', 'hinh_anh_bien_the'} & schema['cayxanh'][0]
+    assert schema['nhapkho'][1] == set()
+    assert schema['xuatkho'][1] == set()
+
+
+def test_migrate_tu_dau_khop_voi_model(app_rieng):
+    assert migrate_schema() == [version for version, _, _ in MIGRATIONS]
+    schema = _schema()
+
+    for bang in db.metadata.sorted_tables:
+        cot, index = schema[bang.name]
+        assert {c.name for c in bang.columns} <= cot, bang.name
+        assert {i.name for i in bang.indexes} <= index, bang.name
+
+
+def test_migrate_tu_phien_ban_1_co_du_lieu(app_rieng):
+    SchemaVersion.__table__.create(db.engine)
+    _migration_tao_bang()
+    db.session.add(SchemaVersion(version=1, mo_ta='Tạo bảng ban đầu'))
+    with db.engine.begin() as conn:
+        conn.execute(db.text(
+            "INSERT INTO cayxanh (id, ma_cay, loai_cay, ton_kho) VALUES (1, 'MG-1', 'Cây Kim Tiền', 3)"))
+        conn.execute(db.text(
+            "INSERT INTO nhapkho (cay_xanh_id, so_luong, gia_nhap, phi_ship, tong_tien, ngay_nhap) "
+            "VALUES (1, 5, 10, 0, 50, '2026-02-03')"))
+        conn.execute(db.text(
+            "INSERT INTO xuatkho (cay_xanh_id, so_luong, ngay_xuat, ly_do) VALUES (1, 2, '2026-02-10', 'Bán')"))
+    db.session.commit()
+
+    assert migrate_schema() == list(range(2, SCHEMA_VERSION + 1))
+    assert lay_schema_version() == SCHEMA_VERSION
+
+    cay = db.session.get(CayXanh, 1)
+    assert cay.tim_kiem == 'mg-1 cay kim tien'
+    # created_at NULL được điền theo ngày nhập/xuất
+    assert db.session.execute(db.text('SELECT count(*) FROM nhapkho WHERE created_at IS NULL')).scalar() == 0
+    # Bảng dẫn xuất được tính từ lịch sử có sẵn
+    assert db.session.get(TonKhoNgay, (1, date(2026, 2, 10))).ton_cuoi == 3
+    assert db.session.get(GiaVonCay, 1).so_luong == 3
+    thang = db.session.get(BienDongThang, (1, date(2026, 2, 1)))
+    assert (thang.so_luong_nhap, thang.so_luong_xuat) == (5, 2)
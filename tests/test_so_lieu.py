@@ -0,0 +1,107 @@
+from datetime import date
+
+import pandas as pd
+
+from app import (BienDongThang, CayXanh, GiaVonCay, LoHang, TonKhoNgay, db, import_dataframe,
+                 ton_kho_theo_ngay, xay_dung_lai_so_lieu)
+
+
+def _so_lieu(cay_ids):
+    """Nội dung 3 bảng tổng hợp của các cây (bỏ id/updated_at, làm tròn số thực)"""
+    def tron(*gia_tri):
+        return tuple(round(v, 6) if isinstance(v, float) else v for v in gia_tri)
+
+    return {
+        'ton_kho_ngay': sorted(
+            tron(r.cay_xanh_id, r.ngay, r.ton_cuoi)
+            for r in TonKhoNgay.query.filter(TonKhoNgay.cay_xanh_id.in_(cay_ids))),
+        'gia_von_cay': sorted(
+            tron(r.cay_xanh_id, r.so_luong, r.gia_tri_binh_quan, r.gia_von_binh_quan, r.gia_tri_fifo, r.gia_von_fifo)
+            for r in GiaVonCay.query.filter(GiaVonCay.cay_xanh_id.in_(cay_ids))),
+        # Lô đã xuất hết chỉ còn là dòng 0 khi cập nhật dần, bản tính lại bỏ qua
+        'lo_hang': sorted(
+            tron(r.cay_xanh_id, r.ngay_nhap, r.don_gia, r.so_luong_con)
+            for r in LoHang.query.filter(LoHang.cay_xanh_id.in_(cay_ids), LoHang.so_luong_con > 1e-9)),
+        'bien_dong_thang': sorted(
+            tron(r.cay_xanh_id, r.thang, r.so_luong_nhap, r.so_luong_xuat, r.gia_tri_nhap)
+            for r in BienDongThang.query.filter(BienDongThang.cay_xanh_id.in_(cay_ids))),
+    }
+
+
+def _kiem_tra_khop_lich_su(cay_ids):
+    """Số liệu cập nhật dần phải trùng với bản tính lại toàn bộ từ lịch sử nhập/xuất"""
+    cap_nhat_dan = _so_lieu(cay_ids)
+    xay_dung_lai_so_lieu()
+    assert _so_lieu(cay_ids) == cap_nhat_dan
+    db.session.rollback()
+    return cap_nhat_dan
+
+
+def _id_cay(*ma_cay):
+    return [id_ for (id_,) in db.session.query(CayXanh.id).filter(CayXanh.ma_cay.in_(ma_cay))]
+
+
+def _ton_cuoi_hom_nay(ma_cay):
+    return {r.ma_cay: r.ton_kho for r in ton_kho_theo_ngay(date.today())}[ma_cay]
+
+
+def test_nhap_xuat_va_xoa_cay_khop_lich_su(client):
+    for ma_cay, so_luong, gia_nhap, ngay in [
+        ('SL-A', 10, 100, '2026-01-05'), ('SL-A', 5, 130, '2026-01-20'),
+        ('SL-B', 8, 50, '2026-02-01'), ('SL-C', 3, 70, '2026-02-03'),
+    ]:
+        ket_qua = client.post('/nhap-hang', json={
+            'ma_cay': ma_cay, 'loai_cay': ma_cay, 'so_luong': so_luong, 'gia_nhap': gia_nhap,
+            'phi_ship': 20, 'ngay_nhap': ngay}).get_json()
+        assert ket_qua['success']
+    assert client.post('/xuat-hang', json={
+        'ma_cay': 'SL-A', 'so_luong': 12, 'ngay_xuat': '2026-02-10'}).get_json()['success']
+    assert client.post('/api/nhap-hang/batch', json={'ngay_nhap': '2026-03-01', 'lines': [
+        {'ma_cay': 'SL-B', 'so_luong': 4, 'gia_nhap': 60}, {'ma_cay': 'SL-D', 'loai_cay': 'SL-D', 'so_luong': 6, 'gia_nhap': 10},
+    ]}).get_json()['success']
+    assert client.post('/api/xuat-hang/batch', json={'ngay_xuat': '2026-03-15', 'lines': [
+        {'ma_cay': 'SL-B', 'so_luong': 9}, {'ma_cay': 'SL-D', 'so_luong': 6},
+    ]}).get_json()['success']
+
+    cay_ids = _id_cay('SL-A', 'SL-B', 'SL-C', 'SL-D')
+    so_lieu = _kiem_tra_khop_lich_su(cay_ids)
+    assert all(so_lieu.values())
+    assert _ton_cuoi_hom_nay('SL-A') == 3 and _ton_cuoi_hom_nay('SL-D') == 0
+
+    id_c = _id_cay('SL-C')
+    assert any(_so_lieu(id_c).values())
+    assert client.post('/cay/SL-C/xoa', json={}).get_json()['success']
+    _kiem_tra_khop_lich_su(cay_ids)
+    assert not any(_so_lieu(id_c).values())
+
+
+def test_import_excel_tinh_lai_va_khop_ton_kho(client):
+    assert client.post('/nhap-hang', json={
+        'ma_cay': 'SLX-A', 'loai_cay': 'SLX-A', 'so_luong': 10, 'gia_nhap': 100,
+        'ngay_nhap': '2026-04-01'}).get_json()['success']
+
+    # Phiếu lùi ngày cho SLX-A, ghi đè tồn kho SLX-B (giá 0: không có phiếu nhập), cây mới SLX-C
+    df = pd.DataFrame({
+        'Tên hàng': ['SLX-A', 'SLX-B', 'SLX-C'],
+        'Số lượng': [4, 7, 5],
+        'Giá tiền': [80, 0, 30],
+        'Ngày': ['2026-03-01', '2026-03-02', '2026-03-03'],
+    })
+    assert import_dataframe(df) == (2, 2)
+    db.session.commit()
+
+    cay_ids = _id_cay('SLX-A', 'SLX-B', 'SLX-C')
+    _kiem_tra_khop_lich_su(cay_ids)
+    # Tồn cuối trong ton_kho_ngay khớp với tồn kho đã ghi đè
+    for ma_cay, ton_kho in db.session.query(CayXanh.ma_cay, CayXanh.ton_kho).filter(CayXanh.id.in_(cay_ids)):
+        assert _ton_cuoi_hom_nay(ma_cay) == ton_kho
+    assert (_ton_cuoi_hom_nay('SLX-A'), _ton_cuoi_hom_nay('SLX-B')) == (4, 7)
+    # Phiếu 2026-03-01 tính trước phiếu 2026-04-01 trong FIFO
+    lo_a = LoHang.query.filter_by(cay_xanh_id=_id_cay('SLX-A')[0]).order_by(LoHang.ngay_nhap)
+    assert [(l.ngay_nhap, l.don_gia) for l in lo_a] == [(date(2026, 3, 1), 80), (date(2026, 4, 1), 100)]
+
+    # Nhập/xuất sau import vẫn cập nhật dần đúng
+    assert client.post('/xuat-hang', json={
+        'ma_cay': 'SLX-B', 'so_luong': 2, 'ngay_xuat': date.today().isoformat()}).get_json()['success']
+    _kiem_tra_khop_lich_su(cay_ids)
+    assert _ton_cuoi_hom_nay('SLX-B') == 5
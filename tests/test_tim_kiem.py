@@ -0,0 +1,56 @@
+import pytest
+from sqlalchemy import event
+
+from app import CayXanh, _co_bang_fts, db, loc_tim_kiem
+
+
+@pytest.fixture(scope='module')
+def cay_tim_kiem(app):
+    for ma_cay, loai_cay in [('QZ-1', 'Cây Kim Tiền'), ('QZ-2', 'Cây Đa Búp Đỏ'),
+                             ('QZ-3', 'Cây Lan Ý'), ('QZ-4', 'Cây An Nhiên')]:
+        db.session.add(CayXanh(ma_cay=ma_cay, loai_cay=loai_cay, ton_kho=1))
+    db.session.commit()
+
+
+def _tim(search):
+    """Mã cây khớp từ khóa (chỉ trong cây của test này) và các câu SQL đã chạy"""
+    cac_cau = []
+
+    def ghi_lai(conn, cursor, statement, parameters, context, executemany):
+        cac_cau.append(statement)
+
+    query = loc_tim_kiem(CayXanh.query.filter(CayXanh.ma_cay.startswith('QZ-')), search)
+    event.listen(db.engine, 'before_cursor_execute', ghi_lai)
+    try:
+        ma_cay = [c.ma_cay for c in query]
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', ghi_lai)
+    return ma_cay, ' '.join(cac_cau)
+
+
+@pytest.mark.parametrize('search', ['kim tien', 'KIM TIỀN', 'Kim Tiền', 'tiền', 'cay kim'])
+def test_tim_khong_phan_biet_dau(cay_tim_kiem, search):
+    assert _co_bang_fts()
+    ma_cay, sql = _tim(search)
+    assert ma_cay == ['QZ-1']
+    assert 'cayxanh_fts' in sql
+
+
+@pytest.mark.parametrize('search, ket_qua', [
+    ('đa', ['QZ-2']), ('DA', ['QZ-2']), ('đ', ['QZ-2']), ('Đỏ', ['QZ-2']),
+    # Khớp đầu từ ("an nhien") xếp trước khớp giữa từ ("lan y")
+    ('an', ['QZ-4', 'QZ-3']),
+])
+def test_tu_khoa_ngan_hon_3_ky_tu_dung_like(cay_tim_kiem, search, ket_qua):
+    ma_cay, sql = _tim(search)
+    assert ma_cay == ket_qua
+    assert 'cayxanh_fts' not in sql and 'LIKE' in sql
+
+
+def test_tu_khoa_rong_khong_loc(cay_tim_kiem):
+    assert sorted(_tim('  ')[0]) == ['QZ-1', 'QZ-2', 'QZ-3', 'QZ-4']
+
+
+def test_trang_ton_kho_tim_khong_dau(client, cay_tim_kiem):
+    html = client.get('/ton-kho', query_string={'search': 'kim tien'}).get_data(as_text=True)
+    assert 'QZ-1' in html and 'QZ-2' not in html
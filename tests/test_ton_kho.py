@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from app import CayXanh, app as flask_app, db, tru_ton_kho
+
+
+def _tao_cay(ma_cay, ton_kho):
+    cay = CayXanh(ma_cay=ma_cay, loai_cay='Ổi', ton_kho=ton_kho)
+    db.session.add(cay)
+    db.session.commit()
+    return cay.id
+
+
+def _ton_kho(cay_id):
+    db.session.expire_all()
+    return db.session.get(CayXanh, cay_id).ton_kho
+
+
+def test_hai_session_cung_tru_khong_am_kho(app):
+    cay_id = _tao_cay('TK-SONG-SONG', 5)
+    ket_qua_khac = []
+
+    def session_khac():
+        # App context mới => session (kết nối) riêng, giống 1 request khác
+        with flask_app.app_context():
+            ket_qua_khac.append(tru_ton_kho(cay_id, 4))
+            db.session.commit()
+
+    # Session này trừ trước và chưa commit; session kia phải chờ rồi thấy tồn kho mới
+    assert tru_ton_kho(cay_id, 4) == 1
+    khac = threading.Thread(target=session_khac)
+    khac.start()
+    time.sleep(0.2)
+    db.session.commit()
+    khac.join(timeout=10)
+
+    assert ket_qua_khac == [None]
+    assert _ton_kho(cay_id) == 1
+
+
+@pytest.mark.parametrize('co_returning', [True, False])
+def test_tru_ton_kho_khong_du_tra_ve_none(app, monkeypatch, co_returning):
+    monkeypatch.setattr(db.engine.dialect, 'update_returning', co_returning)
+    cay_id = _tao_cay(f'TK-THIEU-{co_returning}', 3)
+
+    assert tru_ton_kho(cay_id, 5) is None
+    assert tru_ton_kho(cay_id, 3) == 0
+    db.session.commit()
+    assert _ton_kho(cay_id) == 0
+
+
+def test_xuat_hang_khong_du_bao_loi(client):
+    cay_id = _tao_cay('TK-ROUTE', 2)
+
+    ket_qua = client.post('/xuat-hang', json={
+        'ma_cay': 'TK-ROUTE', 'so_luong': 3, 'ngay_xuat': '2026-04-01'}).get_json()
+
+    assert not ket_qua['success']
+    assert 'Tồn kho không đủ! Hiện có: 2' in ket_qua['message']
+    assert _ton_kho(cay_id) == 2
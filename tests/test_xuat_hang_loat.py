@@ -0,0 +1,109 @@
+import sqlite3
+
+from sqlalchemy import event
+
+from app import CayXanh, XuatKho, db, xuat_hang_loat
+
+
+def _tao_cay(ma_cay, ton_kho):
+    db.session.add(CayXanh(ma_cay=ma_cay, loai_cay='Cam', ton_kho=ton_kho))
+    db.session.commit()
+
+
+def _dat_ton_kho(ma_cay, ton_kho):
+    """Request khác đổi tồn kho và commit (kết nối riêng)"""
+    def lam_gi(conn):
+        with db.engine.begin() as khac:
+            khac.execute(CayXanh.__table__.update().where(CayXanh.ma_cay == ma_cay).values(ton_kho=ton_kho))
+    return lam_gi
+
+
+def _dat_ton_kho_cung_ket_noi(ma_cay, ton_kho):
+    """Đổi tồn kho trên kết nối đang chạy lô (SQLite không cho kết nối khác ghi khi lô đang giữ khóa ghi)"""
+    def lam_gi(conn):
+        conn.exec_driver_sql('UPDATE cayxanh SET ton_kho = ? WHERE ma_cay = ?', (ton_kho, ma_cay))
+    return lam_gi
+
+
+def _song_song(*cac_buoc):
+    """Giả lập request chạy song song: mỗi bước (tiền tố SQL, việc) chạy 1 lần
+    ngay trước câu lệnh tiếp theo khớp tiền tố"""
+    con_lai = list(cac_buoc)
+
+    def truoc_execute(conn, cursor, statement, parameters, context, executemany):
+        if con_lai and statement.startswith(con_lai[0][0]):
+            con_lai.pop(0)[1](conn)
+
+    event.listen(db.engine, 'before_cursor_execute', truoc_execute)
+    return lambda: event.remove(db.engine, 'before_cursor_execute', truoc_execute)
+
+
+def test_xuat_hang_loat_tranh_chap_danh_dau_dong_thieu(app):
+    _tao_cay('XL-A', 5)
+    _tao_cay('XL-B', 5)
+    go = _song_song(('UPDATE cayxanh', _dat_ton_kho('XL-A', 2)))
+    try:
+        thanh_cong, ket_qua = xuat_hang_loat([
+            {'ma_cay': 'XL-A', 'so_luong': 4},
+            {'ma_cay': 'XL-B', 'so_luong': 1},
+        ])
+    finally:
+        go()
+    db.session.rollback()
+
+    assert not thanh_cong
+    assert [dong['success'] for dong in ket_qua] == [False, True]
+    assert 'Hiện có: 2' in ket_qua[0]['message']
+    assert CayXanh.query.filter_by(ma_cay='XL-B').one().ton_kho == 5
+    assert XuatKho.query.join(CayXanh).filter(CayXanh.ma_cay.in_(['XL-A', 'XL-B'])).count() == 0
+
+
+def test_xuat_hang_loat_tranh_chap_giu_viec_khac_trong_session(app):
+    _tao_cay('XL-D', 5)
+    # Việc khác của caller trong cùng session, chưa commit
+    db.session.add(CayXanh(ma_cay='XL-KHAC', loai_cay='Cam', ton_kho=1))
+    # Session đã ghi (flush) nên đang giữ khóa ghi SQLite: đổi tồn kho trên cùng kết nối, trước savepoint
+    go = _song_song(('SAVEPOINT', _dat_ton_kho_cung_ket_noi('XL-D', 0)))
+    try:
+        thanh_cong, _ = xuat_hang_loat([{'ma_cay': 'XL-D', 'so_luong': 2}])
+    finally:
+        go()
+    db.session.commit()
+
+    assert not thanh_cong
+    assert CayXanh.query.filter_by(ma_cay='XL-KHAC').count() == 1
+    assert CayXanh.query.filter_by(ma_cay='XL-D').one().ton_kho == 0
+
+
+def test_xuat_hang_loat_tranh_chap_van_du_thi_thu_lai(app):
+    _tao_cay('XL-C', 10)
+    # Tồn kho bị trừ ngay trước UPDATE rồi được nhập bù trước lần kiểm tra lại => lần thử lại thành công
+    go = _song_song(('UPDATE cayxanh', _dat_ton_kho('XL-C', 1)), ('SELECT', _dat_ton_kho_cung_ket_noi('XL-C', 8)))
+    try:
+        thanh_cong, ket_qua = xuat_hang_loat([{'ma_cay': 'XL-C', 'so_luong': 3}])
+        db.session.commit()
+    finally:
+        go()
+
+    assert thanh_cong and ket_qua[0]['success']
+    db.session.expire_all()
+    cay = CayXanh.query.filter_by(ma_cay='XL-C').one()
+    assert cay.ton_kho == 5
+    assert XuatKho.query.filter_by(cay_xanh_id=cay.id).count() == 1
+
+
+def test_xuat_hang_loat_nhieu_cay_khong_vuot_999_tham_so(app):
+    for i in range(300):
+        db.session.add(CayXanh(ma_cay=f'XL-N{i}', loai_cay='Cam', ton_kho=2))
+    db.session.commit()
+
+    ket_noi = db.session.connection().connection.driver_connection
+    gioi_han_cu = ket_noi.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    try:
+        thanh_cong, _ = xuat_hang_loat([{'ma_cay': f'XL-N{i}', 'so_luong': 1} for i in range(300)])
+        db.session.commit()
+    finally:
+        ket_noi.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, gioi_han_cu)
+
+    assert thanh_cong
+    assert {cay.ton_kho for cay in CayXanh.query.filter(CayXanh.ma_cay.like('XL-N%'))} == {1}